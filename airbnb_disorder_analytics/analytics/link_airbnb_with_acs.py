@@ -1,7 +1,14 @@
 """
 link_airbnb_with_acs.py
 
-this program get the ACS5 characteristics of the neighborhood to which each of the airbnb listings belongs
+this program get the ACS5 characteristics of the neighborhood to which each of the airbnb listings belongs,
+either listing by listing or for all the geolocated listings of a state or an MSA at once
+(get_acs5_features_for_listings)
+
+the per-neighborhood lookups go through an ACSFeatureCache: many listings share a census tract,
+so only the first lookup of a neighborhood queries acs5; the cache can be filled for many neighborhoods with
+one query (prefetch_census_tracts, prefetch_census_block_groups) and saved to disk for the next session;
+a saved cache is only reused for the same ACS5 year and the same state of the acs5 tables (see get_acs5_build_stamp)
 
 includes test case for:
     - the Airbnb2ACS class
@@ -13,26 +20,156 @@ ruilin
 # system import
 import os
 import sys
+import pickle
+import threading
+from collections import OrderedDict
 import pandas as pd
 from tqdm import tqdm
 # third-party import
 import psycopg2
 # local import
 from airbnb_disorder_analytics.config.db_config import DBInfo
+from airbnb_disorder_analytics.config.us_states import USStates
+
+__all__ = ['Airbnb2ACS', 'ACSFeatureCache']
+
+
+class ACSFeatureCache:
+    """
+    bounded in-process cache of the ACS5 variables of neighborhoods, with least-recently-used eviction
+    keys are (geography, neighborhood_id), e.g. ('tract', '36061000100'); values are lists of
+    (variable_id, estimate, margin_of_error)
+    """
+    def __init__(self, max_size=100000, cache_path=None, year=None, build_stamp=None):
+        """
+        :param max_size: int -> max number of neighborhoods kept; the least recently used one is evicted first
+        :param cache_path: str -> pickle file the cache is loaded from (if it exists) and saved to; None to keep
+                            the cache in memory only
+        :param year: int -> the ACS5 year of the cached values (None for any year)
+        :param build_stamp: identifies the state of the acs5 tables the values are read from;
+                            a saved cache with another year or build_stamp is ignored
+        """
+        self.max_size = max_size
+        self.cache_path = cache_path
+        self.year = year
+        self.build_stamp = build_stamp
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if cache_path is not None and os.path.isfile(cache_path):
+            with open(cache_path, 'rb') as file:
+                saved = pickle.load(file)
+            if isinstance(saved, dict) and saved.get('year') == year and saved.get('build_stamp') == build_stamp:
+                for key, value in saved['entries']:
+                    self.put(key, value)
+
+    def get(self, key):
+        """
+        :return: the cached value, or None if the key is not cached
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_missing_keys(self, keys):
+        """
+        :return: a list of the keys that are not cached, without counting them as lookups
+        """
+        with self.lock:
+            return [key for key in keys if key not in self.entries]
+
+    def save(self):
+        """
+        save the cache to cache_path, from the least to the most recently used entry
+        """
+        if self.cache_path is None:
+            return
+        with self.lock:
+            entries = list(self.entries.items())
+        # written to a file of this process and moved into place, so that no one reads a partial cache
+        temp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as file:
+            pickle.dump({'year': self.year, 'build_stamp': self.build_stamp, 'entries': entries}, file)
+        os.replace(temp_path, self.cache_path)
+
+    def get_stats(self):
+        """
+        :return: a dictionary with the number of hits, misses, evictions and cached neighborhoods, and the hit rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'size': len(self.entries)
+        }
 
-__all__ = ['Airbnb2ACS']
 
 class Airbnb2ACS:
     """
     get the ACS5 characteristics of the neighborhood to which each of the airbnb listings belongs
     """
-    def __init__(self):
+    def __init__(self, cache_size=100000, cache_path=None, year=None):
+        """
+        :param cache_size: int -> max number of neighborhoods kept by the feature cache
+        :param cache_path: str -> where the feature cache is persisted; in memory only if None
+        :param year: int -> the ACS5 year of the per-neighborhood lookups; any year if None
+        """
         # psql connection to the airbnb database
         self.airbnb_connection = psycopg2.connect(DBInfo.airbnb_config)
         self.airbnb_cursor = self.airbnb_connection.cursor()
         # psql connection to the acs5 database
-        self.acs_connection = psycopg2.connect(DBInfo.acs_config)
+        self.acs_connection = psycopg2.connect(DBInfo.acs5_config)
         self.acs_cursor = self.acs_connection.cursor()
+        self.uss = USStates()
+        self.year = year
+        self.feature_cache = ACSFeatureCache(cache_size, cache_path, year,
+                                             self.get_acs5_build_stamp() if cache_path is not None else None)
+
+    def get_acs5_build_stamp(self):
+        """
+        the number of loads of variable_by_tract and variable_by_block, which the ACS loader (psql.build_acs_database)
+        records in variable_load in the same transaction as the rows: it changes whenever the variables are
+        (re-)ingested, which invalidates a saved feature cache
+
+        :return: a tuple of (table_name, number of loads); empty if no load has been recorded yet
+        """
+        self.acs_cursor.execute("""SELECT to_regclass('variable_load');""")
+        if self.acs_cursor.fetchone()[0] is None:
+            return ()
+        query = """SELECT table_name, count(*)
+                    FROM variable_load
+                    WHERE table_name IN ('variable_by_tract', 'variable_by_block')
+                    GROUP BY table_name
+                    ORDER BY table_name
+                    ;
+                    """
+        self.acs_cursor.execute(query)
+        return tuple(self.acs_cursor.fetchall())
+
+    def _get_year_clause(self, table=None):
+        """
+        :return: the condition on the ACS5 year of the per-neighborhood lookups, and its parameters
+        """
+        if self.year is None:
+            return '', []
+        column = f'{table}.year' if table is not None else 'year'
+        return f'AND {column} = %s', [self.year]
 
     def get_one_airbnb_listing(self):
         """
@@ -50,38 +187,238 @@ class Airbnb2ACS:
         print('one airbnb listing:', result)
         return result
 
-    def get_acs5_features_by_census_tract(self, census_tract_id):
+    def get_acs5_features_by_census_tract(self, census_tract_id, verbose=True):
         """
         :param census_tract_id : 11-digit str
+        :param verbose: boolean -> whether to print the values
         :return: values of ACS5 variables for this census tract
         """
-        query = """SELECT variable_id, estimate, margin_of_error
-                    FROM variable_by_tract
-                    WHERE census_tract_id = %s
-                    ;
-                    """
-        self.acs_cursor.execute(query, (census_tract_id,))
-        results = self.acs_cursor.fetchall()
-        print(results)
+        results = self.feature_cache.get(('tract', census_tract_id))
+        if results is None:
+            year_clause, year_params = self._get_year_clause()
+            query = """SELECT variable_id, estimate, margin_of_error
+                        FROM variable_by_tract
+                        WHERE census_tract_id = %s
+                        {}
+                        ;
+                        """.format(year_clause)
+            self.acs_cursor.execute(query, [census_tract_id] + year_params)
+            results = self.acs_cursor.fetchall()
+            self.feature_cache.put(('tract', census_tract_id), results)
+        if verbose:
+            print(results)
         return results
 
-    def get_acs5_features_by_census_block(self, census_block_group_id):
+    def get_acs5_features_by_census_block(self, census_block_group_id, verbose=True):
         """
 
         :param census_block_group_id: 12-digit str
+        :param verbose: boolean -> whether to print the values
         :return: values of ACS5 variables for this census block group
         """
         census_tract_id = census_block_group_id[:11]
         census_block_group = census_block_group_id[11]
-        query = """SELECT variable_id, estimate, margin_of_error
-                    FROM variable_by_block
-                    WHERE census_tract_id = %s
-                    AND census_block_group = %s
-                    ;
+        results = self.feature_cache.get(('block_group', census_tract_id + census_block_group))
+        if results is None:
+            year_clause, year_params = self._get_year_clause()
+            query = """SELECT variable_id, estimate, margin_of_error
+                        FROM variable_by_block
+                        WHERE census_tract_id = %s
+                        AND census_block_group = %s
+                        {}
+                        ;
+                        """.format(year_clause)
+            self.acs_cursor.execute(query, [census_tract_id, census_block_group] + year_params)
+            results = self.acs_cursor.fetchall()
+            self.feature_cache.put(('block_group', census_tract_id + census_block_group), results)
+        if verbose:
+            print(results)
+        return results
+
+    def _prefetch(self, geography, neighborhood_ids):
+        """
+        fill the feature cache for all the neighborhoods that are not cached yet, with a single query
+
+        :param geography: str -> 'tract' or 'block_group'
+        :param neighborhood_ids: a list of census_tract_ids or census_block_group_ids
+        :return: int -> number of neighborhoods fetched
+        """
+        missing_ids = [key[1] for key in self.feature_cache.get_missing_keys(
+            [(geography, neighborhood_id) for neighborhood_id in set(neighborhood_ids)])]
+        if not missing_ids:
+            return 0
+        if geography == 'tract':
+            year_clause, year_params = self._get_year_clause()
+            query = """SELECT census_tract_id, variable_id, estimate, margin_of_error
+                        FROM variable_by_tract
+                        WHERE census_tract_id = ANY(%s)
+                        {}
+                        ;
+                        """.format(year_clause)
+            params = [missing_ids] + year_params
+        else:
+            # joined on both columns of the key of variable_by_block, so that its index can be used
+            year_clause, year_params = self._get_year_clause('variable_by_block')
+            query = """SELECT variable_by_block.census_tract_id || variable_by_block.census_block_group,
+                                variable_id, estimate, margin_of_error
+                        FROM variable_by_block
+                        JOIN unnest(%s::text[], %s::text[]) AS neighborhood (census_tract_id, census_block_group)
+                        ON variable_by_block.census_tract_id = neighborhood.census_tract_id
+                        AND variable_by_block.census_block_group = neighborhood.census_block_group
+                        WHERE TRUE
+                        {}
+                        ;
+                        """.format(year_clause)
+            params = [[neighborhood_id[:11] for neighborhood_id in missing_ids],
+                      [neighborhood_id[11:12] for neighborhood_id in missing_ids]] + year_params
+        self.acs_cursor.execute(query, params)
+        results_by_id = {neighborhood_id: [] for neighborhood_id in missing_ids}
+        for neighborhood_id, variable_id, estimate, margin_of_error in self.acs_cursor.fetchall():
+            results_by_id[neighborhood_id].append((variable_id, estimate, margin_of_error))
+        for neighborhood_id, results in results_by_id.items():
+            self.feature_cache.put((geography, neighborhood_id), results)
+        return len(missing_ids)
+
+    def prefetch_census_tracts(self, list_of_census_tract_ids):
+        """
+        :param list_of_census_tract_ids: a list of 11-digit str
+        :return: int -> number of census tracts fetched from the database
+        """
+        return self._prefetch('tract', list_of_census_tract_ids)
+
+    def prefetch_census_block_groups(self, list_of_census_block_group_ids):
+        """
+        :param list_of_census_block_group_ids: a list of 12-digit str
+        :return: int -> number of census block groups fetched from the database
+        """
+        return self._prefetch('block_group', [census_block_group_id[:12]
+                                              for census_block_group_id in list_of_census_block_group_ids])
+
+    def get_geolocated_listings(self, state=None, msa=None, census_block=False):
+        """
+        :param state: str -> keep the listings of one state only, by abbreviation (NY) or full name (New York)
+        :param msa: str -> keep the listings of one metropolitan statistical area only, as stored in property.msa
+        :param census_block: boolean -> keep the listings geolocated to a census block only
+        :return: a pandas dataframe with the columns property_id, census_tract_id and census_block_group_id
+        """
+        query = """SELECT property_id, census_tract_id, census_block_id
+                    FROM property
+                    WHERE census_tract_id IS NOT NULL
                     """
-        self.acs_cursor.execute(query, (census_tract_id, census_block_group))
-        results = self.acs_cursor.fetchall()
-        print(results)
+        params = []
+        if census_block:
+            query += """AND census_block_id IS NOT NULL
+                    """
+        if state is not None:
+            query += """AND state = %s
+                    """
+            params.append(self.uss.abbr_to_name.get(state, state))
+        if msa is not None:
+            query += """AND msa = %s
+                    """
+            params.append(msa)
+        self.airbnb_cursor.execute(query + ';', params)
+        listing_df = pd.DataFrame(self.airbnb_cursor.fetchall(),
+                                  columns=['property_id', 'census_tract_id', 'census_block_id'])
+        # the census block group id is the first 12 digits of the census block id
+        listing_df['census_block_group_id'] = listing_df['census_block_id'].str[:12]
+        return listing_df.drop(columns='census_block_id')
+
+    def get_acs5_features_by_neighborhoods(self, list_of_variable_ids, neighborhood_ids, census_block=False,
+                                           year=None):
+        """
+        get the ACS5 variables of many census tracts or census block groups with a single query
+
+        :param list_of_variable_ids: a list of str
+        :param neighborhood_ids: a list of census_tract_ids (11-digit str) or census_block_group_ids (12-digit str)
+        :param census_block: boolean -> whether neighborhood_ids are census block groups
+        :param year: int -> the year of the ACS5 survey; any year if None
+        :return: a pandas dataframe in long format with the columns geoid, variable_id, estimate, margin_of_error
+                    and year
+        """
+        if census_block:
+            # joined on both columns of the key of variable_by_block, so that its index can be used
+            query = """SELECT variable_by_block.census_tract_id || variable_by_block.census_block_group,
+                                variable_id, estimate, margin_of_error, year
+                        FROM variable_by_block
+                        JOIN unnest(%s::text[], %s::text[]) AS neighborhood (census_tract_id, census_block_group)
+                        ON variable_by_block.census_tract_id = neighborhood.census_tract_id
+                        AND variable_by_block.census_block_group = neighborhood.census_block_group
+                        WHERE variable_id = ANY(%s)
+                        """
+            params = [[neighborhood_id[:11] for neighborhood_id in neighborhood_ids],
+                      [neighborhood_id[11:12] for neighborhood_id in neighborhood_ids], list(list_of_variable_ids)]
+        else:
+            query = """SELECT census_tract_id, variable_id, estimate, margin_of_error, year
+                        FROM variable_by_tract
+                        WHERE variable_id = ANY(%s)
+                        AND census_tract_id = ANY(%s)
+                        """
+            params = [list(list_of_variable_ids), list(neighborhood_ids)]
+        if year is not None:
+            query += """AND year = %s
+                        """
+            params.append(year)
+        self.acs_cursor.execute(query + ';', params)
+        return pd.DataFrame(self.acs_cursor.fetchall(), columns=['geoid', 'variable_id', 'estimate',
+                                                                 'margin_of_error', 'year'])
+
+    def get_acs5_features_for_listings(self, list_of_variable_ids, state=None, msa=None, census_block=False,
+                                       year=None, margins=False, feature_store=None):
+        """
+        attach the ACS5 variables of their neighborhood to all the geolocated listings at once:
+        the listings are read with one query, the variables of all their distinct neighborhoods with another
+        (or from an ACSFeatureStore), and the two are joined on the neighborhood id
+
+        :param list_of_variable_ids: a list of str
+        :param state: str -> see get_geolocated_listings()
+        :param msa: str -> see get_geolocated_listings()
+        :param census_block: boolean -> whether the neighborhood is defined as census block group
+        :param year: int -> the year of the ACS5 survey (required with feature_store); if None, each neighborhood
+                        gets the variables of the latest year the database has for it, and that year is added
+                        as the column year
+        :param margins: boolean -> whether to add the margins-of-error as {variable_id}_margin columns
+        :param feature_store: psql.acs_feature_store.ACSFeatureStore -> read the variables from the store
+                                instead of the database; it must be the store of year and of the geography
+                                set by census_block
+        :return: a pandas dataframe with one row per listing: property_id, census_tract_id,
+                    census_block_group_id, (year) and one column per variable
+        """
+        if feature_store is not None:
+            if year is None or feature_store.year != int(year):
+                raise ValueError(f'the feature store has the ACS5 variables of {feature_store.year}, not of {year}')
+            geography = 'block_group' if census_block else 'tract'
+            if feature_store.geography != geography:
+                raise ValueError(f'the feature store has {feature_store.geography} features, not {geography} features')
+        listing_df = self.get_geolocated_listings(state, msa, census_block)
+        key = 'census_block_group_id' if census_block else 'census_tract_id'
+        neighborhood_ids = listing_df[key].dropna().unique()
+        if feature_store is not None:
+            feature_df = feature_store.to_dataframe(neighborhood_ids, list_of_variable_ids)
+            if margins:
+                margin_df = feature_store.to_dataframe(neighborhood_ids, list_of_variable_ids, margins=True)
+                feature_df = feature_df.join(margin_df.add_suffix('_margin'))
+            feature_df = feature_df.astype(float)
+            feature_df.index = neighborhood_ids
+        else:
+            long_df = self.get_acs5_features_by_neighborhoods(list_of_variable_ids, neighborhood_ids,
+                                                              census_block, year)
+            if year is None:
+                # one survey per neighborhood, otherwise the pivot would have a row per year of the same key
+                latest_year = long_df.groupby('geoid')['year'].transform('max')
+                long_df = long_df[long_df['year'] == latest_year]
+            feature_df = long_df.pivot(index='geoid', columns='variable_id', values='estimate')
+            if margins:
+                margin_df = long_df.pivot(index='geoid', columns='variable_id', values='margin_of_error')
+                feature_df = feature_df.join(margin_df.add_suffix('_margin'))
+            # variables without any value in these neighborhoods still get their (empty) column
+            feature_df = feature_df.reindex(
+                columns=list(list_of_variable_ids) + ([f'{variable_id}_margin' for variable_id in list_of_variable_ids]
+                                                      if margins else []))
+            feature_df = feature_df.astype(float)
+            if year is None:
+                feature_df.insert(0, 'year', long_df.groupby('geoid')['year'].first().astype('Int64'))
+        return listing_df.merge(feature_df, left_on=key, right_index=True, how='left')
 
 if __name__ == '__main__':
     a2a = Airbnb2ACS()
@@ -90,4 +427,11 @@ if __name__ == '__main__':
     a2a.get_acs5_features_by_census_tract(census_tract_id)
     print('airbnb_by_census_block:', property_id)
     a2a.get_acs5_features_by_census_block(census_block_id)
+    listing_feature_df = a2a.get_acs5_features_for_listings(['B01003_1', 'B19013_1'], state='NY', year=2018)
+    print(listing_feature_df.describe())
+    a2a.prefetch_census_tracts(listing_feature_df['census_tract_id'])
+    for census_tract_id in listing_feature_df['census_tract_id']:
+        a2a.get_acs5_features_by_census_tract(census_tract_id, verbose=False)
+    print('feature cache:', a2a.feature_cache.get_stats())
+    a2a.feature_cache.save()
 
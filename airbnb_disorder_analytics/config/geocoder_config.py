@@ -0,0 +1,22 @@
+'''
+geocoder_config.py
+with information on which reverse-geocoding engine is used to find the census block of a point
+(longitude, latitude):
+    - 'census': the live census geocoder API, called through censusgeocode
+    - 'local': psql.local_geocoder.LocalGeocoder, which looks the point up in the census block polygons
+                stored on disk, and works offline
+
+ruilin chen
+10/19/2026
+'''
+
+__all__ = ['GeocoderInfo']
+
+
+class GeocoderInfo:
+    engine = 'census'  # 'census' or 'local'
+    # where the TIGER/Line census block shapefiles (tl_2010_{state_fips}_tabblock10.shp) are stored
+    block_shapefile_folder = '/home/rchen/Documents/github/airbnb_crime/data/census_block_shapefiles'
+    block_shapefile_base_url = 'https://www2.census.gov/geo/tiger/TIGER2010/TABBLOCK/2010'
+    # states whose census blocks are loaded by the local engine (fips codes); all available states if None
+    states = None
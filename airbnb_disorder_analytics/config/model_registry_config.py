@@ -0,0 +1,23 @@
+'''
+model_registry_config.py
+with information on where psql.model_registry stores the matching classifiers
+(the classifiers that decide whether a crime incident can take the census tract of its nearest geolocated point)
+and when a stored classifier is considered stale;
+the folder defaults to the psql package and can be overridden with the AIRBNB_MODEL_FOLDER environment variable
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import os
+
+__all__ = ['ModelRegistryInfo']
+
+
+class ModelRegistryInfo:
+    # folder with matching_classifier_{STATE}.pkl (legacy, version 0) and matching_classifier_{STATE}_v{N}.pkl
+    model_folder = os.environ.get('AIRBNB_MODEL_FOLDER',
+                                  os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'psql'))
+    model_prefix = 'matching_classifier'
+    # a classifier trained more than max_age_days ago is reported as stale when it is loaded
+    max_age_days = 365
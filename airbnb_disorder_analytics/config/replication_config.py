@@ -0,0 +1,23 @@
+'''
+replication_config.py
+with information on the reference tables that are shared across the databases (airbnb_data, acs5, crime_data)
+and that are replicated from their source database into the others by psql.replicate_tables
+
+ruilin chen
+10/19/2026
+'''
+
+__all__ = ['ReferenceTableInfo']
+
+
+class ReferenceTableInfo:
+    tables = ['census_tracts']
+    census_tracts = {
+        'table': 'census_tracts',
+        'primary_keys': ['census_tract_id'],
+        'columns': ['census_tract_id', 'census_tract_code', 'state_id', 'county_id',
+                    'county_name', 'state_abbr', 'state'
+                    ],  # a list of all the columns to be copied, in the same sequence in both databases
+        'source': 'acs5',  # the database where the table is built (by build_acs_database.CensusBlock2Tract)
+        'targets': ['crime_data']  # the databases that keep a copy of the table
+    }
@@ -0,0 +1,211 @@
+'''
+acs_feature_store.py
+
+this script keeps a wide, columnar copy of the ACS 5-year variables stored in acs5
+(variable_by_tract and variable_by_block are long: one row per variable and neighborhood)
+so that the features of any set of neighborhoods can be read without querying the database.
+
+the store of a year and a geography (census tract or census block group) is a folder of numpy files:
+    - geoids.npy: the GEOIDs as int64, sorted (11 digits for census tracts, 12 for census block groups)
+    - estimates.npy and margins.npy: float64 matrices with one row per GEOID and one column per variable,
+                                        NaN where a value is missing
+    - variables.json: the variable_ids of the columns
+the matrices are memory-mapped when the store is opened, so only the rows that are read are loaded.
+get_features copies the rows it is asked for; the neighborhoods that share a GEOID prefix (a state, a county,
+a census tract) can be read without any copy with get_slice_by_prefix.
+
+Dependencies:
+    - third-party packages: psycopg2
+    - local packages: config.db_config
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import os
+import io
+import json
+import shutil
+import numpy as np
+import pandas as pd
+# third-party import
+import psycopg2
+# local import
+from airbnb_disorder_analytics.config.db_config import DBInfo
+
+__all__ = ['ACSFeatureStore']
+
+
+class ACSFeatureStore:
+    """
+    wide, memory-mapped ACS 5-year features of census tracts or census block groups, keyed by int64 GEOIDs
+    """
+    def __init__(self, store_folder, year, geography='tract'):
+        """
+        :param store_folder: str -> folder that keeps the stores of all the years and geographies
+        :param year: int
+        :param geography: str -> 'tract' for census tracts, 'block_group' for census block groups
+        """
+        if geography not in ('tract', 'block_group'):
+            raise ValueError(f'unknown geography: {geography}')
+        self.year = int(year)
+        self.geography = geography
+        self.folder = os.path.join(store_folder, f'acs5_{self.year}_{self.geography}')
+        self.geoids = None
+        self.estimates = None
+        self.margins = None
+        self.variable_ids = None
+        self.column_by_variable_id = {}
+
+    def is_built(self):
+        """
+        :return: boolean -> whether the store has been built; a store is only ever in place once complete
+        """
+        return os.path.isfile(os.path.join(self.folder, 'variables.json'))
+
+    def build(self, acs_connection, list_of_variable_ids=None, verbose=True):
+        """
+        pivot the long table of the geography into the wide store, with one COPY from the database
+
+        :param acs_connection: psycopg2 connection to acs5
+        :param list_of_variable_ids: a list of str -> the variables to keep; all the variables of the year if None
+        :param verbose: boolean -> whether to print outputs as the program runs
+        :return: None
+        """
+        if self.geography == 'tract':
+            query = """COPY (SELECT variable_id, census_tract_id AS geoid, estimate, margin_of_error
+                                FROM variable_by_tract
+                                WHERE year = {}
+                                ) TO STDOUT WITH (FORMAT csv, HEADER)
+                                """.format(self.year)
+        else:
+            query = """COPY (SELECT variable_id, census_tract_id || census_block_group AS geoid,
+                                    estimate, margin_of_error
+                                FROM variable_by_block
+                                WHERE year = {}
+                                ) TO STDOUT WITH (FORMAT csv, HEADER)
+                                """.format(self.year)
+        buffer = io.StringIO()
+        acs_connection.cursor().copy_expert(query, buffer)
+        acs_connection.commit()
+        buffer.seek(0)
+        long_df = pd.read_csv(buffer, dtype={'variable_id': str, 'geoid': np.int64,
+                                             'estimate': np.float64, 'margin_of_error': np.float64})
+        if list_of_variable_ids is not None:
+            long_df = long_df[long_df['variable_id'].isin(list_of_variable_ids)]
+        estimate_df = long_df.pivot(index='geoid', columns='variable_id', values='estimate').sort_index()
+        margin_df = long_df.pivot(index='geoid', columns='variable_id', values='margin_of_error')
+        margin_df = margin_df.reindex(index=estimate_df.index, columns=estimate_df.columns)
+        # the store is written into a folder of this process and swapped in once complete, so that
+        # a crash or a concurrent reader never sees a mix of old and new files
+        temp_folder = f'{self.folder}.{os.getpid()}.tmp'
+        old_folder = f'{self.folder}.{os.getpid()}.old'
+        for folder in [temp_folder, old_folder]:
+            shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(temp_folder)
+        np.save(os.path.join(temp_folder, 'geoids.npy'), estimate_df.index.values.astype(np.int64))
+        np.save(os.path.join(temp_folder, 'estimates.npy'), estimate_df.values.astype(np.float64))
+        np.save(os.path.join(temp_folder, 'margins.npy'), margin_df.values.astype(np.float64))
+        with open(os.path.join(temp_folder, 'variables.json'), 'w') as file:
+            json.dump(list(estimate_df.columns), file)
+        if os.path.isdir(self.folder):
+            os.rename(self.folder, old_folder)
+        os.rename(temp_folder, self.folder)
+        # readers that memory-mapped the old files keep them until they are closed
+        shutil.rmtree(old_folder, ignore_errors=True)
+        self.geoids = None  # reopen the new files on next use
+        if verbose:
+            print('built ACS feature store', self.folder, '\t shape:', estimate_df.shape)
+
+    def open(self):
+        """
+        memory-map the store; called on first use
+        """
+        self.geoids = np.load(os.path.join(self.folder, 'geoids.npy'))
+        self.estimates = np.load(os.path.join(self.folder, 'estimates.npy'), mmap_mode='r')
+        self.margins = np.load(os.path.join(self.folder, 'margins.npy'), mmap_mode='r')
+        with open(os.path.join(self.folder, 'variables.json')) as file:
+            self.variable_ids = json.load(file)
+        self.column_by_variable_id = {variable_id: index for index, variable_id in enumerate(self.variable_ids)}
+
+    def _ensure_open(self):
+        if self.geoids is None:
+            self.open()
+
+    def get_columns(self, list_of_variable_ids=None):
+        """
+        :param list_of_variable_ids: a list of str; all the variables if None
+        :return: a list of int -> the columns of these variables
+        """
+        self._ensure_open()
+        if list_of_variable_ids is None:
+            return list(range(len(self.variable_ids)))
+        return [self.column_by_variable_id[variable_id] for variable_id in list_of_variable_ids]
+
+    def get_rows(self, geoids):
+        """
+        :param geoids: a list or array of GEOIDs, as str or int
+        :return: numpy array of int -> the row of every GEOID, -1 if it is not in the store or is not a number
+                    (e.g. None or NaN)
+        """
+        self._ensure_open()
+        numeric_geoids = pd.to_numeric(pd.Series(geoids, dtype=object), errors='coerce')
+        is_valid = numeric_geoids.notnull().to_numpy()
+        if not len(self.geoids):
+            return np.full(len(is_valid), -1, dtype=np.int64)
+        geoids = numeric_geoids.fillna(-1).to_numpy().astype(np.int64)
+        rows = np.minimum(np.searchsorted(self.geoids, geoids), len(self.geoids) - 1)
+        return np.where(is_valid & (self.geoids[rows] == geoids), rows, -1)
+
+    def get_features(self, geoids, list_of_variable_ids=None, margins=False):
+        """
+        get the features of many neighborhoods at once, as a copy of their rows
+
+        :param geoids: a list or array of GEOIDs, as str or int
+        :param list_of_variable_ids: a list of str -> the columns to return; all the variables if None
+        :param margins: boolean -> return the margins-of-error instead of the estimates
+        :return: numpy array of shape (number of geoids, number of variables); NaN for unknown GEOIDs
+        """
+        columns = self.get_columns(list_of_variable_ids)
+        rows = self.get_rows(geoids)
+        matrix = self.margins if margins else self.estimates
+        if not len(matrix):  # an empty store: every GEOID is unknown
+            return np.full((len(rows), len(columns)), np.nan)
+        features = matrix[np.ix_(np.maximum(rows, 0), columns)]
+        features[rows < 0] = np.nan
+        return features
+
+    def get_slice_by_prefix(self, prefix, margins=False):
+        """
+        get the features of all the neighborhoods whose GEOID starts with prefix, without copying them:
+        e.g. '36061' for all the census tracts of New York County
+
+        :param prefix: str -> the first digits of the GEOIDs
+        :param margins: boolean -> return the margins-of-error instead of the estimates
+        :return: geoids, features: a numpy array of GEOIDs and a memory-mapped view of their rows
+        """
+        self._ensure_open()
+        number_of_digits = 11 if self.geography == 'tract' else 12
+        padding = 10 ** (number_of_digits - len(prefix))
+        start, end = np.searchsorted(self.geoids, [int(prefix) * padding, (int(prefix) + 1) * padding])
+        matrix = self.margins if margins else self.estimates
+        return self.geoids[start:end], matrix[start:end]
+
+    def to_dataframe(self, geoids, list_of_variable_ids=None, margins=False):
+        """
+        :return: a pandas dataframe indexed by GEOID with one column per variable, see get_features()
+        """
+        columns = self.get_columns(list_of_variable_ids)
+        return pd.DataFrame(self.get_features(geoids, list_of_variable_ids, margins),
+                            index=pd.Index(geoids, name='geoid'),
+                            columns=[self.variable_ids[column] for column in columns])
+
+
+if __name__ == '__main__':
+    acs5_connection = psycopg2.connect(DBInfo.acs5_config)
+    store_folder = '/home/rchen/Documents/github/airbnb_crime/airbnb_disorder_analytics/psql/acs5_data/feature_store'
+    for geography in ['tract', 'block_group']:
+        ACSFeatureStore(store_folder, 2018, geography).build(acs5_connection)
+    acs5_connection.close()
+    geoids, features = ACSFeatureStore(store_folder, 2018).get_slice_by_prefix('36061')
+    print(len(geoids), 'census tracts in New York County; features:', features.shape)
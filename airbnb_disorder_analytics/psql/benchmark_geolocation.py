@@ -0,0 +1,188 @@
+'''
+benchmark_geolocation.py
+
+this script measures how fast and how accurately the different geolocation engines find the census tracts
+of points whose census tract is already known, so that the engine and the matching threshold can be
+chosen per state on data rather than by hand.
+
+for every state, a random sample of the points geolocated by the census API is held out from CrimeDB's index
+of geolocated points (see CrimeDB.hold_out_geolocated_points) and replayed through:
+    - matcher: CrimeDB's matching classifier (the path taken by CrimeDB.geolocate_point) at its own threshold
+                and at every threshold in the sweep; the points it doesn't match would go to the census API
+    - nearest: always take the census tract of the nearest geolocated point
+    - local_geocoder: psql.local_geocoder.LocalGeocoder, if the census block shapefiles are available
+    - census_api: the live census geocoder, on a small sample only since it is rate-limited
+
+each row of the report has the points geolocated per second, the share of points matched without the census API
+(match_rate), the tract-level accuracy of those matches, the overall accuracy once the rest is sent to the API,
+and the census API calls projected per million points.
+
+Dependencies:
+    - third-party packages: psycopg2
+    - local packages: config.db_config, psql.match_crime_to_census_tracts, psql.local_geocoder,
+                        psql.match_property_to_census_tracts
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import time
+import numpy as np
+import pandas as pd
+# third-party import
+import psycopg2
+# local import
+from airbnb_disorder_analytics.config.db_config import DBInfo
+from airbnb_disorder_analytics.psql.match_crime_to_census_tracts import CrimeDB
+from airbnb_disorder_analytics.psql.match_property_to_census_tracts import get_census_tract_by_geo_info
+
+__all__ = ['benchmark_state', 'benchmark_states']
+
+
+def _summarize(state_abbr, engine, threshold, holdout_df, matched_flags, predicted_tracts, seconds):
+    """
+    :param matched_flags: numpy array of booleans -> whether each point was matched without the census API
+    :param predicted_tracts: numpy array -> the census tract found for each matched point
+    :param seconds: float -> time taken to geolocate all the points; None if the row wasn't timed on its own,
+                            which leaves its points_per_second empty
+    :return: dictionary -> one row of the report
+    """
+    number_of_points = len(holdout_df)
+    is_correct = matched_flags & (predicted_tracts == holdout_df['census_tract_id'].values)
+    match_rate = matched_flags.mean()
+    return {
+        'state': state_abbr,
+        'engine': engine,
+        'threshold': threshold,
+        'points': number_of_points,
+        'points_per_second': round(number_of_points / max(seconds, 1e-9), 1) if seconds is not None else None,
+        'match_rate': round(match_rate, 4),
+        # accuracy of the points matched without the census API
+        'accuracy': round(is_correct.sum() / max(matched_flags.sum(), 1), 4),
+        # the points that aren't matched are geolocated by the census API, which is taken as the truth
+        'overall_accuracy': round((is_correct.sum() + (~matched_flags).sum()) / number_of_points, 4),
+        'api_calls_per_million': int(round((1 - match_rate) * 1e6))
+    }
+
+
+def benchmark_matcher(cdb, holdout_df, thresholds=None):
+    """
+    replay the held-out points through the matching classifier of CrimeDB, without calling the census API
+
+    :param cdb: CrimeDB whose held-out points were removed by hold_out_geolocated_points()
+    :param holdout_df: pandas dataframe returned by hold_out_geolocated_points()
+    :param thresholds: a list of float -> extra thresholds to evaluate (threshold models only)
+    :return: a list of dictionaries -> rows of the report
+    """
+    model = cdb.get_matching_model()
+    list_of_features = []
+    list_of_nearest_indices = []
+    matched_flags = []
+    start_time = time.time()
+    for longitude, latitude in zip(holdout_df['longitude'].values, holdout_df['latitude'].values):
+        features, nearest_node_index = cdb.get_matching_features(longitude, latitude)
+        matched_flags.append(cdb.predict_matching(features))
+        list_of_features.append(features)
+        list_of_nearest_indices.append(nearest_node_index)
+    seconds = time.time() - start_time
+    matched_flags = np.array(matched_flags)
+    predicted_tracts = cdb.all_geolocated_census_tracts[np.array(list_of_nearest_indices)]
+    list_of_rows = [_summarize(cdb.state_abbr, 'matcher', model['threshold'], holdout_df, matched_flags,
+                               predicted_tracts, seconds)]
+    if thresholds and model['threshold'] is not None:
+        # the features don't depend on the threshold: score them once and only move the cut-off;
+        # the rows of the sweep aren't timed, since the cut-off doesn't change the time per point
+        probabilities = model['clf'].predict_proba(np.array(list_of_features))[:, 1]
+        for threshold in thresholds:
+            list_of_rows.append(_summarize(cdb.state_abbr, 'matcher', threshold, holdout_df,
+                                           probabilities >= threshold, predicted_tracts, None))
+    # nearest is timed on its own: one KD-tree query for all the points, without the classifier
+    start_time = time.time()
+    _, nearest_indices = cdb.geolocated_tree.query(holdout_df[['longitude', 'latitude']].values, k=1)
+    nearest_tracts = cdb.all_geolocated_census_tracts[nearest_indices]
+    list_of_rows.append(_summarize(cdb.state_abbr, 'nearest', None, holdout_df,
+                                   np.ones(len(holdout_df), dtype=bool), nearest_tracts, time.time() - start_time))
+    return list_of_rows
+
+
+def benchmark_local_geocoder(state_abbr, holdout_df):
+    """
+    :return: dictionary -> one row of the report
+    """
+    # imported here so that geopandas is only needed when this engine is benchmarked
+    from airbnb_disorder_analytics.psql.local_geocoder import get_local_geocoder
+    start_time = time.time()
+    matched_df = get_local_geocoder().lookup_many(holdout_df['longitude'].values, holdout_df['latitude'].values)
+    seconds = time.time() - start_time
+    predicted_tracts = matched_df['census_tract_id'].values
+    return _summarize(state_abbr, 'local_geocoder', None, holdout_df, pd.notnull(predicted_tracts),
+                      predicted_tracts, seconds)
+
+
+def benchmark_census_api(state_abbr, holdout_df):
+    """
+    :return: dictionary -> one row of the report
+    """
+    predicted_tracts = []
+    start_time = time.time()
+    for longitude, latitude in zip(holdout_df['longitude'].values, holdout_df['latitude'].values):
+        matched_dict = get_census_tract_by_geo_info(longitude, latitude, verbose=False)
+        predicted_tracts.append(None if matched_dict is None else matched_dict['census_tract_id'])
+    seconds = time.time() - start_time
+    predicted_tracts = np.array(predicted_tracts, dtype=object)
+    return _summarize(state_abbr, 'census_api', None, holdout_df, pd.notnull(predicted_tracts),
+                      predicted_tracts, seconds)
+
+
+def benchmark_state(state_abbr, engines=('matcher', 'local_geocoder', 'census_api'), holdout_size=5000,
+                    thresholds=(0.5, 0.8, 0.9, 0.95, 0.99), api_sample_size=50, seed=123):
+    """
+    benchmark the geolocation engines on held-out geolocated points of one state
+
+    :param state_abbr: str
+    :param engines: a list of str -> any of matcher (which also reports nearest), local_geocoder and census_api
+    :param holdout_size: int -> number of geolocated points held out from the matcher's index
+    :param thresholds: a list of float -> thresholds of the matching classifier to evaluate
+    :param api_sample_size: int -> number of held-out points sent to the census API
+    :param seed: int
+    :return: a pandas dataframe with one row per engine (and per threshold for the matcher)
+    """
+    crime_connection = psycopg2.connect(DBInfo.crime_config)
+    airbnb_connection = psycopg2.connect(DBInfo.airbnb_config)
+    cdb = CrimeDB(state_abbr=state_abbr)
+    cdb.connect_to_db(crime={'connection': crime_connection, 'cursor': crime_connection.cursor()},
+                      airbnb={'connection': airbnb_connection, 'cursor': airbnb_connection.cursor()})
+    try:
+        holdout_df = cdb.hold_out_geolocated_points(holdout_size, seed=seed)
+    finally:
+        crime_connection.close()
+        airbnb_connection.close()
+    list_of_rows = []
+    if 'matcher' in engines:
+        list_of_rows += benchmark_matcher(cdb, holdout_df, thresholds)
+    if 'local_geocoder' in engines:
+        try:
+            list_of_rows.append(benchmark_local_geocoder(state_abbr, holdout_df))
+        except (FileNotFoundError, ImportError) as error:
+            print(f'skipped local_geocoder for {state_abbr}:', error)
+    if 'census_api' in engines:
+        list_of_rows.append(benchmark_census_api(state_abbr, holdout_df.iloc[:api_sample_size]))
+    return pd.DataFrame(list_of_rows)
+
+
+def benchmark_states(list_of_states, output_filename='geolocation_benchmark.csv', **kwargs):
+    """
+    :param list_of_states: a list of state abbreviations
+    :param output_filename: str -> csv file that receives the report of all the states
+    :param kwargs: passed to benchmark_state()
+    :return: a pandas dataframe
+    """
+    report_df = pd.concat([benchmark_state(state_abbr, **kwargs) for state_abbr in list_of_states],
+                          ignore_index=True)
+    report_df.to_csv(output_filename, index=False)
+    print(report_df.to_string(index=False))
+    return report_df
+
+
+if __name__ == '__main__':
+    benchmark_states(['NY', 'CA', 'IL', 'MA', 'TX'])
@@ -28,6 +28,8 @@ Dependencies:
         - airbnb_disorder_analytics.config
             - db_config: connect python to a specific postgresql database
             - us_states: handling US state names
+        - airbnb_disorder_analytics.psql
+            - replicate_tables: bulk load pandas dataframes into postgresql with COPY
 
 Includes test case for:
     - the Downloader class
@@ -44,35 +46,49 @@ import os
 import sys
 import requests
 import zipfile
-import io
+import pickle
+import hashlib
+from urllib.parse import unquote
+from multiprocessing.pool import ThreadPool
 import pandas as pd
+import numpy as np
 from tqdm import tqdm
 # third-party import
 import psycopg2
 # local import
 from airbnb_disorder_analytics.config.db_config import DBInfo
 from airbnb_disorder_analytics.config.us_states import USStates
+from airbnb_disorder_analytics.psql.replicate_tables import copy_dataframe_into_table
 
-__all__ = ['ACSInsertion', 'Downloader', 'ACSTableStructure']
+__all__ = ['ACSInsertion', 'Downloader', 'ACSTableStructure', 'download_states_concurrently']
+
+# geography indices already built by this process, by (data_folder, year, state_abbr);
+# see ACSInsertion.get_geography_index()
+_geography_index_cache = {}
+# metadata that only depends on the year (table structure, templates), by (data_folder, name, year);
+# see FileStructure._get_year_metadata()
+_year_metadata_cache = {}
 
 
 class FileStructure:
     """
     stores file and/or folder paths and a psql cursor
     """
-    def __init__(self, year, state_abbreviation):
+    def __init__(self, year, state_abbreviation, data_folder=None, connect_to_db=True):
         """
 
         :param year: int: a specific year of the ACS5 survey data to extract (latest: 2018)
         :param state_abbreviation: str: a specific US state to extract,
                                         in the abbreviated form that includes two characters
+        :param data_folder: str -> where all the acs5-related data is stored; acs5_data under root_path if None
+        :param connect_to_db: boolean -> whether to open the psql connection (self.connection is None otherwise)
         :return: None
         """
         self.uss = USStates()
         self.root_path = '/home/rchen/Documents/github/airbnb_crime/airbnb_disorder_analytics/psql'
-        self.data_folder = os.path.join(self.root_path, 'acs5_data')  # where all the acs5-related data is stored
-        if not os.path.isdir(self.data_folder):
-            os.mkdir(self.data_folder)
+        # where all the acs5-related data is stored
+        self.data_folder = data_folder if data_folder is not None else os.path.join(self.root_path, 'acs5_data')
+        os.makedirs(self.data_folder, exist_ok=True)
         self.year = int(year)
         self.state_abbr = state_abbreviation
         self.state_full = self.uss.abbr2name(state_abbreviation, ' ').title().replace(' ', '')
@@ -87,9 +103,58 @@ class FileStructure:
         self.key_acs5_variables_filepath = '../../analytics/key_acs5_variables.csv'
         # has detailed information on different ACS tables
         self.table_desc_filename = f'ACS5_{self.year}_table_descriptions.csv'
+        # where the parsed appendix and template files of every year are saved by _get_year_metadata()
+        self.metadata_cache_folder = os.path.join(self.data_folder, 'metadata_cache')
         # psql connection
-        self.connection = psycopg2.connect(DBInfo.acs_config)
-        self.cursor = self.connection.cursor()
+        self.connection = psycopg2.connect(DBInfo.acs5_config) if connect_to_db else None
+        self.cursor = self.connection.cursor() if connect_to_db else None
+
+    def _get_year_metadata(self, name, source_paths, build_function):
+        """
+        get metadata that only depends on the year, such as the table structure parsed from the appendix file:
+        it is built once per year, then kept in memory for the rest of the process and pickled to
+        metadata_cache_folder for later runs; the pickle records the latest mtime of the files it was built from
+        and is rebuilt when that changes
+
+        :param name: str -> name of the metadata
+        :param source_paths: a list of str -> the files or folders the metadata is built from
+        :param build_function: a function without arguments that builds the metadata from its sources
+        :return: the metadata
+        """
+        key = (self.data_folder, name, self.year)
+        if key not in _year_metadata_cache:
+            cache_path = os.path.join(self.metadata_cache_folder, f'{name}_{self.year}.pkl')
+            source_mtime = self._get_source_mtime(source_paths)
+            cached = None
+            if os.path.isfile(cache_path):
+                with open(cache_path, 'rb') as file:
+                    cached = pickle.load(file)
+            if isinstance(cached, dict) and cached.get('source_mtime') == source_mtime:
+                _year_metadata_cache[key] = cached['metadata']
+            else:
+                _year_metadata_cache[key] = build_function()
+                # several worker processes may build the metadata at the same time: write to a file of this
+                # process, then move it into place so that no one reads a partial pickle
+                os.makedirs(self.metadata_cache_folder, exist_ok=True)
+                temp_path = f'{cache_path}.{os.getpid()}.tmp'
+                with open(temp_path, 'wb') as file:
+                    pickle.dump({'source_mtime': source_mtime, 'metadata': _year_metadata_cache[key]}, file)
+                os.replace(temp_path, cache_path)
+        return _year_metadata_cache[key]
+
+    @staticmethod
+    def _get_source_mtime(source_paths):
+        """
+        :param source_paths: a list of str -> files or folders; the files inside a folder are looked at as well,
+                                since editing a file in place doesn't change the mtime of its folder
+        :return: float -> the latest mtime of all of them
+        """
+        list_of_mtimes = []
+        for source_path in source_paths:
+            list_of_mtimes.append(os.path.getmtime(source_path))
+            for folder, _, filenames in os.walk(source_path):
+                list_of_mtimes += [os.path.getmtime(os.path.join(folder, filename)) for filename in filenames]
+        return max(list_of_mtimes)
 
 
 class CensusBlock2Tract(FileStructure):
@@ -127,47 +192,45 @@ class CensusBlock2Tract(FileStructure):
         insert the relationship between census_block_id, census_block_group_id and census_tract_id
         into database
 
+        the ids are formatted column by column and both tables are loaded in bulk with COPY
+
         :param verbose: Boolean --> whether to print output as the program goes
         :return: None
         """
+        # read the codes as strings so that they keep their digits whatever pandas would infer
         block_df = pd.read_csv(os.path.join(self.data_folder, self.census_block_foldername, self.state_abbr+'.csv'),
-                               encoding='ISO-8859-1')  # the raw data
+                               encoding='ISO-8859-1',
+                               dtype={column: str for column in ['state', 'county', 'tractcode', 'blockcode',
+                                                                 'tract', 'block']})  # the raw data
         existing_census_block_count = self.count_census_blocks_by_state()
         # check if the database already has complete records of this state
         # only insert when it is incomplete
         if block_df.shape[0] > existing_census_block_count:
-            print('start inserting into census_blocks')
-            for index, row in tqdm(block_df.iterrows(), total=len(block_df)):
+            if verbose:
+                print('start inserting into census_blocks')
+            # [census_tract/census_block]_id is the long format that includes state_id and county_id as well
+            # [census_tract/census_block]_code is the short format that does not have state_id and county_id
+            census_block_df = pd.DataFrame({
+                'census_block_id': block_df['blockcode'].str.zfill(15),
+                'census_block_code': block_df['block'].str.zfill(4),
+                'census_tract_id': block_df['tractcode'].str.zfill(11),
+                'census_tract_code': block_df['tract'].str.zfill(5),
                 # state_fips: two digits with left paddings of zero: 01 for Alabama
-                state_id = str(row['state']).zfill(2)
-                county_id = str(row['county']).zfill(2)  # county_fips: two digits with left paddings of zero
-                county_name = row['cnamelong']
-                # [census_tract/census_block]_id is the long format that includes state_id and county_id as well
-                # [census_tract/census_block]_code is the short format that does not have state_id and county_id
-                census_tract_id = str(row['tractcode']).zfill(11)
-                census_block_id = str(row['blockcode']).zfill(15)
-                census_tract_code = str(row['tract']).zfill(5)
-                census_block_code = str(row['block']).zfill(4)
-                # insert into two tables: census_blocks and census_tracts
-                # these two tables can be linked by "census_tract_id"
-                query = """INSERT INTO census_blocks (census_block_id, census_block_code, census_tract_id, 
-                                                        census_tract_code, state_id, county_id, county_name, 
-                                                        state_abbr, state)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) 
-                                ON CONFLICT (census_block_id) DO NOTHING
-                                RETURNING census_block_id 
-                                ;"""
-                self.cursor.execute(query, (census_block_id, census_block_code, census_tract_id, census_tract_code,
-                                    state_id, county_id, county_name, self.state_abbr, self.state_full))
-                query = """INSERT INTO census_tracts (census_tract_id, census_tract_code, 
-                                                        state_id, county_id, county_name, state_abbr, state)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s) 
-                                ON CONFLICT (census_tract_id) DO NOTHING
-                                RETURNING census_tract_id 
-                                ;"""
-                self.cursor.execute(query, (census_tract_id, census_tract_code, state_id,
-                                            county_id, county_name, self.state_abbr, self.state_full))
-                self.connection.commit()
+                'state_id': block_df['state'].str.zfill(2),
+                'county_id': block_df['county'].str.zfill(2),  # county_fips: two digits with left paddings of zero
+                'county_name': block_df['cnamelong'],
+                'state_abbr': self.state_abbr,
+                'state': self.state_full
+            })
+            # insert into two tables: census_blocks and census_tracts
+            # these two tables can be linked by "census_tract_id"
+            copy_dataframe_into_table(self.connection, census_block_df, 'census_blocks',
+                                      list(census_block_df.columns), ['census_block_id'], verbose=verbose)
+            tract_columns = ['census_tract_id', 'census_tract_code', 'state_id', 'county_id', 'county_name',
+                             'state_abbr', 'state']
+            census_tract_df = census_block_df.drop_duplicates('census_tract_id')[tract_columns]
+            copy_dataframe_into_table(self.connection, census_tract_df, 'census_tracts',
+                                      tract_columns, ['census_tract_id'], verbose=verbose)
             if verbose:
                 print('finished inserting into census_blocks and census_tracts')
         else:
@@ -188,58 +251,124 @@ class PrintError:
 class Downloader(FileStructure):
     """
     download different files needed for insertion
+
+    files are streamed to disk chunk by chunk, so memory use doesn't depend on their size; an interrupted download
+    is kept as {file}.part, next to {file}.part.url with the url it comes from, and resumed with a range request
+    on the next attempt from the same url. the downloader doesn't use the database.
     """
-    def __init__(self, year, state_abbreviation):
+    def __init__(self, year, state_abbreviation, acs_base_url=None, census_block_base_url=None, checksums=None,
+                 data_folder=None):
         """
 
         :param year: int: a specific year of the ACS5 survey data to extract (latest: 2018)
         :param state_abbreviation: str: a specific US state to extract,
                                         in the abbreviated form that includes two characters
+        :param acs_base_url: str -> where the ACS files of the year are served; census.gov if None
+        :param census_block_base_url: str -> where the census block files are served; fcc.gov if None
+        :param checksums: a dictionary -> the expected sha256 hex digest of some files, by url
+        :param data_folder: str -> where the files are saved; see FileStructure
         :return: None
         """
-        super().__init__(year, state_abbreviation)
+        super().__init__(year, state_abbreviation, data_folder=data_folder, connect_to_db=False)
         # get the state name by state abbreviation in format: New York -> NewYork
-        self.acs_base_url = 'https://www2.census.gov/programs-surveys/acs/summary_file/{}'.format(self.year)
-        self.census_block_base_url = r'https://transition.fcc.gov/form477/Geo/CensusBlockData/CSVFiles'
+        self.acs_base_url = acs_base_url or 'https://www2.census.gov/programs-surveys/acs/summary_file/{}'.format(
+            self.year)
+        self.census_block_base_url = census_block_base_url or \
+            r'https://transition.fcc.gov/form477/Geo/CensusBlockData/CSVFiles'
         # https://transition.fcc.gov/form477/Geo/CensusBlockData/CSVFiles/District%20of%20Columbia.zip
+        self.checksums = checksums if checksums is not None else {}
 
     @staticmethod
-    def download_and_unzip_zip_file(zip_url, path_to_unzipped_folder):
+    def download_and_unzip_zip_file(zip_url, path_to_unzipped_folder, checksum=None):
         """
         download zip_file from online and unzip the files inside into
         the designated folder
 
         :param zip_url: str
         :param path_to_unzipped_folder: str
-        :return: None
+        :param checksum: str -> the expected sha256 hex digest of the zip file; not checked if None
+        :return: boolean -> whether the files were unzipped
         """
+        # named after the zip file, not the folder: several zip files may be unzipped into the same folder
+        path_to_zip_file = os.path.join(os.path.dirname(path_to_unzipped_folder.rstrip(os.sep)),
+                                        unquote(os.path.basename(zip_url)))
+        print(f'Requesting zip file {zip_url}')
+        if not Downloader.download_file(zip_url, path_to_zip_file, checksum=checksum):
+            return False
         try:
-            print(f'Requesting zip file {zip_url}')
-            response = requests.get(zip_url, timeout=3.333)
-            response.raise_for_status()
-            z = zipfile.ZipFile(io.BytesIO(response.content))
-            z.extractall(path_to_unzipped_folder)
-            print('downloaded zip file and unzipped the data to folder', path_to_unzipped_folder)
-        except requests.exceptions.RequestException as e:
-            PrintError.stderr_print(f'Error: Download from {zip_url} failed. Reason: {e}')
+            with zipfile.ZipFile(path_to_zip_file) as z:
+                z.extractall(path_to_unzipped_folder)
+        except zipfile.BadZipFile as e:
+            PrintError.stderr_print(f'Error: {path_to_zip_file} from {zip_url} is corrupt. Reason: {e}')
+            os.remove(path_to_zip_file)
+            return False
+        os.remove(path_to_zip_file)
+        print('downloaded zip file and unzipped the data to folder', path_to_unzipped_folder)
+        return True
 
     @staticmethod
-    def download_file(url, path_to_file):
+    def download_file(url, path_to_file, checksum=None, chunk_size=1024 * 1024, timeout=30, max_retries=3):
         """
         download file from online and save it to the designated path
 
         :param url: str
         :param path_to_file: str
-        :return: None
+        :param checksum: str -> the expected sha256 hex digest of the file; not checked if None
+        :param chunk_size: int -> number of bytes written at a time
+        :param timeout: float -> seconds to wait for the server to connect or to send more data
+        :param max_retries: int -> number of times an interrupted download is resumed
+        :return: boolean -> whether the file was downloaded
         """
-        try:
-            response = requests.get(url, timeout=3.333)
-            response.raise_for_status()
-            with open(path_to_file, 'wb') as f:
-                f.write(response.content)
-                print('downloaded excel file', path_to_file)
-        except requests.exceptions.RequestException as e:
-            PrintError.stderr_print(f'Error: Download from {url} failed. Reason: {e}')
+        path_to_part_file = path_to_file + '.part'
+        path_to_url_file = path_to_part_file + '.url'
+        # a part file is only resumed if it was downloaded from the same url
+        if os.path.isfile(path_to_part_file):
+            part_url = None
+            if os.path.isfile(path_to_url_file):
+                with open(path_to_url_file) as f:
+                    part_url = f.read()
+            if part_url != url:
+                os.remove(path_to_part_file)
+        with open(path_to_url_file, 'w') as f:
+            f.write(url)
+        for attempt in range(max_retries + 1):
+            downloaded_size = os.path.getsize(path_to_part_file) if os.path.isfile(path_to_part_file) else 0
+            headers = {'Range': f'bytes={downloaded_size}-'} if downloaded_size else {}
+            try:
+                with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                    if response.status_code == 416:  # the part file is already complete
+                        break
+                    response.raise_for_status()
+                    # a server that ignores the range request sends the whole file again
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    expected_size = response.headers.get('Content-Length')
+                    if expected_size is not None:
+                        expected_size = int(expected_size) + (downloaded_size if mode == 'ab' else 0)
+                    with open(path_to_part_file, mode) as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                if expected_size is not None and os.path.getsize(path_to_part_file) < expected_size:
+                    raise requests.exceptions.ConnectionError(
+                        f'received {os.path.getsize(path_to_part_file)} of {expected_size} bytes')
+                break
+            except requests.exceptions.RequestException as e:
+                PrintError.stderr_print(f'Error: Download from {url} failed (attempt {attempt + 1}). Reason: {e}')
+        else:
+            return False
+        if checksum is not None:
+            sha256 = hashlib.sha256()
+            with open(path_to_part_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    sha256.update(chunk)
+            if sha256.hexdigest() != checksum:
+                PrintError.stderr_print(f'Error: {url} does not match its checksum; removed the download')
+                os.remove(path_to_part_file)
+                os.remove(path_to_url_file)
+                return False
+        os.replace(path_to_part_file, path_to_file)
+        os.remove(path_to_url_file)
+        print('downloaded file', path_to_file)
+        return True
 
     def download_raw_data_by_state(self):
         """
@@ -261,15 +390,19 @@ class Downloader(FileStructure):
         # Download zip files, as necessary and unzip them to the data folder
         if not os.path.isdir(
                 os.path.join(self.data_folder, self.summary_foldername)):  # download and unzip summary zip file
-            self.download_and_unzip_zip_file(summary_zip_url, os.path.join(self.data_folder, self.summary_foldername))
+            self.download_and_unzip_zip_file(summary_zip_url, os.path.join(self.data_folder, self.summary_foldername),
+                                             self.checksums.get(summary_zip_url))
         if not os.path.isdir(
                 os.path.join(self.data_folder, self.templates_foldername)):  # download and unzip templates zip file
             self.download_and_unzip_zip_file(templates_zip_url,
-                                             os.path.join(self.data_folder, self.templates_foldername))
+                                             os.path.join(self.data_folder, self.templates_foldername),
+                                             self.checksums.get(templates_zip_url))
         # download and unzip census block zip file
         if not os.path.isfile(os.path.join(self.data_folder, self.census_block_foldername, self.state_abbr+'.csv')):
-            self.download_and_unzip_zip_file(census_block_zip_url,
-                                             os.path.join(self.data_folder, f'census_blocks_{self.state_abbr}'))
+            if not self.download_and_unzip_zip_file(census_block_zip_url,
+                                                    os.path.join(self.data_folder, f'census_blocks_{self.state_abbr}'),
+                                                    self.checksums.get(census_block_zip_url)):
+                return
             # reorganize census_block_by_state files and store all of them in a folder called "census_blocks"
             # by first moving the file into the new folder and then rename the file to "{state_abbr}.csv"
             if not os.path.isdir(os.path.join(self.data_folder, self.census_block_foldername)):
@@ -287,24 +420,65 @@ class Downloader(FileStructure):
 
         # Download Excel files
         if not os.path.isfile(os.path.join(self.data_folder, self.appendix_filename)):
-            self.download_file(appendix_file_url, os.path.join(self.data_folder, self.appendix_filename))
+            self.download_file(appendix_file_url, os.path.join(self.data_folder, self.appendix_filename),
+                               self.checksums.get(appendix_file_url))
+
+    def download_year_files(self):
+        """
+        download the files shared by all the states of the year (templates zip and appendix excel),
+        so that concurrent downloads of several states don't fetch them at the same time
+        """
+        templates_zip_url = '/'.join([self.acs_base_url, 'data', self.templates_foldername + '.zip'])
+        appendix_file_url = '/'.join([self.acs_base_url, 'documentation/tech_docs', self.appendix_filename])
+        if not os.path.isdir(os.path.join(self.data_folder, self.templates_foldername)):
+            self.download_and_unzip_zip_file(templates_zip_url,
+                                             os.path.join(self.data_folder, self.templates_foldername),
+                                             self.checksums.get(templates_zip_url))
+        if not os.path.isfile(os.path.join(self.data_folder, self.appendix_filename)):
+            self.download_file(appendix_file_url, os.path.join(self.data_folder, self.appendix_filename),
+                               self.checksums.get(appendix_file_url))
+
+
+def download_states_concurrently(year, list_of_states, workers=4, **kwargs):
+    """
+    download the raw data of several states at the same time with a bounded pool of threads
+
+    :param year: int
+    :param list_of_states: a list of state abbreviations
+    :param workers: int -> max number of states downloaded at the same time
+    :param kwargs: passed to Downloader (acs_base_url, census_block_base_url, checksums, data_folder)
+    :return: None
+    """
+    Downloader(year, list_of_states[0], **kwargs).download_year_files()
+
+    def download_state(state_abbr):
+        Downloader(year, state_abbr, **kwargs).download_raw_data_by_state()
+        return state_abbr
+
+    with ThreadPool(workers) as pool:
+        for _ in tqdm(pool.imap_unordered(download_state, list_of_states), total=len(list_of_states)):
+            pass
 
 
 class ACSTableStructure(FileStructure):
     """
     construct table_id and variable_id and insert their relationship into database
     """
-    def __init__(self, year, state_abbreviation):
+    def __init__(self, year, state_abbreviation, table_structure_df=None):
         """
 
         :param year: int: a specific year of the ACS5 survey data to extract (latest: 2018)
         :param state_abbreviation: str: a specific US state to extract,
                                         in the abbreviated form that includes two characters
+        :param table_structure_df: a pandas dataframe -> the table structure of the year, if it was already
+                                    built (it only depends on the year); read from the appendix file if None
         :return: None
         """
         super().__init__(year, state_abbreviation)
-        self.table_structure_df = None
-        self.table_structure_df = self._build_acs_tables()
+        self.table_structure_df = table_structure_df
+        if self.table_structure_df is None:
+            self.table_structure_df = self._get_year_metadata(
+                'table_structure', [os.path.join(self.data_folder, self.appendix_filename)], self._build_acs_tables)
         # get survey table ids and their descriptions, save them to csv
         if not os.path.isfile(os.path.join(self.data_folder, self.table_desc_filename)):
             table_df = self.table_structure_df.filter(['name', 'title'], axis=1)
@@ -337,29 +511,46 @@ class ACSTableStructure(FileStructure):
         insert the constructed table_structure_df with detailed information on the
         properties of the table as well as the associated variables
 
+        all the tables of the year are inserted at once with COPY, and only if the database doesn't
+        have all of them yet; tables already in the database (e.g. from another year) are kept as they are,
+        since table_id is the key of survey_table
+
         :param verbose: boolean -> whether to print outputs as the program goes
         :return: None
         """
-        for index, row in self.table_structure_df.iterrows():
-            table_id = row['name']
-            table_title = row['title']
-            table_restriction = row['restr']
-            table_topics = row['topics']
-            table_universe = row['universe']
-            table_variable_count = row['end'] - row['start'] + 1
-            query = ("INSERT INTO survey_table (table_id, title, restriction, topics, universe, \n"
-                     "                                                table_variable_count, year)\n"
-                     "                                VALUES (%s, %s, %s, %s, %s, %s, %s) \n"
-                     "                                ON CONFLICT (table_id) DO NOTHING\n"
-                     "                                RETURNING table_id\n"
-                     "                                ;")
-            self.cursor.execute(query, (table_id, table_title, table_restriction, table_topics,
-                                        table_universe, table_variable_count, self.year))
+        table_df = pd.DataFrame({
+            'table_id': self.table_structure_df['name'],
+            'title': self.table_structure_df['title'],
+            'restriction': self.table_structure_df['restr'],
+            'topics': self.table_structure_df['topics'],
+            'universe': self.table_structure_df['universe'],
+            'table_variable_count': (self.table_structure_df['end'] - self.table_structure_df['start'] + 1
+                                     ).astype('Int64'),
+            'year': self.year
+        }).drop_duplicates('table_id')
+        query = """SELECT COUNT(*)
+                    FROM survey_table
+                    WHERE table_id = ANY(%s)
+                    ;
+                    """
+        self.cursor.execute(query, (list(table_df['table_id']), ))
+        if self.cursor.fetchone()[0] >= len(table_df):
             if verbose:
-                print(f'inserted {self.cursor.fetchone()} into psql')
-            self.connection.commit()
+                print('survey_table already complete')
+            return
+        copy_dataframe_into_table(self.connection, table_df, 'survey_table', list(table_df.columns), ['table_id'],
+                                  update_on_conflict=False, verbose=verbose)
         print('finished inserting table structure into psql')
 
+    @staticmethod
+    def get_table_id_from_variable_id(variable_id):
+        """
+
+        :param variable_id: str
+        :return: str
+        """
+        return '_'.join(variable_id.split('_')[:-1])
+
 
 class VariablesInSummaryFile(ACSTableStructure):
     """
@@ -371,12 +562,58 @@ class VariablesInSummaryFile(ACSTableStructure):
     is also the index of the column where the estimate and margin-of-error of this variable is stored
     in the E-file and the M-file.
     """
-    def __init__(self, year, state_abbreviation, verbose=False):
-        super().__init__(year, state_abbreviation)
+    def __init__(self, year, state_abbreviation, verbose=False, table_structure_df=None):
+        super().__init__(year, state_abbreviation, table_structure_df)
         self.variables_in_summary = {}
+        self.variable_index = {}  # variable_id -> (id of its summary file, index of its column)
         self._build_variables2summary_directory(verbose)
 
     def _build_variables2summary_directory(self, verbose=False):
+        templates = self._get_year_metadata(
+            'templates', [os.path.join(self.data_folder, self.templates_foldername)], self._read_templates)
+        self.variables_in_summary = templates['variables_in_summary']
+        self.variable_index = templates['variable_index']
+        if verbose:
+            print('finished processing templates folder and constructed a directory of the summary file:',
+                  self.templates_foldername)
+
+    def insert_survey_variables_into_psql(self, verbose):
+        """
+        insert the id, the table and the title of every variable of the year into survey_variable, at once with COPY,
+        and only if the database doesn't have all of them yet; the variables already in the database keep their titles
+
+        :param verbose: boolean -> whether to print outputs as the program goes
+        :return: None
+        """
+        variable_df = pd.DataFrame(
+            [(variable_id, self.get_table_id_from_variable_id(variable_id), self.variables_in_summary[seq][column])
+             for variable_id, (seq, column) in self.variable_index.items()],
+            columns=['variable_id', 'table_id', 'title'])
+        query = """SELECT COUNT(*)
+                    FROM survey_variable
+                    WHERE variable_id = ANY(%s)
+                    ;
+                    """
+        self.cursor.execute(query, (list(variable_df['variable_id']), ))
+        if self.cursor.fetchone()[0] >= len(variable_df):
+            if verbose:
+                print('survey_variable already complete')
+            return
+        copy_dataframe_into_table(self.connection, variable_df, 'survey_variable', list(variable_df.columns),
+                                  ['variable_id'], update_on_conflict=False, verbose=verbose)
+        print('finished inserting survey variables into psql')
+
+    def _read_templates(self):
+        """
+        read the header of every summary file from the templates folder
+
+        :return: a dictionary with two keys:
+                    - variables_in_summary: the list of variables (column titles) of every summary file, by its id
+                    - variable_index: the id of the summary file and the index of the column of every variable,
+                                        by variable_id (e.g. B07001_1, whose column is headed B07001_001)
+        """
+        variables_in_summary = {}
+        variable_index = {}
         for filename in os.listdir(os.path.join(self.data_folder, self.templates_foldername)):
             if 'seq' in filename.lower():
                 # Generate 4-digit sequence number string
@@ -392,10 +629,15 @@ class VariablesInSummaryFile(ACSTableStructure):
                 continue
             template_df = pd.read_excel(os.path.join(self.data_folder, self.templates_foldername, filename))
             # Extract column names from data row 0
-            self.variables_in_summary[key] = template_df.loc[0].tolist()
-        if verbose:
-            print('finished processing templates folder and constructed a directory of the summary file:',
-                  self.templates_foldername)
+            variables_in_summary[key] = template_df.loc[0].tolist()
+            if key == 'geo':
+                continue
+            # the header itself has the variable codes: FILEID, ..., LOGRECNO, then {table_id}_{3-digit index}
+            for column_index, code in enumerate(template_df.columns):
+                table_id, _, variable_index_in_table = str(code).rpartition('_')
+                if table_id and variable_index_in_table.isdigit():
+                    variable_index['_'.join([table_id, str(int(variable_index_in_table))])] = (key, column_index)
+        return {'variables_in_summary': variables_in_summary, 'variable_index': variable_index}
 
 
 class SummaryFilesByID(FileStructure):
@@ -430,39 +672,69 @@ class ACSInsertion(ACSTableStructure):
     """
     insert ACS data by variable_id
     """
-    def __init__(self, year, state_abbreviation, verbose=True):
-        super().__init__(year, state_abbreviation)
+    def __init__(self, year, state_abbreviation, verbose=True, table_structure_df=None, variables_in_summary=None,
+                 variable_index=None):
+        """
+        :param table_structure_df: a pandas dataframe -> see ACSTableStructure
+        :param variables_in_summary: a dictionary -> the variables of every summary file of the year, if it was
+                                        already built; read from the template files if None
+        :param variable_index: a dictionary -> see VariablesInSummaryFile; must be given with variables_in_summary
+        """
+        super().__init__(year, state_abbreviation, table_structure_df)
         self.variables_in_summary = {}
         self.efile_by_id = {}
         self.mfile_by_id = {}
         self.summary_level_for_census_block = '150'
         self.summary_level_for_census_tract = '140'
+        # where the geography index of every state and year is saved by get_geography_index()
+        self.geography_index_folder = os.path.join(self.data_folder, 'geography_index')
 
-        vsf = VariablesInSummaryFile(year, state_abbreviation, verbose)  # build the summary_to_variable_list directory
-        self.variables_in_summary = vsf.variables_in_summary
+        if variables_in_summary is None:  # build the summary_to_variable_list directory
+            vsf = VariablesInSummaryFile(year, state_abbreviation, verbose, self.table_structure_df)
+            vsf.connection.close()
+            variables_in_summary, variable_index = vsf.variables_in_summary, vsf.variable_index
+        self.variables_in_summary = variables_in_summary
+        self.variable_index = variable_index
 
         sf = SummaryFilesByID(year, state_abbreviation)  # build the summary_id_to_filename directory
         self.efile_by_id = sf.efile_by_id
         self.mfile_by_id = sf.mfile_by_id
 
     def set_new_state(self, state_abbreviation, verbose=False):
-        self.__init__(self.year, state_abbreviation, verbose)
+        # the table structure and the templates only depend on the year: keep them
+        self.connection.close()
+        self.__init__(self.year, state_abbreviation, verbose, self.table_structure_df, self.variables_in_summary,
+                      self.variable_index)
 
     @staticmethod
-    def read_summary_file(file, column_names):
+    def read_summary_file(file, column_names, usecols=None):
         """
             Read summary estimates/margins file and return a massaged DataFrame
             ready for data extraction.
+
+            if usecols (a list of column indices) is given, only LOGRECNO and these columns are read,
+            as int64 and float64 respectively, instead of every column as str
             """
-        summary_df = ACSInsertion.read_from_csv(file, column_names=column_names)
+        if usecols is None:
+            summary_df = ACSInsertion.read_from_csv(file, column_names=column_names)
+        else:
+            logical_record_number_index = column_names.index('LOGRECNO')
+            usecols = sorted(set(usecols) | {logical_record_number_index})
+            dtype = {index: np.float64 for index in usecols}
+            dtype[logical_record_number_index] = np.int64
+            summary_df = ACSInsertion.read_from_csv(file, column_names=column_names, usecols=usecols, dtype=dtype)
         summary_df = summary_df.rename(columns={'SEQUENCE': 'seq', 'LOGRECNO': 'logical_record_number'})
+        # the same integer key as the geography index
+        summary_df['logical_record_number'] = pd.to_numeric(summary_df['logical_record_number']).astype(np.int64)
         return summary_df
 
     @staticmethod
-    def read_from_csv(file, column_names):
+    def deduplicate_column_names(column_names):
         """
-        customized call to pandas.read_csv for reading header-less summary files.
         replace duplicates in column_names with column_name_{index}
+
+        :param column_names: a list of str
+        :return: a list of str
         """
         name_set = set()
         names_without_duplicates = []
@@ -480,8 +752,25 @@ class ACSInsertion(ACSTableStructure):
                         new_name = '_'.join([name, str(index)])
                 names_without_duplicates.append(new_name)
                 name_set.add(new_name)
-        return pd.read_csv(file, encoding='ISO-8859-1', names=names_without_duplicates,
-                           header=None, na_values=['.', -1], dtype=str)
+        return names_without_duplicates
+
+    @staticmethod
+    def read_from_csv(file, column_names, usecols=None, dtype=str):
+        """
+        customized call to pandas.read_csv for reading header-less summary files.
+        replace duplicates in column_names with column_name_{index}
+
+        :param usecols: a list of column indices -> read these columns only; all the columns if None
+        :param dtype: the dtype of all the columns, or a dictionary of dtypes by column index
+        """
+        names_without_duplicates = ACSInsertion.deduplicate_column_names(column_names)
+        if usecols is None:
+            return pd.read_csv(file, encoding='ISO-8859-1', names=names_without_duplicates,
+                               header=None, na_values=['.', -1], dtype=dtype)
+        summary_df = pd.read_csv(file, encoding='ISO-8859-1', header=None, usecols=usecols,
+                                 na_values=['.', -1], dtype=dtype)
+        summary_df.columns = [names_without_duplicates[index] for index in summary_df.columns]
+        return summary_df
 
     def insert_variable_into_psql(self, variable_id, census_block=False, census_tract=False, verbose=True):
         """
@@ -491,29 +780,90 @@ class ACSInsertion(ACSTableStructure):
         :param census_block: boolean -> whether the neighborhood is defined as census block
         :param census_tract: boolean -> whether the neighborhood is defined as census tract
         :param verbose: boolean -> whether to print output as the program goes
+        :return: int -> number of rows inserted or updated
+        """
+        return self.insert_variables_into_psql([variable_id], census_block, census_tract, verbose)
+
+    def insert_variables_into_psql(self, list_of_variable_ids, census_block=False, census_tract=False,
+                                   verbose=True):
+        """
+        insert many ACS variables into database at once; each summary file is read only once per geography
+        (see extract_variables())
+
+        :param list_of_variable_ids: a list of str
+        :param census_block: boolean -> whether the neighborhood is defined as census block
+        :param census_tract: boolean -> whether the neighborhood is defined as census tract
+        :param verbose: boolean -> whether to print output as the program goes
+        :return: int -> number of rows inserted or updated
+        """
+        count_of_rows = 0
+        # census blocks and census tracts are different logical records: extract and load them separately
+        if census_block:
+            long_df = self.extract_variables(list_of_variable_ids, census_block=True, verbose=verbose)
+            count_of_rows += self.load_variables_into_psql(long_df, census_block=True, verbose=verbose)
+        if census_tract:
+            long_df = self.extract_variables(list_of_variable_ids, census_tract=True, verbose=verbose)
+            count_of_rows += self.load_variables_into_psql(long_df, census_tract=True, verbose=verbose)
+        return count_of_rows
+
+    def load_variables_into_psql(self, long_df, census_block=False, census_tract=False, verbose=True):
+        """
+        bulk load a long-format frame of any number of variables into variable_by_block or variable_by_tract
+        with COPY; the rows that are already in the table are updated with the new values
+
+        :param long_df: a pandas dataframe returned by extract_variables() for one geography
+        :param census_block: boolean -> whether long_df has census blocks, loaded into variable_by_block
+        :param census_tract: boolean -> whether long_df has census tracts, loaded into variable_by_tract
+        :param verbose: boolean -> whether to print output as the program goes
+        :return: int -> number of rows inserted or updated
+        """
+        if census_block == census_tract:
+            raise ValueError('long_df has the neighborhoods of one geography: set either census_block or census_tract')
+        if census_block:
+            table = 'variable_by_block'
+            primary_keys = ['variable_id', 'census_tract_id', 'census_block_group']
+        else:
+            table = 'variable_by_tract'
+            primary_keys = ['variable_id', 'census_tract_id']
+        # a row can be upserted only once per statement: keep the last of any duplicated keys
+        long_df = long_df.drop_duplicates(subset=primary_keys, keep='last').assign(year=self.year)
+        # not committed here: the load is recorded in the same transaction as the rows by copy_dataframe_into_table
+        self._record_variable_load(table)
+        return copy_dataframe_into_table(self.connection, long_df, table,
+                                         primary_keys + ['estimate', 'margin_of_error', 'year'], primary_keys,
+                                         update_on_conflict=True, verbose=verbose)
+
+    def _record_variable_load(self, table):
+        """
+        add a row for this load to variable_load: readers of the variables (e.g. the feature cache of
+        analytics.link_airbnb_with_acs) compare the number of loads of a table to know whether the values they
+        keep are still current. a row is inserted rather than a counter updated, so that the states loaded
+        in parallel don't wait for each other
+
+        :param table: str -> variable_by_block or variable_by_tract
         :return: None
         """
-        merged_df = self._merge_summary_files_by_id(variable_id, census_block, census_tract, verbose)
-        for index, row in merged_df.iterrows():
-            if census_block:
-                query = """INSERT INTO variable_by_block (variable_id, census_tract_id, census_block_group, estimate, 
-                                                            margin_of_error, year)
-                                    VALUES (%s, %s, %s, %s, %s, %s) 
-                                    ON CONFLICT (variable_id, census_tract_id, census_block_group) DO NOTHING
-                                    RETURNING variable_id
-                                    ;"""
-                self.cursor.execute(query, (variable_id, row['census_tract_id'], row['census_block_group'],
-                                            row[variable_id + '_Estimate'], row[variable_id + '_Margin'], self.year))
-            if census_tract:
-                query = """INSERT INTO variable_by_tract (variable_id, census_tract_id, estimate, 
-                                                            margin_of_error, year)
-                                    VALUES (%s, %s, %s, %s, %s) 
-                                    ON CONFLICT (variable_id, census_tract_id) DO NOTHING
-                                    RETURNING variable_id
-                                    ;"""
-                self.cursor.execute(query, (variable_id, row['census_tract_id'],
-                                            row[variable_id + '_Estimate'], row[variable_id + '_Margin'], self.year))
-            self.connection.commit()
+        cursor = self.connection.cursor()
+        query = """CREATE TABLE IF NOT EXISTS variable_load (
+                        load_id BIGSERIAL PRIMARY KEY,
+                        table_name TEXT NOT NULL,
+                        year INTEGER NOT NULL,
+                        loaded_at TIMESTAMP NOT NULL DEFAULT now()
+                    );
+                    """
+        cursor.execute(query)
+        query = """INSERT INTO variable_load (table_name, year)
+                    VALUES (%s, %s)
+                    ;
+                    """
+        cursor.execute(query, (table, self.year))
+
+    def _get_seq_by_variable_id(self, variable_id):
+        """
+        :param variable_id: str
+        :return: str -> the 4-digit sequence number of the summary files that store the variable
+        """
+        return self.variable_index[variable_id][0]
 
     def _get_summary_column_index_by_variable_id(self, variable_id):
         """
@@ -523,20 +873,7 @@ class ACSInsertion(ACSTableStructure):
         :param variable_id: str
         :return: int
         """
-        table_id = self.get_table_id_from_variable_id(variable_id)
-        seq = self.table_structure_df['seq'][self.table_structure_df['name'] == table_id].values[0]
-        list_of_variables_in_summary = self.variables_in_summary[seq]
-        query = """SELECT variable_id, title
-                                        FROM survey_variable
-                                        WHERE table_id = '{}'
-                                        AND variable_id = '{}'
-                                        ;
-                                        """.format(table_id, variable_id)
-        self.cursor.execute(query)
-        result = self.cursor.fetchone()
-        target_variable_name = result[1]
-        target_variable_column_index = list_of_variables_in_summary.index(target_variable_name)
-        return target_variable_column_index
+        return self.variable_index[variable_id][1]
 
     def _merge_summary_files_by_id(self, variable_id, census_block=False, census_tract=False, verbose=True):
         """
@@ -550,41 +887,25 @@ class ACSInsertion(ACSTableStructure):
         :return: a pandas dataframe
         """
         table_id = self.get_table_id_from_variable_id(variable_id)
-        seq = self.table_structure_df['seq'][self.table_structure_df['name'] == table_id].values[0]
+        seq, column_index_of_variable_in_summary = self.variable_index[variable_id]
         list_of_variables_in_summary = self.variables_in_summary[seq]
-        column_index_of_variable_in_summary = self._get_summary_column_index_by_variable_id(variable_id)
-        # read gdf, rename the two geo-columns and extract census_tract_id and/or census_block_id
-        # from geographic_identifier
-        gdf = self.read_from_csv(os.path.join(self.data_folder, self.summary_foldername, self.gfilename),
-                                 column_names=self.variables_in_summary['geo'])
-        if census_block:
-            gdf = gdf[['Logical Record Number', 'Geographic Identifier']][gdf['Summary Level']
-                                                                          == self.summary_level_for_census_block]
-            gdf.columns = ['logical_record_number', 'geographic_identifier']
-            gdf['census_tract_id'] = gdf['geographic_identifier'].str.split('US').str[1].str[:-1]
-            gdf['census_block_group'] = gdf['geographic_identifier'].str.split('US').str[1].str[-1]
-
-        if census_tract:
-            gdf = gdf[['Logical Record Number', 'Geographic Identifier']][gdf['Summary Level'] ==
-                                                                          self.summary_level_for_census_tract]
-            gdf.columns = ['logical_record_number', 'geographic_identifier']
-            gdf['census_tract_id'] = gdf['geographic_identifier'].str.split('US').str[1]
+        gdf = self._read_geography(census_block, census_tract)
 
-        # add two more columns on census_tract_id and census_block_group
-
-        # read estimates and margins-of-error
+        # read estimates and margins-of-error: only the geo-column and the column of the target_variable_id,
+        # and rename the columns by adding a postfix of '_Estimate' to edf variable column and
+        # that of '_Margin' to mdf variable column
         efile = self.efile_by_id[seq]
         edf = self.read_summary_file(os.path.join(self.data_folder, self.summary_foldername, efile),
-                                     column_names=list_of_variables_in_summary)
+                                     column_names=list_of_variables_in_summary,
+                                     usecols=[column_index_of_variable_in_summary])
         mfile = self.mfile_by_id[seq]
         mdf = self.read_summary_file(os.path.join(self.data_folder, self.summary_foldername, mfile),
-                                     column_names=list_of_variables_in_summary)
-        # keep only the geo-column and the column of the target_variable_id and rename the columns by
-        # adding a postfix of '_Estimate' to edf variable column and that of '_Margin' to mdf variable column
-        geo_code_column_index = list(edf.columns).index('logical_record_number')
-        use_col_nums = [geo_code_column_index, column_index_of_variable_in_summary]
-        edf = edf.iloc[:, use_col_nums]
-        mdf = mdf.iloc[:, use_col_nums]
+                                     column_names=list_of_variables_in_summary,
+                                     usecols=[column_index_of_variable_in_summary])
+        variable_column = self.deduplicate_column_names(list_of_variables_in_summary)[
+            column_index_of_variable_in_summary]
+        edf = edf[['logical_record_number', variable_column]]
+        mdf = mdf[['logical_record_number', variable_column]]
         edf.columns = ['logical_record_number', variable_id+'_Estimate']
         mdf.columns = ['logical_record_number', variable_id + '_Margin']
 
@@ -595,14 +916,139 @@ class ACSInsertion(ACSTableStructure):
             print('got merged_df for', table_id, '\t dataframe shape:', merged_df.shape)
         return merged_df
 
-    @staticmethod
-    def get_table_id_from_variable_id(variable_id):
+    def _build_geography_index(self):
+        """
+        parse the geography file of the state into compact arrays, keeping the census tracts and
+        the census block groups only
+
+        :return: a dictionary of numpy arrays with one entry per logical record:
+                    - logical_record_number: int64
+                    - summary_level: the summary level, as in the geography file (140 or 150)
+                    - census_tract_id: 11-character census tract ids
+                    - census_block_group: the one-digit census block group ('' for census tracts)
         """
+        geo_columns = self.variables_in_summary['geo']
+        column_names = ['Summary Level', 'Logical Record Number', 'Geographic Identifier']
+        gdf = pd.read_csv(os.path.join(self.data_folder, self.summary_foldername, self.gfilename),
+                          encoding='ISO-8859-1', header=None, dtype=str,
+                          usecols=[geo_columns.index(name) for name in column_names])
+        # usecols returns the columns in file order; put them back in the order of column_names
+        gdf = gdf[[geo_columns.index(name) for name in column_names]]
+        gdf.columns = ['summary_level', 'logical_record_number', 'geographic_identifier']
+        gdf = gdf[gdf['summary_level'].isin([self.summary_level_for_census_tract,
+                                             self.summary_level_for_census_block])]
+        # e.g. 15000US360610001001 -> 36061000100 (census tract) and 1 (census block group)
+        geoid = gdf['geographic_identifier'].str.partition('US')[2]
+        return {
+            'logical_record_number': pd.to_numeric(gdf['logical_record_number']).to_numpy(dtype=np.int64),
+            'summary_level': gdf['summary_level'].to_numpy(dtype='U3'),
+            'census_tract_id': geoid.str[:11].to_numpy(dtype='U11'),
+            'census_block_group': geoid.str[11:12].to_numpy(dtype='U1')
+        }
+
+    def get_geography_index(self):
+        """
+        get the geography index of the state (see _build_geography_index()); it is built once per state and year,
+        then kept in memory for the rest of the process and saved to geography_index_folder for later runs;
+        the saved index records the mtime and size of the geography file and is rebuilt when they change
 
-        :param variable_id: str
-        :return: str
+        :return: a dictionary of numpy arrays
         """
-        return '_'.join(variable_id.split('_')[:-1])
+        key = (self.data_folder, self.year, self.state_abbr)
+        if key not in _geography_index_cache:
+            index_path = os.path.join(self.geography_index_folder, f'{self.year}_{self.state_abbr}.npz')
+            gfile_stat = os.stat(os.path.join(self.data_folder, self.summary_foldername, self.gfilename))
+            source_info = np.array([gfile_stat.st_mtime, gfile_stat.st_size], dtype=np.float64)
+            geography_index = None
+            if os.path.isfile(index_path):
+                with np.load(index_path) as npz_file:
+                    if 'source_info' in npz_file.files and np.array_equal(npz_file['source_info'], source_info):
+                        geography_index = {name: npz_file[name] for name in npz_file.files if name != 'source_info'}
+            if geography_index is None:
+                geography_index = self._build_geography_index()
+                # several worker processes may build indexes at the same time (see psql.ingest_acs_in_parallel):
+                # write to a file of this process, then move it into place so that no one reads a partial index
+                os.makedirs(self.geography_index_folder, exist_ok=True)
+                temp_path = f'{index_path}.{os.getpid()}.tmp'
+                with open(temp_path, 'wb') as file:
+                    np.savez(file, source_info=source_info, **geography_index)
+                os.replace(temp_path, index_path)
+            _geography_index_cache[key] = geography_index
+        return _geography_index_cache[key]
+
+    def _read_geography(self, census_block=False, census_tract=False):
+        """
+        get the logical records of the neighborhoods of the state from its geography index
+
+        :param census_block: boolean -> whether the neighborhood is defined as census block
+        :param census_tract: boolean -> whether the neighborhood is defined as census tract
+        :return: a pandas dataframe with the columns logical_record_number, census_tract_id
+                    and (for census blocks) census_block_group
+        """
+        geography_index = self.get_geography_index()
+        if census_block:
+            is_selected = geography_index['summary_level'] == self.summary_level_for_census_block
+            columns = ['logical_record_number', 'census_tract_id', 'census_block_group']
+        else:
+            is_selected = geography_index['summary_level'] == self.summary_level_for_census_tract
+            columns = ['logical_record_number', 'census_tract_id']
+        return pd.DataFrame({column: geography_index[column][is_selected] for column in columns})
+
+    def extract_variables(self, list_of_variable_ids, census_block=False, census_tract=False, verbose=True):
+        """
+        extract the estimates and margins-of-error of many variables at once:
+        the variables are grouped by the summary files (sequence) that store them, and the geography file
+        and the E and M files of each sequence are read only once for all the variables of the group
+
+        :param list_of_variable_ids: a list of str
+        :param census_block: boolean -> whether the neighborhood is defined as census block
+        :param census_tract: boolean -> whether the neighborhood is defined as census tract
+        :param verbose: boolean -> whether to print output as the program goes
+        :return: a pandas dataframe in long format, with one row per variable and neighborhood and the columns
+                    variable_id, logical_record_number, census_tract_id, (census_block_group,)
+                    estimate and margin_of_error; without any row if list_of_variable_ids is empty
+        """
+        # a variable requested twice is extracted once
+        list_of_variable_ids = list(dict.fromkeys(list_of_variable_ids))
+        unknown_variable_ids = [variable_id for variable_id in list_of_variable_ids
+                                if variable_id not in self.variable_index]
+        if unknown_variable_ids:
+            raise ValueError(f'variables not in any summary file of {self.year}: {unknown_variable_ids}')
+        variable_ids_by_seq = {}
+        for variable_id in list_of_variable_ids:
+            variable_ids_by_seq.setdefault(self._get_seq_by_variable_id(variable_id), []).append(variable_id)
+        gdf = self._read_geography(census_block, census_tract)
+        geo_columns = list(gdf.columns)
+        if not variable_ids_by_seq:
+            return pd.DataFrame(columns=['variable_id'] + geo_columns + ['estimate', 'margin_of_error'])
+        list_of_long_dfs = []
+        for seq, variable_ids in variable_ids_by_seq.items():
+            list_of_variables_in_summary = self.variables_in_summary[seq]
+            column_indices = [self._get_summary_column_index_by_variable_id(variable_id)
+                              for variable_id in variable_ids]
+            # read only the columns of the requested variables
+            edf = self.read_summary_file(os.path.join(self.data_folder, self.summary_foldername,
+                                                      self.efile_by_id[seq]),
+                                         column_names=list_of_variables_in_summary, usecols=column_indices)
+            mdf = self.read_summary_file(os.path.join(self.data_folder, self.summary_foldername,
+                                                      self.mfile_by_id[seq]),
+                                         column_names=list_of_variables_in_summary, usecols=column_indices)
+            names_without_duplicates = self.deduplicate_column_names(list_of_variables_in_summary)
+            # line the margins of error up with the estimates by logical record, rather than by row position
+            mdf = mdf.set_index('logical_record_number').reindex(edf['logical_record_number'].values)
+            for variable_id, column_index in zip(variable_ids, column_indices):
+                long_df = pd.DataFrame({
+                    'variable_id': variable_id,
+                    'logical_record_number': edf['logical_record_number'].values,
+                    'estimate': edf[names_without_duplicates[column_index]].values,
+                    'margin_of_error': mdf[names_without_duplicates[column_index]].to_numpy()
+                })
+                list_of_long_dfs.append(long_df)
+            if verbose:
+                print('extracted', len(variable_ids), 'variables from sequence', seq)
+        long_df = pd.concat(list_of_long_dfs, ignore_index=True)
+        long_df = long_df.merge(gdf[geo_columns], on='logical_record_number', how='inner')
+        return long_df[['variable_id'] + geo_columns + ['estimate', 'margin_of_error']]
 
     def get_variable_restriction_from_variable_id(self, variable_id):
         """
@@ -643,9 +1089,7 @@ if __name__ == '__main__':
     list_of_us_states = acs.uss.all_states()  # get a list of all US states in their abbreviations
     df = acs.get_key_acs5_variables()  # get a list of ACS5 variables to insert
     key_variable_ids = acs.get_key_acs5_variables()
-    for key_variable_id in tqdm(key_variable_ids,  total=len(key_variable_ids)):
-        print('== a new round: inserting data related to', key_variable_id)
-        print('variable property:', acs.get_variable_restriction_from_variable_id(key_variable_id))
-        for state_abbr in tqdm(list_of_us_states, total=len(list_of_us_states)):
-            acs.set_new_state(state_abbr)
-            acs.insert_variable_into_psql(key_variable_id, census_tract=True, verbose=False)
+    # read the files of each state once for all the variables, instead of once per variable
+    for state_abbr in tqdm(list_of_us_states, total=len(list_of_us_states)):
+        acs.set_new_state(state_abbr)
+        acs.insert_variables_into_psql(key_variable_ids, census_tract=True, verbose=False)
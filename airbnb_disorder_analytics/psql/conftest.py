@@ -0,0 +1,93 @@
+'''
+conftest.py
+
+fixtures shared by the tests of psql:
+    - file_server: a local http server, standing in for census.gov, that serves the files of a temporary folder
+                    and supports "Range: bytes={start}-" requests
+
+Dependencies:
+    - third-party packages: pytest
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import os
+import threading
+import functools
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+# third-party import
+import pytest
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    serve the files of a folder, with support for "Range: bytes={start}-" requests
+    """
+    def __init__(self, *args, range_starts, **kwargs):
+        """
+        :param range_starts: list -> the start of every range request received is appended to it
+        """
+        self.range_starts = range_starts
+        super().__init__(*args, **kwargs)
+
+    def send_head(self):
+        range_header = self.headers.get('Range')
+        path = self.translate_path(self.path)
+        if range_header is None or not os.path.isfile(path):
+            return super().send_head()
+        start = int(range_header.split('=')[1].rstrip('-'))
+        self.range_starts.append(start)
+        size = os.path.getsize(path)
+        if start >= size:
+            self.send_error(416)
+            return None
+        file = open(path, 'rb')
+        file.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Length', str(size - start))
+        self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        self.end_headers()
+        return file
+
+    def log_message(self, *args):
+        pass
+
+
+class FileServer:
+    """
+    a running RangeRequestHandler server and what the tests need to know about it
+    """
+    def __init__(self, folder):
+        """
+        :param folder: str -> the folder whose files are served
+        """
+        self.folder = folder
+        self.range_starts = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(
+            RangeRequestHandler, directory=folder, range_starts=self.range_starts))
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add_file(self, filename, content):
+        """
+        :param filename: str
+        :param content: bytes
+        :return: str -> the url of the file
+        """
+        with open(os.path.join(self.folder, filename), 'wb') as file:
+            file.write(content)
+        return f'{self.base_url}/{filename}'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    served_folder = tmp_path / 'served'
+    served_folder.mkdir()
+    server = FileServer(str(served_folder))
+    yield server
+    server.close()
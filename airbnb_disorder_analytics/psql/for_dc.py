@@ -8,7 +8,7 @@ matching is based on the longitude and latitude of the listing.
 
 Dependencies:
     - third-party packages: psycopg2, censusgeocode
-    - local packages: config.db_config, psql.match_property_to_census_tracts
+    - local packages: config.db_config, psql.match_property_to_census_tracts, psql.replicate_tables
 
 ruilin chen
 08/15/2020
@@ -27,6 +27,8 @@ from scipy.spatial import cKDTree
 # local import
 from airbnb_disorder_analytics.config.db_config import DBInfo
 from airbnb_disorder_analytics.config.us_states import USStates
+from airbnb_disorder_analytics.psql.replicate_tables import copy_dataframe_into_table
+from airbnb_disorder_analytics.psql.model_registry import load_model, list_models, predict_local_match
 
 airbnb_connection = psycopg2.connect(DBInfo.airbnb_config)
 airbnb_cursor = airbnb_connection.cursor()
@@ -109,6 +111,13 @@ def ckdnearest(all_nodes, target_node, k=1):
     return indices_of_min, dist[indices_of_min]
 
 def get_census_tract_id_from_code(acs_cursor, state_abbr):
+    """
+    get the census_tract_id of every census tract in a state together with its 5-digit census_tract_code
+
+    :param acs_cursor: psycopg2 cursor to acs5
+    :param state_abbr: str
+    :return: a pandas dataframe with two columns: census_tract_id, census_tract_code
+    """
     query = """SELECT census_tract_id, census_tract_code
                 FROM census_tracts
                 WHERE state_abbr = %s
@@ -116,67 +125,92 @@ def get_census_tract_id_from_code(acs_cursor, state_abbr):
                 """
     acs_cursor.execute(query, (state_abbr,))
     results = acs_cursor.fetchall()
-    code_to_id = {item[1]: item[0] for item in results}
-    return code_to_id
+    code_df = pd.DataFrame(results, columns=['census_tract_id', 'census_tract_code'])
+    return code_df
 
-def insert_by_pandas(city, state_abbr, crime_df, crime_columns=None, batch_size=10000):
+def insert_by_pandas(city, state_abbr, crime_df, code_df, crime_columns, connection):
     """
     insert crime incidents stored in a pandas dataframe into psql
 
-    :param city: st
+    census tract codes are matched to census_tract_ids with one merge against code_df, dates and years are
+    parsed column-wise, and the valid incidents are loaded with a single COPY.
+
+    :param city: str
+    :param state_abbr: str
     :param crime_df: a pandas dataframe with the raw data
+    :param code_df: a pandas dataframe with two columns: census_tract_id, census_tract_code
+                    (see get_census_tract_id_from_code())
     :param crime_columns: a dictionary with the keys being psql columns and values being the
                             corresponding pandas columns
-    :return: None
+    :param connection: psycopg2 connection to crime_data
+    :return: unmatched_df: a pandas dataframe with the census tract codes that are not in code_df
+                            and the number of incidents that have them
     """
-    error_count = 0
     if isinstance(crime_columns['date'], list):
         # if the crime date are stored in two separate columns, one for date and one for time of day,
-        # create a new column and combine them
-        crime_df['combined_date_time'] = crime_df[crime_columns['date'][0]] + ' ' + crime_df[
-            crime_columns['date'][1]]
-        crime_columns['date'] = 'combined_date_time'
-    for index, row in tqdm(crime_df.iterrows(), total=len(crime_df)):
-        incident_id = row[crime_columns['incident_id']]
-        description = row[crime_columns['description']]
-        longitude = row[crime_columns['longitude']]
-        latitude = row[crime_columns['latitude']]
-        census_tract_code = row[crime_columns['census_tract']]
-        try:
-            census_tract_id = code_to_id[census_tract_code]
-        except KeyError:
-            error_count += 1
-            continue
-        try:
-            year = pd.to_datetime(row[crime_columns['date']]).year
-        # if the provided date is out of bound, ignore the entry
-        except pd._libs.tslibs.np_datetime.OutOfBoundsDatetime:
-            error_count += 1
-            continue
-        date = row[crime_columns['date']]
-        # if date is not provided, print the row,
-        # ignore the entry and increment the error_count by 1
-        if pd.isnull(date):
-            print(row)
-            error_count += 1
-        else:
-            if pd.isnull(longitude) and pd.isnull(latitude):
-                # if none of the longitude, latitude and address columns have meaningful information,
-                # ignore the record and increment the error_count by 1
-                error_count += 1
-            else:
-                query = """INSERT INTO crime_incident (incident_id, description, longitude, latitude, census_tract_id, year, city, state, date) 
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                    ON CONFLICT (incident_id) DO NOTHING
-                                    RETURNING incident_id
-                                    ;
-                                """
-                values = (incident_id, description, longitude, latitude, census_tract_id, year, city, state_abbr, date)
-                crime_cursor.execute(query, values)
-                if index % batch_size == 0:
-                    crime_connection.commit()
-    crime_connection.commit()
-    print('== error count:', error_count)
+        # combine them
+        date = crime_df[crime_columns['date'][0]] + ' ' + crime_df[crime_columns['date'][1]]
+    else:
+        date = crime_df[crime_columns['date']]
+    # the raw census tract codes are numbers without the left paddings of zero
+    census_tract_code = pd.to_numeric(crime_df[crime_columns['census_tract']], errors='coerce').astype('Int64')
+    incident_df = pd.DataFrame({
+        'incident_id': crime_df[crime_columns['incident_id']],
+        'description': crime_df[crime_columns['description']],
+        'longitude': crime_df[crime_columns['longitude']],
+        'latitude': crime_df[crime_columns['latitude']],
+        'census_tract_code': census_tract_code.astype(str).str.zfill(5).where(census_tract_code.notnull()),
+        'date': date
+    })
+    incident_df = incident_df.merge(code_df, on='census_tract_code', how='left')
+    # dates that can't be parsed or are out of bound become NaT
+    incident_df['year'] = pd.to_datetime(incident_df['date'], errors='coerce').dt.year
+    is_matched = incident_df['census_tract_id'].notnull()
+    # if none of the longitude, latitude columns have meaningful information, ignore the record
+    is_valid = (incident_df['year'].notnull() & incident_df['date'].notnull()
+                & ~(incident_df['longitude'].isnull() & incident_df['latitude'].isnull()))
+    unmatched_df = incident_df.loc[~is_matched, 'census_tract_code'].fillna('missing').value_counts()
+    unmatched_df = unmatched_df.rename_axis('census_tract_code').reset_index(name='count_of_incidents')
+    incident_df = incident_df[is_matched & is_valid].copy()
+    incident_df['year'] = incident_df['year'].astype(int)
+    incident_df['city'] = city
+    incident_df['state'] = state_abbr
+    # the primary key of the partitioned crime_incident is (incident_id, year): skip the incident_ids
+    # that are already stored in any year, as the insertion did before the table was partitioned
+    incident_df = incident_df.drop_duplicates(subset=['incident_id'])
+    cursor = connection.cursor()
+    query = """SELECT incident_id
+                FROM crime_incident
+                WHERE incident_id = ANY(%s)
+                ;
+                """
+    cursor.execute(query, (incident_df['incident_id'].astype(str).tolist(), ))
+    existing_incident_ids = {incident_id for (incident_id, ) in cursor.fetchall()}
+    incident_df = incident_df[~incident_df['incident_id'].astype(str).isin(existing_incident_ids)]
+    copy_dataframe_into_table(connection, incident_df, 'crime_incident',
+                              columns=['incident_id', 'description', 'longitude', 'latitude', 'census_tract_id',
+                                       'year', 'city', 'state', 'date'],
+                              primary_keys=None)
+    print('== error count:', int((~is_matched | ~is_valid).sum()), '\t unmatched census tracts:', len(unmatched_df))
+    return unmatched_df
+
+def insert_crime_files(city, state_abbr, data_folder, list_of_filenames, code_df, crime_columns, connection):
+    """
+    insert crime incidents from several csv files (e.g. one per year) into psql, one bulk load per file
+
+    :return: unmatched_df: a pandas dataframe with the unmatched census tract codes of all the files
+    """
+    list_of_unmatched_dfs = []
+    for filename in list_of_filenames:
+        crime_df = pd.read_csv(os.path.join(data_folder, filename))
+        unmatched_df = insert_by_pandas(city, state_abbr, crime_df, code_df, crime_columns, connection)
+        unmatched_df['filename'] = filename
+        list_of_unmatched_dfs.append(unmatched_df)
+    unmatched_df = pd.concat(list_of_unmatched_dfs, ignore_index=True)
+    if len(unmatched_df):
+        print('unmatched census tract codes:')
+        print(unmatched_df.to_string(index=False))
+    return unmatched_df
 
 def get_geolocated_points_by_state(state_abbr):  # include geolocated records in crime_data
     state_id = uss.abbr_to_fips[state_abbr]
@@ -217,14 +251,8 @@ def geolocate_airbnb_points(state_abbr, batch_size, verbose=True):
         update_census_tract_to_psql(property_id, census_tract_id, verbose)
         airbnb_connection.commit()
 
-def load_classifer(pkl_name):
-    with open(pkl_name, 'rb') as file:
-        pickle_model = pickle.load(file)
-    return pickle_model
-
 def predict_matching(input):
-    output = clf.predict(np.array([input]).reshape(1, -1))
-    return bool(output[0])
+    return predict_local_match(matching_model, input)
 
 def geolocate_point(longitude, latitude):
     target_node = np.array([[longitude, latitude]])
@@ -273,7 +301,6 @@ if __name__ == '__main__':
     uss = USStates()
 
     data_folder = '/home/rchen/Documents/github/airbnb_crime/data/crime_data'
-    code_folder = '/home/rchen/Documents/github/airbnb_crime/airbnb_disorder_analytics/psql'
     crime_filenames = ['DC_Crime_Incidents_in_2019.csv',
                       'DC_Crime_Incidents_in_2018.csv',
                       'DC_Crime_Incidents_in_2017.csv',
@@ -288,16 +315,19 @@ if __name__ == '__main__':
                      'date': 'REPORT_DAT',
                      'census_tract': 'CENSUS_TRACT'
                      }
-    code_to_id = get_census_tract_id_from_code(acs_cursor=acs5_cursor, state_abbr='DC')
+    code_df = get_census_tract_id_from_code(acs_cursor=acs5_cursor, state_abbr='DC')
 
-    # for crime_file in crime_filenames:
-    #     df = pd.read_csv(os.path.join(data_folder, crime_file))
-    #     #print(df.columns)
-    #     df['CENSUS_TRACT'] = df['CENSUS_TRACT'].astype('Int64').astype(str).str.zfill(5)
-    #     insert_by_pandas(city, state_abbr, df, crime_columns=crime_columns)
+    # insert_crime_files(city, state_abbr, data_folder, crime_filenames, code_df, crime_columns, crime_connection)
     all_geolocated_points = get_geolocated_points_by_state(state_abbr)
     all_geolocated_nodes = np.array([[point[0], point[1]] for point in all_geolocated_points])
-    clf = load_classifer(os.path.join(code_folder, 'matching_classifier_DC.pkl'))
+    # geolocate_point() only computes the nearest distance: use the newest classifier that takes it alone,
+    # not the newest one overall (which may look at more neighbors)
+    models_df = list_models(state_abbr)
+    nearest_versions = models_df.loc[models_df['k'] == 1, 'version'] if len(models_df) else []
+    if len(nearest_versions) == 0:
+        raise FileNotFoundError(f'no nearest-distance (k = 1) matching classifier for {state_abbr}')
+    matching_model = load_model(state_abbr, version=int(max(nearest_versions)))
+    assert matching_model['k'] == 1
     while True:
         geolocate_airbnb_points(state_abbr, batch_size=10000, verbose=False)
 
@@ -0,0 +1,148 @@
+'''
+geolocate_crimes_in_parallel.py
+
+this script geolocates crime incidents of several states at the same time by running one CrimeDB
+per state in its own process. each process opens its own database connections and builds its
+own index of geolocated points and its own matching classifier, so the states don't share
+any state with each other. the number of geolocated incidents reported by every process
+is collected into a single progress bar and a summary table at the end.
+
+Dependencies:
+    - third-party packages: psycopg2
+    - local packages: config.db_config, psql.match_crime_to_census_tracts
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import time
+import queue
+import multiprocessing
+import pandas as pd
+from tqdm import tqdm
+# third-party import
+import psycopg2
+# local import
+from airbnb_disorder_analytics.config.db_config import DBInfo
+from airbnb_disorder_analytics.psql.match_crime_to_census_tracts import CrimeDB
+
+__all__ = ['geolocate_state', 'geolocate_states_in_parallel']
+
+
+def count_ungeolocated_crimes(crime_cursor, state_abbr, year=None):
+    """
+    count crime incidents with longitude/latitude that are yet to be geolocated
+
+    :param crime_cursor: psycopg2 cursor to crime_data
+    :param state_abbr: str
+    :param year: int -> count crime incidents that happen in one year only
+    :return: int
+    """
+    if year is not None:
+        query = """SELECT COUNT(*)
+                    FROM crime_incident
+                    WHERE longitude IS NOT NULL
+                    AND longitude != 'NaN'
+                    AND longitude < -50
+                    AND latitude > 20
+                    AND census_tract_id IS NULL
+                    AND year = %s
+                    AND state = %s
+                    ;
+                    """
+        crime_cursor.execute(query, (year, state_abbr))
+    else:
+        query = """SELECT COUNT(*)
+                    FROM crime_incident
+                    WHERE longitude IS NOT NULL
+                    AND longitude != 'NaN'
+                    AND longitude < -50
+                    AND latitude > 20
+                    AND census_tract_id IS NULL
+                    AND state = %s
+                    ;
+                    """
+        crime_cursor.execute(query, (state_abbr, ))
+    return crime_cursor.fetchone()[0]
+
+
+def geolocate_state(state_abbr, year=None, batch_size=10000, progress_queue=None):
+    """
+    geolocate all the crime incidents of one state; designed to run in a worker process
+
+    :param state_abbr: str
+    :param year: int -> process crime incidents that happen in one year only
+    :param batch_size: int -> number of crime incidents to process per batch
+    :param progress_queue: a multiprocessing queue that receives (state_abbr, count of incidents processed)
+                            after each batch
+    :return: a dictionary that summarizes the run for this state
+    """
+    start_time = time.time()
+    crime_connection = psycopg2.connect(DBInfo.crime_config)
+    acs5_connection = psycopg2.connect(DBInfo.acs5_config)
+    airbnb_connection = psycopg2.connect(DBInfo.airbnb_config)
+    cdb = CrimeDB(state_abbr=state_abbr)
+    cdb.connect_to_db(acs5={'connection': acs5_connection, 'cursor': acs5_connection.cursor()},
+                      crime={'connection': crime_connection, 'cursor': crime_connection.cursor()},
+                      airbnb={'connection': airbnb_connection, 'cursor': airbnb_connection.cursor()})
+    cdb.batch_size = batch_size
+    try:
+        while True:
+            # the batch is empty only when every incident has been processed, geolocated or not
+            count = cdb.local_geolocating(year=year, verbose=False, show_progress=False)
+            if count == 0:
+                break
+            if progress_queue is not None:
+                progress_queue.put((state_abbr, count))
+    finally:
+        for connection in [crime_connection, acs5_connection, airbnb_connection]:
+            connection.close()
+    return {
+        'state': state_abbr,
+        'geolocated': cdb.geolocated_count,
+        'local_matches': cdb.local_match_count,
+        'api_calls': cdb.api_match_count,
+        'seconds': round(time.time() - start_time, 1)
+    }
+
+
+def geolocate_states_in_parallel(list_of_states, processes=None, year=None, batch_size=10000):
+    """
+    geolocate the crime incidents of several states at once, one state per process
+
+    :param list_of_states: a list of state abbreviations
+    :param processes: int -> max number of states processed at the same time; defaults to number of cores
+    :param year: int -> process crime incidents that happen in one year only
+    :param batch_size: int -> number of crime incidents each process handles per batch
+    :return: a pandas dataframe with one row per state
+    """
+    crime_connection = psycopg2.connect(DBInfo.crime_config)
+    crime_cursor = crime_connection.cursor()
+    total_count = sum([count_ungeolocated_crimes(crime_cursor, state_abbr, year) for state_abbr in list_of_states])
+    crime_connection.close()
+    if processes is None:
+        processes = min(len(list_of_states), multiprocessing.cpu_count())
+    manager = multiprocessing.Manager()
+    progress_queue = manager.Queue()
+    progress_bar = tqdm(total=total_count)
+    with multiprocessing.Pool(processes) as pool:
+        async_results = [pool.apply_async(geolocate_state, (state_abbr, year, batch_size, progress_queue))
+                         for state_abbr in list_of_states]
+        while not all([async_result.ready() for async_result in async_results]) or not progress_queue.empty():
+            try:
+                state_abbr, count = progress_queue.get(timeout=1)
+                progress_bar.update(count)
+            except queue.Empty:
+                continue
+        list_of_reports = [async_result.get() for async_result in async_results]
+    progress_bar.close()
+    report_df = pd.DataFrame(list_of_reports)
+    report_df['points_per_second'] = (report_df['geolocated'] / report_df['seconds']).round(1)
+    print(report_df.to_string(index=False))
+    print('total geolocated:', report_df['geolocated'].sum(),
+          '\t total api calls:', report_df['api_calls'].sum())
+    return report_df
+
+
+if __name__ == '__main__':
+    geolocate_states_in_parallel(['NY', 'CA', 'IL', 'MA', 'TX'])
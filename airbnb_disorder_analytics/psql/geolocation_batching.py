@@ -0,0 +1,100 @@
+'''
+geolocation_batching.py
+
+this script includes the helpers that the batch geolocation of airbnb listings
+(psql.match_property_to_census_tracts) uses around the census API, none of which needs the database:
+    - RateLimiter: spaces out the calls of all the threads to the census API
+    - RetryBudget: the total number of retries all the threads are allowed to make
+    - group_properties_by_location(): group the listings that share a location, so that it is geolocated once
+
+Dependencies:
+    - none
+
+ruilin chen
+10/19/2026
+'''
+
+# system import
+import time
+import threading
+
+__all__ = ['RateLimiter', 'RetryBudget', 'group_properties_by_location', 'print_deduplication_ratio']
+
+
+class RateLimiter:
+    """
+    spaces out calls to the census API so that all the threads together make at most
+    max_calls_per_second calls per second
+    """
+    def __init__(self, max_calls_per_second):
+        self.interval = 1.0 / max_calls_per_second
+        self.next_call_time = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        block the calling thread until it is allowed to make the next call
+        """
+        with self.lock:
+            now = time.time()
+            wait_time = self.next_call_time - now
+            self.next_call_time = max(now, self.next_call_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class RetryBudget:
+    """
+    the total number of retries all the threads are allowed to make;
+    once used up, failed calls are given up on instead of retried
+    """
+    def __init__(self, max_retries):
+        self.remaining_retries = max_retries
+        self.lock = threading.Lock()
+
+    def spend(self):
+        """
+        :return: boolean -> whether a retry is still allowed
+        """
+        with self.lock:
+            if self.remaining_retries <= 0:
+                return False
+            self.remaining_retries -= 1
+            return True
+
+
+def group_properties_by_location(list_of_properties, precision=5):
+    """
+    group listings whose coordinates are identical once rounded to a number of decimal places
+    (5 decimal places is about one meter), so that each location only needs to be geolocated once.
+    airbnb obfuscates coordinates, and many listings end up sharing the exact same ones.
+
+    :param list_of_properties: list -> [(property_id, longitude, latitude)...]
+    :param precision: int -> number of decimal places kept when comparing coordinates
+    :return: list_of_locations: list -> [(longitude, latitude, [property_id, ...])...]
+                                        where longitude and latitude are those of the first listing in the group
+    """
+    coordinates_by_location = {}
+    property_ids_by_location = {}
+    for property_id, longitude, latitude in list_of_properties:
+        if longitude is None or latitude is None:
+            location = (property_id, )  # listings without coordinates are never grouped
+        else:
+            location = (round(longitude, precision), round(latitude, precision))
+        if location not in coordinates_by_location:
+            coordinates_by_location[location] = (longitude, latitude)
+            property_ids_by_location[location] = []
+        property_ids_by_location[location].append(property_id)
+    return [(longitude, latitude, property_ids_by_location[location])
+            for location, (longitude, latitude) in coordinates_by_location.items()]
+
+
+def print_deduplication_ratio(list_of_properties, list_of_locations):
+    """
+    :param list_of_properties: list -> the listings of a batch
+    :param list_of_locations: list -> the output of group_properties_by_location() for the same batch
+    :return: None
+    """
+    if list_of_locations:
+        print('listings:', len(list_of_properties), '\t distinct locations:', len(list_of_locations),
+              '\t deduplication ratio: {:.2f}'.format(len(list_of_properties) / len(list_of_locations)))
@@ -0,0 +1,107 @@
+'''
+ingest_acs_in_parallel.py
+
+this script inserts ACS 5-year variables of several states at the same time by running one ACSInsertion
+per state in its own process. the table structure (appendix file) and the summary file templates only
+depend on the year, so they are read once by the parent process and handed to every worker when it starts;
+each worker then reads the summary files of its state once and inserts all the requested variables
+(see ACSInsertion.insert_variables_into_psql). the time spent on every state is reported in a summary
+table at the end.
+
+Dependencies:
+    - local packages: psql.build_acs_database
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import time
+import multiprocessing
+import pandas as pd
+from tqdm import tqdm
+# local import
+from airbnb_disorder_analytics.psql.build_acs_database import ACSInsertion, VariablesInSummaryFile
+
+__all__ = ['ingest_state', 'ingest_states_in_parallel']
+
+# metadata of the year shared by all the states, set in every worker by _init_worker()
+_shared_metadata = {}
+
+
+def _init_worker(metadata):
+    global _shared_metadata
+    _shared_metadata = metadata
+
+
+def ingest_state(state_abbr, year, list_of_variable_ids, census_block=False, census_tract=True):
+    """
+    insert all the requested variables of one state; designed to run in a worker process
+
+    :param state_abbr: str
+    :param year: int
+    :param list_of_variable_ids: a list of str
+    :param census_block: boolean -> whether the neighborhood is defined as census block
+    :param census_tract: boolean -> whether the neighborhood is defined as census tract
+    :return: a dictionary that summarizes the run for this state
+    """
+    start_time = time.time()
+    acs = ACSInsertion(year, state_abbr, verbose=False,
+                       table_structure_df=_shared_metadata.get('table_structure_df'),
+                       variables_in_summary=_shared_metadata.get('variables_in_summary'),
+                       variable_index=_shared_metadata.get('variable_index'))
+    load_seconds = time.time() - start_time
+    try:
+        count_of_rows = acs.insert_variables_into_psql(list_of_variable_ids, census_block=census_block,
+                                                       census_tract=census_tract, verbose=False)
+    finally:
+        acs.connection.close()
+    return {
+        'state': state_abbr,
+        'variables': len(list_of_variable_ids),
+        'rows': count_of_rows,
+        'load_seconds': round(load_seconds, 1),
+        'seconds': round(time.time() - start_time, 1)
+    }
+
+
+def ingest_states_in_parallel(year, list_of_states, list_of_variable_ids, census_block=False, census_tract=True,
+                              processes=None):
+    """
+    insert the requested variables of several states at once, one state per process
+
+    :param year: int
+    :param list_of_states: a list of state abbreviations
+    :param list_of_variable_ids: a list of str
+    :param census_block: boolean -> whether the neighborhood is defined as census block
+    :param census_tract: boolean -> whether the neighborhood is defined as census tract
+    :param processes: int -> max number of states processed at the same time; defaults to number of cores
+    :return: a pandas dataframe with one row per state
+    """
+    # the appendix and the templates are the same for every state of the year: read them once
+    vsf = VariablesInSummaryFile(year, list_of_states[0])
+    # the tables and variables of the year; a no-op once the database has all of them
+    vsf.insert_table_structure_into_psql(verbose=False)
+    vsf.insert_survey_variables_into_psql(verbose=False)
+    vsf.connection.close()
+    metadata = {'table_structure_df': vsf.table_structure_df, 'variables_in_summary': vsf.variables_in_summary,
+                'variable_index': vsf.variable_index}
+    if processes is None:
+        processes = min(len(list_of_states), multiprocessing.cpu_count())
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(metadata, )) as pool:
+        async_results = [pool.apply_async(ingest_state, (state_abbr, year, list_of_variable_ids, census_block,
+                                                         census_tract))
+                         for state_abbr in list_of_states]
+        list_of_reports = [async_result.get() for async_result in tqdm(async_results, total=len(async_results))]
+    report_df = pd.DataFrame(list_of_reports)
+    report_df['rows_per_second'] = (report_df['rows'] / report_df['seconds']).round(1)
+    print(report_df.to_string(index=False))
+    print('total rows:', report_df['rows'].sum(), '\t total seconds:', report_df['seconds'].sum())
+    return report_df
+
+
+if __name__ == '__main__':
+    acs = ACSInsertion(2018, 'NY', verbose=False)
+    key_variable_ids = acs.get_key_acs5_variables()  # get a list of ACS5 variables to insert
+    list_of_us_states = acs.uss.all_states()  # get a list of all US states in their abbreviations
+    acs.connection.close()
+    ingest_states_in_parallel(2018, list_of_us_states, key_variable_ids)
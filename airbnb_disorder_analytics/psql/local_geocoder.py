@@ -0,0 +1,142 @@
+'''
+local_geocoder.py
+
+this script provides a local replacement for the census geocoder API: it finds the census block
+to which a point defined by its longitude and latitude belongs by looking the point up in the
+2010 census block polygons (TIGER/Line shapefiles) stored on disk.
+
+the result has the same structure as match_property_to_census_tracts.get_census_tract_by_geo_info(),
+so callers can switch between the two engines by setting config.geocoder_config.GeocoderInfo.engine.
+points are looked up in bulk with a spatial join against an r-tree index of the polygons, so
+hundreds of thousands of points can be geolocated per minute on one machine without any network call.
+
+Dependencies:
+    - third-party packages: geopandas
+    - local packages: config.geocoder_config, config.us_states, psql.build_acs_database
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import os
+import pandas as pd
+# third-party import
+import geopandas as gpd
+# local import
+from airbnb_disorder_analytics.config.geocoder_config import GeocoderInfo
+from airbnb_disorder_analytics.config.us_states import USStates
+from airbnb_disorder_analytics.psql.build_acs_database import Downloader
+
+__all__ = ['LocalGeocoder', 'get_local_geocoder', 'download_block_shapefiles']
+
+# one geocoder per process, created on first use by get_local_geocoder()
+_local_geocoder = None
+
+
+class LocalGeocoder:
+    """
+    reverse-geocode points to 2010 census blocks using census block polygons
+    """
+    def __init__(self, shapefile_folder, states=None):
+        """
+        :param shapefile_folder: str -> folder with the tl_2010_{state_fips}_tabblock10.shp files
+        :param states: a list of state fips codes to load; load all the shapefiles in the folder if None
+        """
+        self.shapefile_folder = shapefile_folder
+        self.states = states
+        self.blocks = None  # a geopandas dataframe with one polygon per census block, loaded on first lookup
+        self.block_id_column = 'GEOID10'
+
+    def _load_blocks(self):
+        """
+        read the census block shapefiles and build the spatial index used by the lookups
+        """
+        list_of_block_dfs = []
+        for filename in sorted(os.listdir(self.shapefile_folder)):
+            if not (filename.endswith('.shp') and 'tabblock10' in filename):
+                continue
+            state_id = filename.split('_')[2][:2]  # tl_2010_{state_fips}_tabblock10.shp
+            if self.states is not None and state_id not in self.states:
+                continue
+            block_df = gpd.read_file(os.path.join(self.shapefile_folder, filename))
+            list_of_block_dfs.append(block_df[[self.block_id_column, 'geometry']])
+        if not list_of_block_dfs:
+            raise FileNotFoundError(f'no census block shapefiles found in {self.shapefile_folder}')
+        self.blocks = gpd.GeoDataFrame(pd.concat(list_of_block_dfs, ignore_index=True),
+                                       crs=list_of_block_dfs[0].crs)
+        self.blocks.sindex  # build the r-tree once instead of on the first join
+
+    def lookup_many(self, longitudes, latitudes):
+        """
+        find the census geographies of many points at once
+
+        :param longitudes: a list or array of floats
+        :param latitudes: a list or array of floats
+        :return: a pandas dataframe in the same order as the input points, with the columns
+                    census_block_id, census_tract_id, county_id and state_id
+                    (all None for points that don't fall in any loaded census block)
+        """
+        if self.blocks is None:
+            self._load_blocks()
+        # the TIGER/Line shapefiles use NAD83 (EPSG:4269), which is what the census geocoder expects as well
+        points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(longitudes, latitudes), crs=self.blocks.crs)
+        joined_df = gpd.sjoin(points, self.blocks, how='left', predicate='within')
+        # a point on the border of two blocks matches both; keep one of them like the census API does
+        joined_df = joined_df[~joined_df.index.duplicated(keep='first')].sort_index()
+        census_block_id = joined_df[self.block_id_column]
+        matched_df = pd.DataFrame({
+            'census_block_id': census_block_id,
+            'census_tract_id': census_block_id.str[:11],
+            'county_id': census_block_id.str[:5],
+            'state_id': census_block_id.str[:2]
+        })
+        return matched_df.where(matched_df.notnull(), None).reset_index(drop=True)
+
+    def lookup(self, longitude, latitude):
+        """
+        find the census geographies of one point
+
+        :param longitude: float
+        :param latitude: float
+        :return: matched_dict: dictionary with four keys, or None if the point is not in any loaded block:
+                                - census_block_id
+                                - census_tract_id
+                                - county_id
+                                - state_id
+        """
+        matched_dict = self.lookup_many([longitude], [latitude]).iloc[0].to_dict()
+        if matched_dict['census_block_id'] is None:
+            return None
+        return matched_dict
+
+
+def get_local_geocoder():
+    """
+    :return: the LocalGeocoder of this process, configured by config.geocoder_config.GeocoderInfo
+    """
+    global _local_geocoder
+    if _local_geocoder is None:
+        _local_geocoder = LocalGeocoder(GeocoderInfo.block_shapefile_folder, GeocoderInfo.states)
+    return _local_geocoder
+
+
+def download_block_shapefiles(list_of_states):
+    """
+    download the 2010 census block shapefiles of the given states into GeocoderInfo.block_shapefile_folder
+
+    :param list_of_states: a list of state abbreviations
+    :return: None
+    """
+    uss = USStates()
+    # the zip files are downloaded next to the shapefile folder, i.e. into its parent: create both on a fresh checkout
+    os.makedirs(GeocoderInfo.block_shapefile_folder, exist_ok=True)
+    for state_abbr in list_of_states:
+        state_id = uss.abbr_to_fips[state_abbr]
+        zip_url = '/'.join([GeocoderInfo.block_shapefile_base_url, f'tl_2010_{state_id}_tabblock10.zip'])
+        if not os.path.isfile(os.path.join(GeocoderInfo.block_shapefile_folder, f'tl_2010_{state_id}_tabblock10.shp')):
+            Downloader.download_and_unzip_zip_file(zip_url, GeocoderInfo.block_shapefile_folder)
+
+
+if __name__ == '__main__':
+    download_block_shapefiles(['NY', 'CA', 'IL', 'MA', 'TX', 'DC'])
+    print(get_local_geocoder().lookup(-73.9857, 40.7484))
@@ -247,6 +247,7 @@ if __name__ == '__main__':
     # cdb.drop_crimes_by_year(2014)
     ## geolocate crime using airbnb
     cdb.batch_size = 10000
-    while True:
-        #cdb.local_geolocating(year=2019, verbose=False)
-        cdb.local_geolocating(verbose=False)
\ No newline at end of file
+    # local_geolocating returns 0 once every incident has been processed
+    #while cdb.local_geolocating(year=2019, verbose=False):
+    while cdb.local_geolocating(verbose=False):
+        pass
\ No newline at end of file
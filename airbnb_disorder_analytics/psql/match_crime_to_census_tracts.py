@@ -9,7 +9,8 @@ matching is based on the longitude and latitude of the listing.
 
 Dependencies:
     - third-party packages: psycopg2, censusgeocode
-    - local packages: config.db_config, psql.match_property_to_census_tracts
+    - local packages: config.db_config, config.replication_config,
+                      psql.match_property_to_census_tracts, psql.replicate_tables
 
 ruilin chen
 08/15/2020
@@ -35,6 +36,10 @@ import censusgeocode as cg
 from airbnb_disorder_analytics.config.db_config import DBInfo
 from airbnb_disorder_analytics.psql.match_property_to_census_tracts import get_census_tract_by_geo_info
 from airbnb_disorder_analytics.config.us_states import USStates
+from airbnb_disorder_analytics.config.replication_config import ReferenceTableInfo
+from airbnb_disorder_analytics.psql.replicate_tables import copy_table_between_databases
+from airbnb_disorder_analytics.psql.matching_features import get_neighbor_features, sample_index_points
+from airbnb_disorder_analytics.psql.model_registry import load_model, predict_local_match
 
 
 
@@ -90,7 +95,15 @@ class CrimeDB:
         self.city = None
         self.all_geolocated_points = None
         self.all_geolocated_nodes = None
-        self.matching_classifier_name = f'matching_classifier_{self.state_abbr.upper()}.pkl'
+        self.all_geolocated_census_tracts = None  # numpy array of the census tracts of all_geolocated_nodes
+        self.geolocated_tree = None  # cKDTree over all_geolocated_nodes, built once per state
+        self.local_match_count = 0  # number of points matched by the local classifier
+        self.api_match_count = 0  # number of points that fell back to the censusgeocode API
+        self.geolocated_count = 0  # number of crime incidents updated by local_geolocating
+        # incident_id after which local_geolocating selects its next batch, so that the incidents
+        # it couldn't geolocate are not selected again
+        self.last_selected_incident_id = None
+        self.crime_partition_prefix = 'crime_incident_y'  # crime_incident is partitioned by year
         self.city_to_crime_filename = {}
         self.data_folder = '/home/rchen/Documents/github/airbnb_crime/data/crime_data'
         self.crime_filename_by_city = {
@@ -170,8 +183,24 @@ class CrimeDB:
             'seattle': 'WA',
             'sf': 'CA'
         }
-        self.cwd = '/home/rchen/Documents/github/airbnb_crime/airbnb_disorder_analytics/psql'
-        self.clf = self.load_classifer(os.path.join(self.cwd, self.matching_classifier_name))
+        self.matching_model = None  # the state's matching classifier, loaded from psql.model_registry on first use
+
+    def set_matching_model(self, model):
+        """
+        :param model: either a dictionary returned by model_registry.load_model(), or
+                        a fitted estimator that takes the nearest distance only
+        """
+        if not isinstance(model, dict):
+            model = {'clf': model, 'k': 1, 'threshold': None}
+        self.matching_model = model
+
+    def get_matching_model(self):
+        """
+        :return: dictionary -> the matching classifier of the state and its metadata (see psql.model_registry)
+        """
+        if self.matching_model is None:
+            self.matching_model = load_model(self.state_abbr)
+        return self.matching_model
 
     def connect_to_db(self, acs5={'connection': '', 'cursor': ''},
                       crime={'connection': '', 'cursor': ''},
@@ -186,38 +215,140 @@ class CrimeDB:
     def copy_census_tracts_from_acs5(self):
         """
         copies the entire census_tracts table from acs5 into crime_data
+        by streaming it between the two connections (see psql.replicate_tables)
+        """
+        table_info = ReferenceTableInfo.census_tracts
+        copy_table_between_databases(self.acs5_connection, self.crime_connection, table_info['table'],
+                                     table_info['columns'], table_info['primary_keys'])
+
+    def create_crime_partition(self, year):
         """
-        acs5_query = """SELECT census_tract_id, census_tract_code, state_id, county_id, county_name, state_abbr, state
-                            FROM census_tracts
-                            ;
+        create the partition that stores crime incidents of a given year, if it doesn't exist yet
+
+        :param year: int
+        :return: str -> name of the partition
+        """
+        partition_name = f'{self.crime_partition_prefix}{int(year)}'
+        query = """CREATE TABLE IF NOT EXISTS {} PARTITION OF crime_incident
+                    FOR VALUES FROM (%s) TO (%s)
+                    ;
+                    """.format(partition_name)
+        self.crime_cursor.execute(query, (int(year), int(year) + 1))
+        return partition_name
+
+    def partition_crime_incident_by_year(self, first_year, last_year):
+        """
+        convert crime_incident into a table partitioned by year, so that incidents of one year
+        live in their own partition (crime_incident_y{year}) and year-filtered queries only scan
+        the partitions they need. incidents outside [first_year, last_year] go to crime_incident_default.
+
+        the existing table is renamed to crime_incident_unpartitioned and its rows are moved into the
+        new partitions; the old table is kept until the user drops it manually.
+        note: the primary key becomes (incident_id, year) since postgres requires the partition key
+        to be part of any unique constraint on a partitioned table; the other indexes of the old table
+        are recreated on the new one. _insert_by_pandas still skips an incident_id that exists in any year.
+
+        :param first_year: int
+        :param last_year: int
+        :return: None
+        """
+        query = """SELECT relkind
+                    FROM pg_class
+                    WHERE relname = 'crime_incident'
+                    ;
+                    """
+        self.crime_cursor.execute(query)
+        result = self.crime_cursor.fetchone()
+        if result is not None and result[0] == 'p':
+            print('crime_incident is already partitioned')
+        else:
+            self.crime_cursor.execute("""ALTER TABLE crime_incident RENAME TO crime_incident_unpartitioned;""")
+            self.crime_cursor.execute("""CREATE TABLE crime_incident
+                                            (LIKE crime_incident_unpartitioned INCLUDING DEFAULTS)
+                                            PARTITION BY RANGE (year)
+                                            ;
+                                        """)
+            self.crime_cursor.execute("""ALTER TABLE crime_incident ADD PRIMARY KEY (incident_id, year);""")
+            # the unique indexes can't be copied (they don't include year); the others are recreated as they are
+            query = """SELECT indexname, indexdef
+                        FROM pg_indexes
+                        WHERE tablename = 'crime_incident_unpartitioned'
+                        AND indexdef NOT LIKE 'CREATE UNIQUE%'
+                        ;
                         """
-        self.acs5_cursor.execute(acs5_query)
-        results = self.acs5_cursor.fetchall()
-
-        crime_query = """INSERT INTO census_tracts (census_tract_id, census_tract_code, state_id, county_id, county_name, state_abbr, state) 
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (census_tract_id) DO NOTHING
-                            RETURNING census_tract_id
-                            ;
+            self.crime_cursor.execute(query)
+            for index_name, index_definition in self.crime_cursor.fetchall():
+                self.crime_cursor.execute("""CREATE INDEX IF NOT EXISTS {}_by_year ON crime_incident USING {};"""
+                                          .format(index_name, index_definition.split(' USING ', 1)[1]))
+            self.crime_cursor.execute("""CREATE INDEX IF NOT EXISTS crime_incident_state_census_tract_id
+                                            ON crime_incident (state, census_tract_id)
+                                            ;
+                                        """)
+            self.crime_cursor.execute("""CREATE TABLE crime_incident_default PARTITION OF crime_incident DEFAULT;""")
+        for year in range(first_year, last_year + 1):
+            self.create_crime_partition(year)
+        if result is None or result[0] != 'p':
+            query = """INSERT INTO crime_incident
+                        SELECT * FROM crime_incident_unpartitioned
+                        ON CONFLICT DO NOTHING
+                        ;
                         """
-        for index, result in tqdm(enumerate(results), total=len(results)):
-            self.crime_cursor.execute(crime_query, result)
-            if index % self.batch_size == 0:
-                self.crime_connection.commit()
+            self.crime_cursor.execute(query)
+            print('moved records into partitions:', self.crime_cursor.rowcount)
+        self.crime_connection.commit()
+
+    def get_crime_partitions(self):
+        """
+        get the yearly partitions of crime_incident
+
+        :return: a dictionary with keys being years and values being partition names
+        """
+        query = """SELECT child.relname
+                    FROM pg_inherits, pg_class AS parent, pg_class AS child
+                    WHERE pg_inherits.inhparent = parent.oid
+                    AND pg_inherits.inhrelid = child.oid
+                    AND parent.relname = 'crime_incident'
+                    ;
+                    """
+        self.crime_cursor.execute(query)
+        partition_by_year = {}
+        for (partition_name, ) in self.crime_cursor.fetchall():
+            year = partition_name[len(self.crime_partition_prefix):]
+            if partition_name.startswith(self.crime_partition_prefix) and year.isdigit():
+                partition_by_year[int(year)] = partition_name
+        return partition_by_year
 
     def drop_crimes_by_year(self, year):
         """
         keep only crimes in recent years in the database
+
+        yearly partitions older than the given year are detached and dropped, which is instant
+        regardless of their size; rows in the default partition are deleted without being
+        fetched back into python.
         :param year: int
         :return:
         """
+        count_of_results = 0
+        for partition_year, partition_name in sorted(self.get_crime_partitions().items()):
+            if partition_year >= year:
+                continue
+            # reltuples is the planner's row estimate; good enough for reporting without a full scan
+            query = """SELECT reltuples::bigint
+                        FROM pg_class
+                        WHERE relname = %s
+                        ;
+                        """
+            self.crime_cursor.execute(query, (partition_name, ))
+            count_of_results += max(self.crime_cursor.fetchone()[0], 0)
+            self.crime_cursor.execute("""ALTER TABLE crime_incident DETACH PARTITION {};""".format(partition_name))
+            self.crime_cursor.execute("""DROP TABLE {};""".format(partition_name))
+            print('dropped partition:', partition_name)
         query = """DELETE FROM crime_incident
                     WHERE year < %s
-                    RETURNING *
                     ;
                     """
         self.crime_cursor.execute(query, (year, ))
-        count_of_results = len(self.crime_cursor.fetchall())
+        count_of_results += self.crime_cursor.rowcount
         self.crime_connection.commit()
         print('deleted records:', count_of_results)
 
@@ -266,12 +397,13 @@ class CrimeDB:
                     # later census tracts can be geolocated by using the address
                     address = row[crime_columns['address']]
                     query = """INSERT INTO crime_incident (incident_id, description, address, year, city, state, date) 
-                                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                                            ON CONFLICT (incident_id) DO NOTHING
+                                            SELECT %s, %s, %s, %s, %s, %s, %s
+                                            WHERE NOT EXISTS (SELECT 1 FROM crime_incident WHERE incident_id = %s)
+                                            ON CONFLICT DO NOTHING
                                             RETURNING incident_id
                                             ;
                                         """
-                    values = (incident_id, description, address, year, city, state_abbr, date)
+                    values = (incident_id, description, address, year, city, state_abbr, date, incident_id)
                     self.crime_cursor.execute(query, values)
                     if index % self.batch_size == 0:
                         self.crime_connection.commit()
@@ -281,12 +413,13 @@ class CrimeDB:
                     error_count += 1
                 else:
                     query = """INSERT INTO crime_incident (incident_id, description, longitude, latitude, year, city, state, date) 
-                                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                                        ON CONFLICT (incident_id) DO NOTHING
+                                        SELECT %s, %s, %s, %s, %s, %s, %s, %s
+                                        WHERE NOT EXISTS (SELECT 1 FROM crime_incident WHERE incident_id = %s)
+                                        ON CONFLICT DO NOTHING
                                         RETURNING incident_id
                                         ;
                                     """
-                    values = (incident_id, description, longitude, latitude, year, city, state_abbr, date)
+                    values = (incident_id, description, longitude, latitude, year, city, state_abbr, date, incident_id)
                     self.crime_cursor.execute(query, values)
                     if index % self.batch_size == 0:
                         self.crime_connection.commit()
@@ -311,8 +444,12 @@ class CrimeDB:
             self._insert_by_pandas(city, crime_df)
 
     def get_geolocated_points_by_state(self):  # include geolocated records in both airbnb_data and crime_data
+        # every point is (longitude, latitude, census_tract_id, is_api_geolocated): the census tracts of airbnb
+        # properties and of crimes with a census block come from the census API; the other crimes may have been
+        # labelled by local matching
         if self.all_geolocated_points is None:
-            query = """SELECT crime_incident.longitude, crime_incident.latitude, crime_incident.census_tract_id
+            query = """SELECT crime_incident.longitude, crime_incident.latitude, crime_incident.census_tract_id,
+                                crime_incident.census_block_id IS NOT NULL
                         FROM crime_incident, census_tracts
                         WHERE crime_incident.census_tract_id = census_tracts.census_tract_id
                         AND crime_incident.longitude IS NOT NULL
@@ -322,13 +459,10 @@ class CrimeDB:
                         AND census_tracts.state_id = %s
                         ;
                         """
-            crime_cursor.execute(query, (self.state_id,))
+            self.crime_cursor.execute(query, (self.state_id,))
             state = self.uss.abbr_to_name[self.state_abbr]
-            list_of_records = crime_cursor.fetchall()
-            if len(list_of_records) > 200000:
-                random.shuffle(list_of_records)
-                list_of_records = list_of_records[:200000]
-            query = """SELECT property.longitude, property.latitude, property.census_tract_id
+            list_of_records = self.crime_cursor.fetchall()
+            query = """SELECT property.longitude, property.latitude, property.census_tract_id, TRUE
                         FROM property, census_tract
                         WHERE property.census_tract_id = census_tract.census_tract_id
                         AND property.longitude IS NOT NULL
@@ -338,13 +472,37 @@ class CrimeDB:
                         AND property.state = %s
                         ;
                     """
-            airbnb_cursor.execute(query, (state,))
-            another_list_of_records = airbnb_cursor.fetchall()
-            random.shuffle(another_list_of_records)
-            self.all_geolocated_points = list_of_records + another_list_of_records
-            random.shuffle(self.all_geolocated_points)
-            self.all_geolocated_points = self.all_geolocated_points[:200000]
+            self.airbnb_cursor.execute(query, (state,))
+            another_list_of_records = self.airbnb_cursor.fetchall()
+            # the matching classifiers are trained on an index drawn the same way
+            self.all_geolocated_points = sample_index_points(list_of_records, another_list_of_records)
             self.all_geolocated_nodes = np.array([[point[0], point[1]] for point in self.all_geolocated_points])
+            self.all_geolocated_census_tracts = np.array([point[2] for point in self.all_geolocated_points])
+            self.geolocated_tree = cKDTree(self.all_geolocated_nodes)
+
+    def hold_out_geolocated_points(self, size, seed=123):
+        """
+        remove a random sample of the geolocated points from the index used for local matching,
+        so that they can be replayed through geolocate_point() with a known census tract.
+        only the points geolocated by the census API are held out, so that the known census tract
+        is not itself the output of local matching
+
+        :param size: int -> number of points to hold out
+        :param seed: int
+        :return: a pandas dataframe with the columns longitude, latitude and census_tract_id
+        """
+        self.get_geolocated_points_by_state()
+        candidates = np.flatnonzero([point[3] for point in self.all_geolocated_points])
+        held_out = np.zeros(len(self.all_geolocated_nodes), dtype=bool)
+        held_out[np.random.RandomState(seed).choice(candidates, size=min(size, len(candidates)), replace=False)] = True
+        holdout_df = pd.DataFrame({'longitude': self.all_geolocated_nodes[held_out, 0],
+                                   'latitude': self.all_geolocated_nodes[held_out, 1],
+                                   'census_tract_id': self.all_geolocated_census_tracts[held_out]})
+        self.all_geolocated_points = [point for point, flag in zip(self.all_geolocated_points, held_out) if not flag]
+        self.all_geolocated_nodes = self.all_geolocated_nodes[~held_out]
+        self.all_geolocated_census_tracts = self.all_geolocated_census_tracts[~held_out]
+        self.geolocated_tree = cKDTree(self.all_geolocated_nodes)
+        return holdout_df
 
     @staticmethod
     def ckdnearest(all_nodes, target_node, k=1):
@@ -358,29 +516,41 @@ class CrimeDB:
         else:
             return np.argmin(dist), min(dist)
 
-    @staticmethod
-    def load_classifer(pkl_name):
-        with open(pkl_name, 'rb') as file:
-            pickle_model = pickle.load(file)
-        return pickle_model
-
     def predict_matching(self, input):
-        output = self.clf.predict(np.array([input]).reshape(1, -1))
-        return bool(output[0])
+        return predict_local_match(self.get_matching_model(), input)
+
+    def get_matching_features(self, longitude, latitude):
+        """
+        :return: the features of a point expected by the matching classifier, and the index of its nearest
+                    geolocated point
+        """
+        k = self.get_matching_model()['k']
+        nearest_dists, nearest_indices = self.geolocated_tree.query([longitude, latitude], k=k)
+        nearest_dists = np.reshape(nearest_dists, (1, -1))
+        nearest_indices = np.reshape(nearest_indices, (1, -1))
+        if k == 1:  # legacy classifier: the nearest distance only
+            return nearest_dists[0], nearest_indices[0, 0]
+        features = get_neighbor_features(nearest_dists, self.all_geolocated_census_tracts[nearest_indices])
+        return features[0], nearest_indices[0, 0]
 
     def geolocate_point(self, longitude, latitude, verbose):
-        target_node = np.array([[longitude, latitude]])
-        nearest_node_index, nearest_dist = self.ckdnearest(self.all_geolocated_nodes, target_node)
-        matched_flag = self.predict_matching(nearest_dist)
+        features, nearest_node_index = self.get_matching_features(longitude, latitude)
+        matched_flag = self.predict_matching(features)
         if matched_flag:
-            nearest_census_tract = self.all_geolocated_points[nearest_node_index][2]
+            nearest_census_tract = self.all_geolocated_census_tracts[nearest_node_index]
+            self.local_match_count += 1
             if verbose:
                 print('matched succeeded. predicted_census_tract:', nearest_census_tract)
             return nearest_census_tract
         else:
-            queried_output = get_census_tract_by_geo_info(longitude, latitude, verbose)['census_tract_id']
-            print('matched failed. queried_census_tract:', queried_output['census_tract_id'])
-            return queried_output['censusact_id']
+            matched_dict = get_census_tract_by_geo_info(longitude, latitude, verbose)
+            self.api_match_count += 1
+            if matched_dict is None:  # only happens with the local engine, for points outside the loaded blocks
+                return None
+            queried_census_tract = matched_dict['census_tract_id']
+            if verbose:
+                print('matched failed. queried_census_tract:', queried_census_tract)
+            return queried_census_tract
 
     def get_census_tract_by_address(self, address, verbose=True):
         """
@@ -442,7 +612,7 @@ class CrimeDB:
         :return:
         """
         if year is not None:
-            query = """SELECT incident_id, address
+            query = """SELECT incident_id, year, address
                         FROM crime_incident
                         WHERE address IS NOT NULL
                         AND census_tract_id IS NULL
@@ -454,7 +624,7 @@ class CrimeDB:
                         """.format(self.batch_size)
             self.crime_cursor.execute(query, (year, self.state_abbr))
         else:
-            query = """SELECT incident_id, address
+            query = """SELECT incident_id, year, address
                         FROM crime_incident
                         WHERE address IS NOT NULL
                         AND census_tract_id IS NULL
@@ -467,8 +637,8 @@ class CrimeDB:
         results = self.crime_cursor.fetchall()
         if len(results): # check if there are still records waiting to be geolocated
             for result in tqdm(results, total=len(results)):
-                incident_id = result[0]
-                address = result[1].lower().replace(' block', '')
+                incident_id, incident_year = result[0], result[1]
+                address = result[2].lower().replace(' block', '')
                 address = address.replace('nb', '')
                 address = address.replace('sb', '')
                 address = address.replace('ih', 'interstate')
@@ -481,17 +651,17 @@ class CrimeDB:
                 if address != 'unknown':
                     matched_dict = self.get_census_tract_by_address(address, verbose)
                     if matched_dict is not None:
-                        cdb._update_census_block_to_psql(incident_id, matched_dict['census_tract_id'],
-                                                     census_block_id=matched_dict['census_block_id'],
-                                                     longitude=matched_dict['longitude'],
-                                                     latitude=matched_dict['latitude'],
-                                                     verbose=verbose)
+                        self._update_census_block_to_psql(incident_id, matched_dict['census_tract_id'],
+                                                          census_block_id=matched_dict['census_block_id'],
+                                                          longitude=matched_dict['longitude'],
+                                                          latitude=matched_dict['latitude'],
+                                                          year=incident_year, verbose=verbose)
                         self.crime_connection.commit()
         else:
             print('all the crime incidents are already labelled')
             sys.exit()
 
-    def local_geolocating(self, year=None, verbose=True):
+    def local_geolocating(self, year=None, verbose=True, show_progress=True):
         """
         geolocate crime incidents using the censusgeocode API and update the
         results into psql
@@ -499,51 +669,54 @@ class CrimeDB:
         :param city: str -> process crime incidents that happen in one city at a time
         :param year: int -> process crime incidents that happen in one year at a time
         :param verbose: boolean -> whether to print outputs as the program runs
-        :return:
+        :param show_progress: boolean -> whether to show a progress bar for the batch
+        :return: int -> number of crime incidents selected in this batch (0 when none are left);
+                        the number of them that were geolocated is added to self.geolocated_count
         """
         self.get_geolocated_points_by_state()
+        values = [self.state_abbr]
+        year_clause = ''
         if year is not None:
-            query = """SELECT incident_id, longitude, latitude
-                        FROM crime_incident
-                        WHERE longitude IS NOT NULL
-                        AND longitude != 'NaN'
-                        AND latitude > 0
-                        AND census_tract_id IS NULL
-                        AND year = %s
-                        AND state = %s
-                        LIMIT {}
-                        ;
-                        """.format(self.batch_size)
-            self.crime_cursor.execute(query, (year, self.state_abbr))
-        else:
-            query = """SELECT incident_id, longitude, latitude
-                        FROM crime_incident
-                        WHERE longitude IS NOT NULL
-                        AND longitude != 'NaN'
-                        AND latitude > 0
-                        AND census_tract_id IS NULL
-                        AND state = %s
-                        LIMIT {}
-                        ;
-                        """.format(self.batch_size)
-            self.crime_cursor.execute(query, (self.state_abbr, ))
+            year_clause = 'AND year = %s'
+            values.append(year)
+        # the incidents are walked in incident_id order: the ones left ungeolocated by a batch
+        # (no local match and no census tract found) are behind the cursor and are not selected again
+        cursor_clause = ''
+        if self.last_selected_incident_id is not None:
+            cursor_clause = 'AND incident_id > %s'
+            values.append(self.last_selected_incident_id)
+        query = """SELECT incident_id, year, longitude, latitude
+                    FROM crime_incident
+                    WHERE longitude IS NOT NULL
+                    AND longitude != 'NaN'
+                    AND longitude < -50
+                    AND latitude > 20
+                    AND census_tract_id IS NULL
+                    AND state = %s
+                    {}
+                    {}
+                    ORDER BY incident_id
+                    LIMIT {}
+                    ;
+                    """.format(year_clause, cursor_clause, self.batch_size)
+        self.crime_cursor.execute(query, values)
         results = self.crime_cursor.fetchall()
-        if len(results): # check if there are still records waiting to be geolocated
-            for result in tqdm(results, total=len(results)):
-                incident_id = result[0]
-                longitude = result[1]
-                latitude = result[2]
-                if longitude < - 50 and latitude > 20:
-                    #output = get_census_tract_by_geo_info(longitude, latitude, verbose)
-                    census_tract_id = self.geolocate_point(longitude, latitude, verbose)
-                    cdb._update_census_block_to_psql(incident_id, census_tract_id, verbose=verbose)
-                    self.crime_connection.commit()
-        else:
+        if len(results) == 0:
             print('all the crime incidents are already labelled')
-            sys.exit()
+            return 0
+        for incident_id, incident_year, longitude, latitude in tqdm(results, total=len(results),
+                                                                    disable=not show_progress):
+            census_tract_id = self.geolocate_point(longitude, latitude, verbose)
+            if census_tract_id is None:
+                continue
+            self._update_census_block_to_psql(incident_id, census_tract_id, year=incident_year, verbose=verbose)
+            self.crime_connection.commit()
+            self.geolocated_count += 1
+        self.last_selected_incident_id = results[-1][0]
+        return len(results)
 
     def _update_census_block_to_psql(self, incident_id, census_tract_id, census_block_id=None,
-                                     longitude=None, latitude=None, verbose=True):
+                                     longitude=None, latitude=None, year=None, verbose=True):
         """
         insert the matching result between crime incidents and their census block info into psql
         as census block is defined to be child of census tract, the update also requires information
@@ -554,39 +727,31 @@ class CrimeDB:
         :param incident_id: str
         :param census_block_id: str
         :param census_tract_id: str
+        :param year: int -> the year of the incident, so that only its partition of crime_incident is scanned
         :param: verbose: boolean -> whether to print detailed outputs as the program runs
         :return: True
         """
         if census_block_id is not None and longitude is not None:
-
-            query = """UPDATE crime_incident
-                        SET census_block_id = %s,
-                            census_tract_id = %s,
-                            longitude = %s,
-                            latitude = %s
-                        WHERE incident_id = %s 
-                        RETURNING incident_id
-                        """
-            self.crime_cursor.execute(query, (census_block_id, census_tract_id,
-                                            longitude, latitude, incident_id))
-            query_output = self.crime_cursor.fetchone()
+            set_clause = 'census_block_id = %s, census_tract_id = %s, longitude = %s, latitude = %s'
+            values = [census_block_id, census_tract_id, longitude, latitude, incident_id]
         elif census_block_id is not None:
-            query = """UPDATE crime_incident
-                        SET census_block_id = %s,
-                            census_tract_id = %s
-                        WHERE incident_id = %s 
-                        RETURNING incident_id
-                        """
-            self.crime_cursor.execute(query, (census_block_id, census_tract_id, incident_id))
-            query_output = self.crime_cursor.fetchone()
+            set_clause = 'census_block_id = %s, census_tract_id = %s'
+            values = [census_block_id, census_tract_id, incident_id]
         else:
-            query = """UPDATE crime_incident
-                        SET census_tract_id = %s
-                        WHERE incident_id = %s 
-                        RETURNING incident_id
-                        """
-            self.crime_cursor.execute(query, (census_tract_id, incident_id))
-            query_output = self.crime_cursor.fetchone()
+            set_clause = 'census_tract_id = %s'
+            values = [census_tract_id, incident_id]
+        year_clause = ''
+        if year is not None:
+            year_clause = 'AND year = %s'
+            values.append(int(year))
+        query = """UPDATE crime_incident
+                    SET {}
+                    WHERE incident_id = %s
+                    {}
+                    RETURNING incident_id
+                    """.format(set_clause, year_clause)
+        self.crime_cursor.execute(query, values)
+        query_output = self.crime_cursor.fetchone()
         if verbose:
             print('updated property:', query_output)
         return True
@@ -607,13 +772,17 @@ if __name__ == '__main__':
                       airbnb={'connection': airbnb_connection, 'cursor': airbnb_cursor})
     ## copy the table census tracts from acs5
     # cdb.copy_census_tracts_from_acs5()
+    ## partition crime_incident by year (only needs to run once)
+    # cdb.partition_crime_incident_by_year(2014, 2020)
     ## import crime data from pandas to psql
     # cdb.insert_crimes_into_psql('nyc', year_threshold=2014) # austin, boston, chicago, dc, la, nyc, seattle, sf
     # cdb.drop_crimes_by_year(2014)
     ## geolocate crime using airbnb
     cdb.batch_size = 10000
-    while True:
-        cdb.local_geolocating(verbose=False)
+    while cdb.local_geolocating(verbose=False):
+        pass
+    ## geolocate several states at once, one process per state
+    # geolocate_states_in_parallel(['NY', 'CA', 'IL', 'MA', 'TX'])  # from psql.geolocate_crimes_in_parallel
     ## geolocate TX by address
     # cdb.batch_size = 100
     # cdb.city = 'austin'
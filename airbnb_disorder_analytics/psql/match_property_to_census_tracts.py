@@ -10,7 +10,7 @@ matching is based on the longitude and latitude of the listing.
 
 Dependencies:
     - third-party packages: psycopg2, censusgeocode
-    - local packages: config.db_config
+    - local packages: config.db_config, config.geocoder_config, psql.geolocation_batching, psql.local_geocoder
 
 ruilin chen
 08/09/2020
@@ -22,34 +22,50 @@ import random
 from pprint import pprint
 from tqdm import tqdm
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 # third-party import
 import psycopg2
+from psycopg2.extras import execute_values
+import requests
 import censusgeocode as cg
 # local import
 from airbnb_disorder_analytics.config.db_config import DBInfo
+from airbnb_disorder_analytics.config.geocoder_config import GeocoderInfo
+from airbnb_disorder_analytics.psql.geolocation_batching import RateLimiter, RetryBudget, \
+    group_properties_by_location, print_deduplication_ratio
 
 
 # connect to database
 connection = psycopg2.connect(DBInfo.airbnb_config)
 cursor = connection.cursor()
+# census tracts and census blocks already inserted and committed by this process; no need to upsert them again
+written_census_tract_ids = set()
+written_census_block_ids = set()
+# census tracts and census blocks inserted in the current transaction; written once it is committed
+pending_census_tract_ids = set()
+pending_census_block_ids = set()
 
 
-def get_unlocated_properties(state=None, num_of_properties=10):
+def get_unlocated_properties(state=None, num_of_properties=10, excluded_property_ids=None):
     """
     get longitude and latitude for listings that are yet to be geolocated,
     meaning that the census tracts in which they are located have not been identified.
 
     :param num_of_properties: int -> how many properties to return
+    :param excluded_property_ids: list -> properties to skip, e.g. those the API already failed on
     :return: list_of_properties: list -> [(property_id, longitude, latitude)...]
     """
+    if excluded_property_ids is None:
+        excluded_property_ids = []
     if state is None:
         query = """SELECT property_id, longitude, latitude
                         FROM property
                         WHERE census_tract_id IS NULL 
+                        AND property_id != ALL(%s)
                         LIMIT {}
                         ;
                     """.format(num_of_properties)
-        cursor.execute(query)
+        cursor.execute(query, (list(excluded_property_ids), ))
         list_of_properties = cursor.fetchall()
         return list_of_properties
     else:
@@ -57,15 +73,15 @@ def get_unlocated_properties(state=None, num_of_properties=10):
                         FROM property
                         WHERE census_tract_id IS NULL 
                         AND state = %s
+                        AND property_id != ALL(%s)
                         LIMIT {}
                         ;
                     """.format(num_of_properties)
-        cursor.execute(query, (state, ))
+        cursor.execute(query, (state, list(excluded_property_ids)))
         list_of_properties = cursor.fetchall()
         return list_of_properties
 
 
-
 def get_census_tract_by_geo_info(longitude, latitude, verbose=True):
     """
     find the census tract to which a given point defined by their
@@ -79,7 +95,15 @@ def get_census_tract_by_geo_info(longitude, latitude, verbose=True):
                             - census_tract_id
                             - county_id
                             - state_id
+                            (with the local engine: None if the point is outside all the loaded census blocks)
     """
+    if GeocoderInfo.engine == 'local':  # look the point up in the census block polygons instead of the API
+        # imported here so that geopandas is only needed by the local engine
+        from airbnb_disorder_analytics.psql.local_geocoder import get_local_geocoder
+        matched_dict = get_local_geocoder().lookup(longitude, latitude)
+        if verbose:
+            pprint(matched_dict)
+        return matched_dict
     geocoded_result = None
     repeated_trial = 0
     while geocoded_result is None: # repeatly calling the Census API until the program gets the right return
@@ -94,6 +118,23 @@ def get_census_tract_by_geo_info(longitude, latitude, verbose=True):
         except KeyError:
             time.sleep(random.random())
     assert len(geocoded_result)
+    matched_dict = _parse_geocoded_result(geocoded_result)
+    if verbose:
+        pprint(matched_dict)
+    return matched_dict
+
+
+def _parse_geocoded_result(geocoded_result):
+    """
+    extract the census geographies from the output of censusgeocode.coordinates()
+
+    :param geocoded_result: dictionary
+    :return: matched_dict: dictionary with four keys:
+                            - census_block_id
+                            - census_tract_id
+                            - county_id
+                            - state_id
+    """
     census_block_id = geocoded_result['2010 Census Blocks'][0]['GEOID']
     census_tract_id = geocoded_result['Census Tracts'][0]['GEOID']
     county_id = geocoded_result['Counties'][0]['GEOID']
@@ -104,101 +145,214 @@ def get_census_tract_by_geo_info(longitude, latitude, verbose=True):
         'county_id': county_id,
         'state_id': state_id
     }
-    if verbose:
-        pprint(matched_dict)
     return matched_dict
 
-def update_census_block_to_psql(property_id, census_block_id, census_tract_id, verbose=True):
+
+def reverse_geocode(longitude, latitude, rate_limiter, retry_budget, verbose=True):
     """
-    insert the matching result between airbnb property and their census block info into psql
-    as census block is defined to be child of census tract, the update also requires information
-    on the census tract to which this block belongs.
+    thread-safe version of get_census_tract_by_geo_info(): every call to the census API waits for
+    the shared rate_limiter, and every retry is taken from the shared retry_budget.
 
-    :param property_id: str
-    :param census_block_id: str
-    :param census_tract_id: str
+    :param longitude: float
+    :param latitude: float
+    :param rate_limiter: RateLimiter
+    :param retry_budget: RetryBudget
     :param: verbose: boolean -> whether to print detailed outputs as the program runs
-    :return: True
+    :return: matched_dict (see get_census_tract_by_geo_info) or None if the point couldn't be geolocated
     """
-    query = """UPDATE property
-                SET census_block_id = %s,
-                    census_tract_id = %s
-                WHERE property_id = %s 
-                RETURNING property_id
-                """
-    cursor.execute(query, (census_block_id, census_tract_id, property_id))
-    query_output = cursor.fetchone()
-    if verbose:
-        print('updated property:', query_output)
-
-    query = """INSERT INTO census_block (census_block_id, census_tract_id) 
-                VALUES (%s, %s)
-                ON CONFLICT (census_block_id) DO NOTHING
-                RETURNING census_block_id
-                ;
-                """
-    cursor.execute(query, (census_block_id, census_tract_id))
-    query_output = cursor.fetchone()
-    if verbose:
-        print('updated census block:', query_output)
-    return True
-
+    if GeocoderInfo.engine == 'local':
+        return get_census_tract_by_geo_info(longitude, latitude, verbose)
+    while True:
+        rate_limiter.wait()
+        try:
+            geocoded_result = cg.coordinates(x=longitude, y=latitude)
+            matched_dict = _parse_geocoded_result(geocoded_result)
+            if verbose:
+                pprint(matched_dict)
+            return matched_dict
+        except (ValueError, KeyError, IndexError, TypeError, requests.exceptions.RequestException):
+            if not retry_budget.spend():
+                return None
+            time.sleep(random.random())
 
-def update_census_tract_to_psql(census_tract_id, county_id, state_id, verbose=True):
+def update_geolocation_results_to_psql(list_of_matched_results, verbose=True):
     """
-    insert census tract into psql
-    as census tract is defined to be child of county and state, the update also requires information
-    on the county and state to which this census tract belongs.
+    write the matching results of a whole batch, i.e. the census block and census tract of every property:
+    the distinct census tracts and census blocks of the batch are deduplicated in memory and each table
+    is written with a single statement. tracts and blocks already written by this process are skipped.
+    the caller is responsible for committing, with commit_geolocation_results().
 
-    :param census_tract_id: str
-    :param county_id: str
-    :param state_id: str
+    :param list_of_matched_results: list -> [(property_id, matched_dict)...];
+                                            entries whose matched_dict is None are ignored
     :param: verbose: boolean -> whether to print detailed outputs as the program runs
-    :return: True
+    :return: int -> number of properties updated
     """
-    query = """INSERT INTO census_tract (census_tract_id, county_id, state_id) 
-                VALUES (%s, %s, %s)
-                ON CONFLICT (census_tract_id) DO NOTHING
-                RETURNING census_tract_id
-                ;
-                """
-    cursor.execute(query, (census_tract_id, county_id, state_id))
-    query_output = cursor.fetchone()
+    property_rows = []
+    census_block_rows = {}
+    census_tract_rows = {}
+    for property_id, matched_dict in list_of_matched_results:
+        if matched_dict is None:
+            continue
+        property_rows.append((property_id, matched_dict['census_block_id'], matched_dict['census_tract_id']))
+        if matched_dict['census_block_id'] not in written_census_block_ids:
+            census_block_rows[matched_dict['census_block_id']] = matched_dict['census_tract_id']
+        if matched_dict['census_tract_id'] not in written_census_tract_ids:
+            census_tract_rows[matched_dict['census_tract_id']] = (matched_dict['county_id'], matched_dict['state_id'])
+    if census_tract_rows:
+        query = """INSERT INTO census_tract (census_tract_id, county_id, state_id) 
+                    VALUES %s
+                    ON CONFLICT (census_tract_id) DO NOTHING
+                    ;
+                    """
+        execute_values(cursor, query, [(census_tract_id, county_id, state_id) for census_tract_id, (county_id, state_id)
+                                       in census_tract_rows.items()], page_size=len(census_tract_rows))
+        pending_census_tract_ids.update(census_tract_rows.keys())
+    if census_block_rows:
+        query = """INSERT INTO census_block (census_block_id, census_tract_id) 
+                    VALUES %s
+                    ON CONFLICT (census_block_id) DO NOTHING
+                    ;
+                    """
+        execute_values(cursor, query, list(census_block_rows.items()), page_size=len(census_block_rows))
+        pending_census_block_ids.update(census_block_rows.keys())
+    if property_rows:
+        query = """UPDATE property
+                    SET census_block_id = matched.census_block_id,
+                        census_tract_id = matched.census_tract_id
+                    FROM (VALUES %s) AS matched (property_id, census_block_id, census_tract_id)
+                    WHERE property.property_id = matched.property_id
+                    ;
+                    """
+        execute_values(cursor, query, property_rows, page_size=len(property_rows))
     if verbose:
-        print('updated census tract:', query_output)
-    return True
+        print('updated properties:', len(property_rows), '\t new census blocks:', len(census_block_rows),
+              '\t new census tracts:', len(census_tract_rows))
+    return len(property_rows)
+
+
+def rollback_geolocation_results():
+    """
+    roll back the batch written by update_geolocation_results_to_psql() and forget its census tracts and blocks
+    """
+    connection.rollback()
+    pending_census_tract_ids.clear()
+    pending_census_block_ids.clear()
+
+
+def commit_geolocation_results():
+    """
+    commit the batch written by update_geolocation_results_to_psql(); its census tracts and census blocks
+    are only remembered as written once the commit succeeds, so a rolled back batch doesn't hide them
+    from the next ones
+    """
+    try:
+        connection.commit()
+    except psycopg2.Error:
+        rollback_geolocation_results()
+        raise
+    written_census_tract_ids.update(pending_census_tract_ids)
+    written_census_block_ids.update(pending_census_block_ids)
+    pending_census_tract_ids.clear()
+    pending_census_block_ids.clear()
 
 
-def geolocate_properties_by_batch(state, batch_size=10, verbose=True):
+def geolocate_properties_by_batch(state, batch_size=10, verbose=True, coordinate_precision=5,
+                                  excluded_property_ids=None):
     """
     geolocate unlocated properties through the following steps:
         - get geo-info of the unlocated properties from database
-        - find the corresponding census tract using the geo-info
+        - group the properties that share the same location
+        - find the corresponding census tract using the geo-info, once per location
         - update the database with the matched result
 
     :param: batch_size: int -> number of properties to process per batch
                                     # this batch processing setup avoids storing too much info in memory
     :param: verbose: boolean -> whether to print detailed outputs as the program runs
-    :return: True
+    :param: coordinate_precision: int -> decimal places used to decide if two properties share a location
+    :param: excluded_property_ids: list -> properties to skip, e.g. those that failed in an earlier batch
+    :return: failed_property_ids: list -> properties that couldn't be geolocated
     """
-    list_of_unlocated_properties = get_unlocated_properties(state, batch_size)
-    for property_id, longitude, latitude in tqdm(list_of_unlocated_properties):
+    list_of_unlocated_properties = get_unlocated_properties(state, batch_size, excluded_property_ids)
+    list_of_locations = group_properties_by_location(list_of_unlocated_properties, coordinate_precision)
+    print_deduplication_ratio(list_of_unlocated_properties, list_of_locations)
+    list_of_matched_results = []
+    for longitude, latitude, property_ids in tqdm(list_of_locations):
         matched_result = get_census_tract_by_geo_info(longitude, latitude, verbose)
-        census_block_id = matched_result['census_block_id']
-        census_tract_id = matched_result['census_tract_id']
-        county_id = matched_result['county_id']
-        state_id = matched_result['state_id']
-        update_census_block_to_psql(property_id, census_block_id, census_tract_id, verbose)
-        update_census_tract_to_psql(census_tract_id, county_id, state_id, verbose)
-        connection.commit()
+        list_of_matched_results += [(property_id, matched_result) for property_id in property_ids]
+    failed_property_ids = [property_id for property_id, matched_result in list_of_matched_results
+                           if matched_result is None]
+    try:
+        update_geolocation_results_to_psql(list_of_matched_results, verbose)
+    except psycopg2.Error:
+        rollback_geolocation_results()
+        raise
+    commit_geolocation_results()
+    return failed_property_ids
+
+
+def geolocate_properties_concurrently(state, rate_limiter, retry_budget, batch_size=200, workers=8,
+                                      excluded_property_ids=None, verbose=True, coordinate_precision=5):
+    """
+    same as geolocate_properties_by_batch() but the census API is called from a pool of threads,
+    so the throughput is bounded by the rate_limiter rather than by the latency of a single request.
+    the results of the whole batch are written to the database in one transaction.
+
+    :param: state: str
+    :param: rate_limiter: RateLimiter -> shared by all the batches
+    :param: retry_budget: RetryBudget -> shared by all the batches
+    :param: batch_size: int -> number of properties to process per batch
+    :param: workers: int -> number of threads calling the census API at the same time
+    :param: excluded_property_ids: list -> properties to skip
+    :param: verbose: boolean -> whether to print detailed outputs as the program runs
+    :param: coordinate_precision: int -> decimal places used to decide if two properties share a location
+    :return: failed_property_ids: list -> properties that couldn't be geolocated
+    """
+    list_of_unlocated_properties = get_unlocated_properties(state, batch_size, excluded_property_ids)
+    list_of_locations = group_properties_by_location(list_of_unlocated_properties, coordinate_precision)
+    print_deduplication_ratio(list_of_unlocated_properties, list_of_locations)
+
+    def geolocate_one_location(a_location):
+        longitude, latitude, property_ids = a_location
+        return property_ids, reverse_geocode(longitude, latitude, rate_limiter, retry_budget, verbose)
+
+    if GeocoderInfo.engine == 'local':  # no API to wait for: look up the whole batch at once
+        from airbnb_disorder_analytics.psql.local_geocoder import get_local_geocoder
+        matched_df = get_local_geocoder().lookup_many([a_location[0] for a_location in list_of_locations],
+                                                      [a_location[1] for a_location in list_of_locations])
+        list_of_matched_locations = [(a_location[2],
+                                      matched_dict if matched_dict['census_block_id'] is not None else None)
+                                     for a_location, matched_dict in zip(list_of_locations,
+                                                                         matched_df.to_dict('records'))]
+    else:
+        with ThreadPool(workers) as pool:
+            list_of_matched_locations = list(tqdm(pool.imap_unordered(geolocate_one_location, list_of_locations),
+                                                  total=len(list_of_locations)))
+    list_of_matched_results = [(property_id, matched_result)
+                               for property_ids, matched_result in list_of_matched_locations
+                               for property_id in property_ids]
+    failed_property_ids = [property_id for property_id, matched_result in list_of_matched_results
+                           if matched_result is None]
+    try:
+        update_geolocation_results_to_psql(list_of_matched_results, verbose)
+    except psycopg2.Error:
+        rollback_geolocation_results()
+        raise
+    commit_geolocation_results()
+    return failed_property_ids
 
 
-def geolocate_all_properties(state, verbose=True):
+def geolocate_all_properties(state, verbose=True, workers=None, max_calls_per_second=10, max_retries=1000,
+                             coordinate_precision=5):
     """
     geolocate all unlocated properties by calling geolocate_properties_by_batch() until
     count of unlocated properties equal to zero
 
     :param: verbose: boolean -> whether to print detailed outputs as the program runs
+    :param: workers: int -> if provided, call the census API from this many threads at once
+                            (see geolocate_properties_concurrently()); otherwise one call at a time
+    :param: max_calls_per_second: int -> rate limit of the census API, shared by all the threads
+    :param: max_retries: int -> total number of retries allowed for failed API calls across all the threads
+    :param: coordinate_precision: int -> decimal places used to decide if two properties share a location
     :return: True
     """
     if state is None:
@@ -220,12 +374,25 @@ def geolocate_all_properties(state, verbose=True):
         cursor.execute(query, (state, ))
         result = cursor.fetchone()
         count_of_unlocated_properties = result[0]
+    rate_limiter = RateLimiter(max_calls_per_second)
+    retry_budget = RetryBudget(max_retries)
+    failed_property_ids = []
     while count_of_unlocated_properties:
         print('remaining unlocated properties:', count_of_unlocated_properties)
         batch_size = min(count_of_unlocated_properties, 200)
-        geolocate_properties_by_batch(state, batch_size, verbose)
+        # the properties that failed in an earlier batch are skipped, so that they aren't fetched again and again
+        if workers is None:
+            failed_property_ids += geolocate_properties_by_batch(state, batch_size, verbose, coordinate_precision,
+                                                                 failed_property_ids)
+        else:
+            failed_property_ids += geolocate_properties_concurrently(state, rate_limiter, retry_budget, batch_size,
+                                                                     workers, failed_property_ids, verbose,
+                                                                     coordinate_precision)
         count_of_unlocated_properties -= batch_size
+    if failed_property_ids:
+        print('properties that failed to be geolocated:', len(failed_property_ids))
 
 
 if __name__ == '__main__':
-    geolocate_all_properties(state='New York', verbose=False)
\ No newline at end of file
+    geolocate_all_properties(state='New York', verbose=False)
+    # geolocate_all_properties(state='New York', verbose=False, workers=8, max_calls_per_second=10)
@@ -0,0 +1,71 @@
+'''
+matching_features.py
+
+this script builds the features used by the matching classifiers, which decide whether a point can take
+the census tract of its nearest geolocated neighbor (a local match) or has to be sent to the census API.
+
+the features are derived from the k nearest geolocated points of every point, for many points at once:
+    - the distances to the k nearest points (dist_1 ... dist_k)
+    - vote_share: the share of the k nearest points that are in the same census tract as the nearest one
+    - tract_gap: how much farther the nearest point of a different census tract is than the nearest point;
+                    if all k points are in the same tract, the distance to the k-th point is used instead
+
+the same functions are used to train the classifiers (psql.train_matching_classifier) and
+to apply them (psql.match_crime_to_census_tracts.CrimeDB.geolocate_point); both draw the geolocated points
+with sample_index_points(), so that the neighbor distances seen in training are those of the index in production.
+
+Dependencies:
+    - third-party packages: numpy
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import random
+# third-party import
+import numpy as np
+
+__all__ = ['get_feature_names', 'get_neighbor_features', 'sample_index_points']
+
+
+def get_feature_names(k):
+    """
+    :param k: int -> number of nearest neighbors
+    :return: a list of str -> names of the columns returned by get_neighbor_features()
+    """
+    return [f'dist_{index + 1}' for index in range(k)] + ['vote_share', 'tract_gap']
+
+
+def sample_index_points(crime_points, airbnb_points, max_size=200000):
+    """
+    draw the geolocated points of a state that make up the local matching index:
+    at most max_size crime incidents are kept, then at most max_size points overall
+
+    :param crime_points: a list of points (tuples starting with longitude, latitude, census_tract_id)
+    :param airbnb_points: a list of points, as crime_points
+    :param max_size: int
+    :return: a list of points, in random order
+    """
+    crime_points = list(crime_points)
+    random.shuffle(crime_points)
+    points = crime_points[:max_size] + list(airbnb_points)
+    random.shuffle(points)
+    return points[:max_size]
+
+
+def get_neighbor_features(nearest_dists, nearest_census_tracts):
+    """
+    :param nearest_dists: numpy array of shape (number_of_points, k) -> distances to the k nearest
+                            geolocated points, sorted from the nearest to the farthest
+    :param nearest_census_tracts: numpy array of shape (number_of_points, k) -> census tracts of
+                                    these geolocated points
+    :return: numpy array of shape (number_of_points, k + 2), see get_feature_names()
+    """
+    nearest_dists = np.asarray(nearest_dists, dtype=float)
+    nearest_census_tracts = np.asarray(nearest_census_tracts)
+    is_in_nearest_tract = nearest_census_tracts == nearest_census_tracts[:, [0]]
+    vote_share = is_in_nearest_tract.mean(axis=1)
+    dists_to_other_tracts = np.where(is_in_nearest_tract, np.inf, nearest_dists).min(axis=1)
+    dists_to_other_tracts = np.where(np.isinf(dists_to_other_tracts), nearest_dists[:, -1], dists_to_other_tracts)
+    tract_gap = dists_to_other_tracts - nearest_dists[:, 0]
+    return np.column_stack([nearest_dists, vote_share, tract_gap])
@@ -0,0 +1,197 @@
+'''
+model_registry.py
+
+this script stores and loads the matching classifiers of every state together with their metadata:
+    - state, version and training date
+    - k and feature_spec: how many nearest geolocated points the classifier looks at and
+                            which features (see psql.matching_features) it expects
+    - threshold: the probability above which a local match is accepted (None to use clf.predict)
+    - metrics: validation metrics reported by the training script
+    - trained_on: the training date, None if unknown (the legacy pickles)
+
+every call to save_model() writes a new version, matching_classifier_{STATE}_v{N}.pkl, into
+ModelRegistryInfo.model_folder; the pickles written before the registry existed
+(matching_classifier_{STATE}.pkl, a bare estimator) are read as version 0.
+a model is unpickled the first time it is asked for and then cached for the rest of the process,
+so the CrimeDB instances (and the worker processes) that never geolocate anything don't pay for it.
+
+Dependencies:
+    - third-party packages: pandas
+    - local packages: config.model_registry_config, psql.matching_features
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import os
+import re
+import pickle
+import datetime
+import pandas as pd
+import numpy as np
+# local import
+from airbnb_disorder_analytics.config.model_registry_config import ModelRegistryInfo
+from airbnb_disorder_analytics.psql.matching_features import get_feature_names
+
+__all__ = ['save_model', 'load_model', 'list_models', 'is_stale', 'predict_local_match']
+
+# models already unpickled by this process, by (state_abbr, version)
+_model_cache = {}
+# states whose stale model has already been reported by this process
+_warned_states = set()
+
+
+def _get_model_path(state_abbr, version):
+    if version == 0:
+        filename = '{}_{}.pkl'.format(ModelRegistryInfo.model_prefix, state_abbr.upper())
+    else:
+        filename = '{}_{}_v{}.pkl'.format(ModelRegistryInfo.model_prefix, state_abbr.upper(), version)
+    return os.path.join(ModelRegistryInfo.model_folder, filename)
+
+
+def _get_versions(state_abbr):
+    """
+    :return: a sorted list of int -> the versions of the state's model found in the model folder
+    """
+    pattern = re.compile(r'^{}_{}(?:_v(\d+))?\.pkl$'.format(ModelRegistryInfo.model_prefix, state_abbr.upper()))
+    versions = []
+    for filename in os.listdir(ModelRegistryInfo.model_folder):
+        matched = pattern.match(filename)
+        if matched:
+            versions.append(int(matched.group(1) or 0))
+    return sorted(versions)
+
+
+def _read_model(state_abbr, version):
+    """
+    unpickle a model and fill in the metadata missing from the older formats
+    """
+    model_path = _get_model_path(state_abbr, version)
+    with open(model_path, 'rb') as file:
+        model = pickle.load(file)
+    if not isinstance(model, dict):  # a bare estimator, which takes the nearest distance only
+        model = {'clf': model, 'k': 1, 'threshold': None, 'feature_spec': ['dist_1'], 'metrics': {}}
+    model.setdefault('feature_spec', get_feature_names(model['k']) if model['k'] > 1 else ['dist_1'])
+    model.setdefault('metrics', {})
+    # the legacy pickles don't record when they were trained (their mtime is only when they were copied)
+    model.setdefault('trained_on', None)
+    model['state'] = state_abbr.upper()
+    model['version'] = version
+    return model
+
+
+def save_model(state_abbr, clf, k, threshold=None, feature_spec=None, metrics=None):
+    """
+    store a trained matching classifier as the newest version of the state's model
+
+    :param state_abbr: str
+    :param clf: a fitted estimator
+    :param k: int -> number of nearest geolocated points the classifier looks at
+    :param threshold: float -> probability above which a local match is accepted; None to use clf.predict
+    :param feature_spec: a list of str -> names of the features clf expects
+    :param metrics: dictionary -> validation metrics
+    :return: int -> the version of the saved model
+    """
+    versions = _get_versions(state_abbr)
+    version = versions[-1] + 1 if versions else 1
+    model = {
+        'clf': clf,
+        'k': k,
+        'threshold': threshold,
+        'feature_spec': feature_spec if feature_spec is not None else get_feature_names(k),
+        'metrics': metrics if metrics is not None else {},
+        'state': state_abbr.upper(),
+        'version': version,
+        'trained_on': datetime.date.today().isoformat()
+    }
+    model_path = _get_model_path(state_abbr, version)
+    with open(model_path, 'wb') as file:
+        pickle.dump(model, file)
+    _model_cache[(state_abbr.upper(), version)] = model
+    print('saved model to', model_path)
+    return version
+
+
+def load_model(state_abbr, version=None, verbose=True):
+    """
+    :param state_abbr: str
+    :param version: int -> the version to load; the newest one if None
+    :param verbose: boolean -> whether to warn about a stale model (once per state); a model trained on an unknown
+                                date (the legacy version 0) is only reported when a newer version exists
+    :return: dictionary -> the model, with the keys clf, k, threshold, feature_spec, metrics,
+                            state, version and trained_on
+    """
+    if version is None:
+        versions = _get_versions(state_abbr)
+        if not versions:
+            raise FileNotFoundError(f'no matching classifier for {state_abbr} in {ModelRegistryInfo.model_folder}')
+        version = versions[-1]
+    key = (state_abbr.upper(), version)
+    if key not in _model_cache:
+        _model_cache[key] = _read_model(state_abbr, version)
+    model = _model_cache[key]
+    if verbose and model['state'] not in _warned_states and is_stale(model) and \
+            (model['trained_on'] is not None or _get_versions(state_abbr)[-1] > version):
+        _warned_states.add(model['state'])
+        print('warning: the matching classifier of {} (version {}, trained on {}) is stale'.format(
+            model['state'], version, model['trained_on'] or 'an unknown date'))
+    return model
+
+
+def list_models(state_abbr=None):
+    """
+    :param state_abbr: str -> list the models of one state only; all the states if None
+    :return: a pandas dataframe with one row per stored model and its metadata
+    """
+    pattern = re.compile(r'^{}_([A-Z]{{2}})(?:_v\d+)?\.pkl$'.format(ModelRegistryInfo.model_prefix))
+    if state_abbr is None:
+        list_of_states = sorted({pattern.match(filename).group(1)
+                                 for filename in os.listdir(ModelRegistryInfo.model_folder)
+                                 if pattern.match(filename)})
+    else:
+        list_of_states = [state_abbr.upper()]
+    list_of_rows = []
+    for state in list_of_states:
+        for version in _get_versions(state):
+            model = load_model(state, version, verbose=False)
+            row = {key: model[key] for key in ['state', 'version', 'trained_on', 'k', 'threshold']}
+            row.update(model['metrics'])
+            row['stale'] = is_stale(model)
+            list_of_rows.append(row)
+    return pd.DataFrame(list_of_rows)
+
+
+def is_stale(model, max_age_days=None):
+    """
+    a model is stale if it was trained more than max_age_days ago or on an unknown date, or if its feature_spec
+    no longer matches the features built by psql.matching_features
+
+    :param model: dictionary returned by load_model()
+    :param max_age_days: int -> defaults to ModelRegistryInfo.max_age_days
+    :return: boolean
+    """
+    if max_age_days is None:
+        max_age_days = ModelRegistryInfo.max_age_days
+    if model['trained_on'] is None:
+        return True
+    trained_on = datetime.datetime.strptime(model['trained_on'], '%Y-%m-%d').date()
+    if (datetime.date.today() - trained_on).days > max_age_days:
+        return True
+    expected_spec = get_feature_names(model['k']) if model['k'] > 1 else ['dist_1']
+    return list(model['feature_spec']) != expected_spec
+
+
+def predict_local_match(model, features):
+    """
+    :param model: dictionary returned by load_model()
+    :param features: a list or numpy array -> the features of one point, in the order of model['feature_spec']
+    :return: boolean -> whether the point can take the census tract of its nearest geolocated point
+    """
+    features = np.array([features]).reshape(1, -1)
+    if model['threshold'] is None:
+        return bool(model['clf'].predict(features)[0])
+    return bool(model['clf'].predict_proba(features)[0, 1] >= model['threshold'])
+
+
+if __name__ == '__main__':
+    print(list_models().to_string(index=False))
@@ -0,0 +1,200 @@
+'''
+replicate_tables.py
+
+this script copies rows into postgresql tables in bulk:
+    - copy_table_between_databases() copies reference tables (such as census_tracts) from the database
+        where they are built into the other databases that need them. rows are streamed from
+        "COPY ... TO STDOUT" on the source connection straight into "COPY ... FROM STDIN"
+        on the target connection through an os pipe, so the table never has to be held in python memory.
+    - copy_dataframe_into_table() loads a pandas dataframe with "COPY ... FROM STDIN", chunk by chunk.
+
+in both cases the rows are first copied into a temporary staging table and then upserted into the target table,
+which makes it safe to re-run the copy on a table that already has (some of) the rows.
+
+Dependencies:
+    - third-party packages: psycopg2
+    - local packages: config.db_config, config.replication_config
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import io
+import os
+import threading
+# third-party import
+import psycopg2
+# local import
+from airbnb_disorder_analytics.config.db_config import DBInfo
+from airbnb_disorder_analytics.config.replication_config import ReferenceTableInfo
+
+__all__ = ['copy_table_between_databases', 'copy_dataframe_into_table', 'replicate_reference_tables']
+
+# psycopg2 connection strings by database name
+config_by_database = {
+    'airbnb_data': DBInfo.airbnb_config,
+    'acs5': DBInfo.acs5_config,
+    'crime_data': DBInfo.crime_config
+}
+
+
+def _upsert_from_staging_table(cursor, table, staging_table, columns, primary_keys, update_on_conflict):
+    """
+    move the rows of the staging table into the target table
+
+    :param cursor: psycopg2 cursor
+    :param table: str
+    :param staging_table: str
+    :param columns: a list of str
+    :param primary_keys: a list of str -> the conflict target; if None, any conflicting row is skipped
+    :param update_on_conflict: boolean -> whether conflicting rows are overwritten (requires primary_keys);
+                                            ignored if every column is a primary key, since there is nothing to update
+    :return: int -> number of rows inserted or updated
+    """
+    non_key_columns = [column for column in columns if primary_keys is None or column not in primary_keys]
+    if primary_keys is None:
+        conflict_clause = 'ON CONFLICT DO NOTHING'
+    elif update_on_conflict and non_key_columns:
+        conflict_clause = 'ON CONFLICT ({}) DO UPDATE SET '.format(', '.join(primary_keys)) + ', '.join(
+            [f'{column} = EXCLUDED.{column}' for column in non_key_columns])
+    else:
+        conflict_clause = 'ON CONFLICT ({}) DO NOTHING'.format(', '.join(primary_keys))
+    query = """INSERT INTO {table} ({columns})
+                SELECT {columns} FROM {staging_table}
+                {conflict_clause}
+                ;
+                """.format(table=table, columns=', '.join(columns), staging_table=staging_table,
+                           conflict_clause=conflict_clause)
+    cursor.execute(query)
+    return cursor.rowcount
+
+
+def copy_table_between_databases(source_connection, target_connection, table, columns, primary_keys,
+                                 update_on_conflict=False, verbose=True):
+    """
+    copy a table from one database to another in constant memory
+
+    :param source_connection: psycopg2 connection to the database that has the table
+    :param target_connection: psycopg2 connection to the database that receives the table
+    :param table: str -> name of the table; the table must already exist in both databases
+    :param columns: a list of str -> the columns to be copied
+    :param primary_keys: a list of str -> the columns used to detect conflicting rows
+    :param update_on_conflict: boolean -> whether existing rows in the target table are overwritten
+                                            by the source rows (True) or kept as they are (False)
+    :param verbose: boolean -> whether to print outputs as the program runs
+    :return: int -> number of rows inserted or updated in the target table
+    """
+    column_list = ', '.join(columns)
+    staging_table = f'{table}_staging'
+    export_query = """COPY (SELECT {} FROM {}) TO STDOUT""".format(column_list, table)
+    import_query = """COPY {} ({}) FROM STDIN""".format(staging_table, column_list)
+    exceptions = []
+
+    def export_from_source():
+        # runs in its own thread so that the source can fill the pipe while the target drains it
+        try:
+            with os.fdopen(write_fd, 'wb') as writer:
+                source_connection.cursor().copy_expert(export_query, writer)
+        except (Exception, psycopg2.Error) as error:
+            exceptions.append(error)
+
+    target_cursor = target_connection.cursor()
+    exporter = threading.Thread(target=export_from_source)
+    try:
+        query = """CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS)
+                    ON COMMIT DROP
+                    ;
+                    """.format(staging_table, table)
+        target_cursor.execute(query)
+        read_fd, write_fd = os.pipe()
+        exporter.start()
+        try:
+            with os.fdopen(read_fd, 'rb') as reader:
+                target_cursor.copy_expert(import_query, reader)
+        finally:
+            exporter.join()
+        if exceptions:  # the export stopped halfway; don't upsert a partial table
+            raise exceptions[0]
+        count_of_rows = _upsert_from_staging_table(target_cursor, table, staging_table, columns, primary_keys,
+                                                   update_on_conflict)
+        target_connection.commit()
+    except (Exception, psycopg2.Error):
+        # leave both connections usable rather than in an aborted or open transaction
+        target_connection.rollback()
+        source_connection.rollback()
+        raise
+    source_connection.commit()  # close the read transaction opened by the export
+    if verbose:
+        print(f'replicated {table}:', count_of_rows, 'rows')
+    return count_of_rows
+
+
+def copy_dataframe_into_table(connection, a_df, table, columns, primary_keys, update_on_conflict=False,
+                              chunk_size=100000, verbose=True):
+    """
+    bulk load a pandas dataframe into a table with COPY, and upsert it by primary_keys
+
+    :param connection: psycopg2 connection
+    :param a_df: a pandas dataframe whose column names are the table's column names
+    :param table: str -> name of the table
+    :param columns: a list of str -> the columns to be loaded
+    :param primary_keys: a list of str -> the columns used to detect conflicting rows;
+                                        if None, rows that conflict with any unique constraint are skipped
+    :param update_on_conflict: boolean -> whether existing rows are overwritten (True) or kept as they are (False);
+                                        if True, a_df must not have duplicated primary_keys
+    :param chunk_size: int -> number of rows serialized at a time, which bounds the extra memory used
+    :param verbose: boolean -> whether to print outputs as the program runs
+    :return: int -> number of rows inserted or updated
+    """
+    staging_table = f'{table}_staging'
+    cursor = connection.cursor()
+    import_query = """COPY {} ({}) FROM STDIN WITH (FORMAT csv)""".format(staging_table, ', '.join(columns))
+    a_df = a_df[columns]
+    try:
+        query = """CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS)
+                    ON COMMIT DROP
+                    ;
+                    """.format(staging_table, table)
+        cursor.execute(query)
+        for start in range(0, len(a_df), chunk_size):
+            buffer = io.StringIO()
+            # missing values are written as unquoted empty fields, which COPY reads as NULL
+            a_df.iloc[start:start + chunk_size].to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert(import_query, buffer)
+        count_of_rows = _upsert_from_staging_table(cursor, table, staging_table, columns, primary_keys,
+                                                   update_on_conflict)
+    except (Exception, psycopg2.Error):
+        # leave the caller's connection usable rather than in an aborted transaction
+        connection.rollback()
+        raise
+    connection.commit()
+    if verbose:
+        print(f'loaded into {table}:', count_of_rows, 'rows')
+    return count_of_rows
+
+
+def replicate_reference_tables(tables=None, verbose=True):
+    """
+    copy every reference table listed in config.replication_config.ReferenceTableInfo
+    from its source database into each of its target databases
+
+    :param tables: a list of str -> the tables to replicate; replicate all reference tables if None
+    :param verbose: boolean -> whether to print outputs as the program runs
+    :return: None
+    """
+    if tables is None:
+        tables = ReferenceTableInfo.tables
+    for table in tables:
+        table_info = getattr(ReferenceTableInfo, table)
+        source_connection = psycopg2.connect(config_by_database[table_info['source']])
+        for target in table_info['targets']:
+            target_connection = psycopg2.connect(config_by_database[target])
+            copy_table_between_databases(source_connection, target_connection, table_info['table'],
+                                         table_info['columns'], table_info['primary_keys'], verbose=verbose)
+            target_connection.close()
+        source_connection.close()
+
+
+if __name__ == '__main__':
+    replicate_reference_tables()
@@ -0,0 +1,89 @@
+'''
+test_acs_feature_store.py
+
+test the ACSFeatureStore of acs_feature_store against a fake acs5 connection:
+    - a store is built from the long table and its features are read back by GEOID and by GEOID prefix
+    - unknown or non-numeric GEOIDs get NaN features
+    - a rebuild replaces the whole store, and leaves no temporary folder behind
+
+Dependencies:
+    - third-party packages: numpy, pandas, pytest (psycopg2 is imported by acs_feature_store)
+    - local packages: psql.acs_feature_store
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import os
+import numpy as np
+# third-party import
+import pytest
+
+pytest.importorskip('psycopg2')
+# local import
+from airbnb_disorder_analytics.psql.acs_feature_store import ACSFeatureStore
+
+
+class FakeCursor:
+    def __init__(self, csv):
+        self.csv = csv
+
+    def copy_expert(self, query, buffer):
+        buffer.write(self.csv)
+
+
+class FakeConnection:
+    """
+    stands in for a psycopg2 connection to acs5: every COPY returns the same csv
+    """
+    def __init__(self, rows):
+        """
+        :param rows: a list of (variable_id, geoid, estimate, margin_of_error)
+        """
+        self.csv = 'variable_id,geoid,estimate,margin_of_error\n' + ''.join(
+            f'{variable_id},{geoid},{estimate},{margin_of_error}\n'
+            for variable_id, geoid, estimate, margin_of_error in rows)
+
+    def cursor(self):
+        return FakeCursor(self.csv)
+
+    def commit(self):
+        pass
+
+
+def test_build_and_read(tmp_path):
+    store = ACSFeatureStore(str(tmp_path), 2018)
+    assert not store.is_built()
+    store.build(FakeConnection([('B01003_1', '36061000200', 30, 3), ('B01003_1', '36061000100', 10, 1),
+                                ('B19013_1', '36061000100', 20, 2), ('B01003_1', '36047000100', 50, 5)]),
+                verbose=False)
+    assert store.is_built()
+    assert list(store.get_rows(['36061000100', 36047000100, '36061000300', None, float('nan'), 'x'])) == \
+        [1, 0, -1, -1, -1, -1]
+    features = store.get_features(['36061000100', '36061000200', '36061000300'], ['B19013_1', 'B01003_1'])
+    np.testing.assert_array_equal(features, [[20, 10], [np.nan, 30], [np.nan, np.nan]])
+    margins = store.get_features(['36061000100'], ['B01003_1'], margins=True)
+    np.testing.assert_array_equal(margins, [[1]])
+    geoids, features = store.get_slice_by_prefix('36061')
+    assert list(geoids) == [36061000100, 36061000200]
+    np.testing.assert_array_equal(features[:, store.get_columns(['B01003_1'])[0]], [10, 30])
+    assert len(store.get_slice_by_prefix('06')[0]) == 0
+
+
+def test_rebuild(tmp_path):
+    store = ACSFeatureStore(str(tmp_path), 2018, 'block_group')
+    store.build(FakeConnection([('B01003_1', '360610001001', 10, 1)]), verbose=False)
+    store.build(FakeConnection([('B19013_1', '360610001002', 20, 2)]), verbose=False)
+    assert os.listdir(str(tmp_path)) == ['acs5_2018_block_group']
+    feature_df = store.to_dataframe(['360610001001', '360610001002'])
+    assert list(feature_df.columns) == ['B19013_1']
+    np.testing.assert_array_equal(feature_df['B19013_1'].values, [np.nan, 20])
+    with pytest.raises(KeyError):
+        store.get_columns(['B01003_1'])
+
+
+def test_empty_store(tmp_path):
+    store = ACSFeatureStore(str(tmp_path), 2018)
+    store.build(FakeConnection([]), verbose=False)
+    assert list(store.get_rows(['36061000100'])) == [-1]
+    assert store.get_features(['36061000100']).shape == (1, 0)
@@ -0,0 +1,84 @@
+'''
+test_downloader.py
+
+test the Downloader of build_acs_database against the local http server of the file_server fixture (conftest.py):
+    - a file is downloaded and matches its checksum
+    - a download that doesn't match its checksum is removed
+    - an interrupted download (a .part file) is resumed from the same url
+    - a .part file left by another url is discarded instead of being resumed
+build_acs_database needs psycopg2 and tqdm to be imported: the tests are skipped without them
+
+Dependencies:
+    - third-party packages: pytest, requests (psycopg2 and tqdm are imported by build_acs_database)
+    - local packages: psql.build_acs_database
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import os
+import hashlib
+# third-party import
+import pytest
+
+pytest.importorskip('psycopg2')
+pytest.importorskip('tqdm')
+# local import
+from airbnb_disorder_analytics.psql.build_acs_database import Downloader
+
+
+@pytest.fixture
+def download_folder(tmp_path):
+    folder = tmp_path / 'downloads'
+    folder.mkdir()
+    return str(folder)
+
+
+def test_downloader_without_database(file_server, download_folder):
+    assert Downloader(2018, 'NY', acs_base_url=file_server.base_url, data_folder=download_folder).connection is None
+
+
+def test_download_file(file_server, download_folder):
+    content = os.urandom(300000)
+    url = file_server.add_file('a.bin', content)
+    path = os.path.join(download_folder, 'a.bin')
+    assert Downloader.download_file(url, path, checksum=hashlib.sha256(content).hexdigest())
+    with open(path, 'rb') as file:
+        assert file.read() == content
+    assert not os.path.isfile(path + '.part') and not os.path.isfile(path + '.part.url')
+
+
+def test_checksum_mismatch(file_server, download_folder):
+    url = file_server.add_file('a.bin', os.urandom(300000))
+    path = os.path.join(download_folder, 'a.bin')
+    assert not Downloader.download_file(url, path, checksum='0' * 64)
+    assert not os.path.isfile(path) and not os.path.isfile(path + '.part')
+
+
+def test_resume_same_url(file_server, download_folder):
+    content = os.urandom(300000)
+    url = file_server.add_file('a.bin', content)
+    path = os.path.join(download_folder, 'a.bin')
+    with open(path + '.part', 'wb') as file:
+        file.write(content[:100000])
+    with open(path + '.part.url', 'w') as file:
+        file.write(url)
+    assert Downloader.download_file(url, path, checksum=hashlib.sha256(content).hexdigest())
+    assert file_server.range_starts == [100000]
+    with open(path, 'rb') as file:
+        assert file.read() == content
+
+
+def test_discard_part_of_another_url(file_server, download_folder):
+    content = os.urandom(300000)
+    url = file_server.add_file('a.bin', content)
+    other_url = file_server.add_file('b.bin', os.urandom(300000))
+    path = os.path.join(download_folder, 'a.bin')
+    with open(path + '.part', 'wb') as file:
+        file.write(b'\0' * 100000)
+    with open(path + '.part.url', 'w') as file:
+        file.write(other_url)
+    assert Downloader.download_file(url, path, checksum=hashlib.sha256(content).hexdigest())
+    assert file_server.range_starts == []
+    with open(path, 'rb') as file:
+        assert file.read() == content
@@ -0,0 +1,56 @@
+'''
+test_geolocation_batching.py
+
+test the helpers of geolocation_batching:
+    - listings are grouped by their rounded coordinates, and listings without coordinates are never grouped
+    - the RateLimiter spaces out the calls of all the threads together
+    - the RetryBudget is shared by all the threads and never goes below zero
+
+Dependencies:
+    - third-party packages: pytest
+    - local packages: psql.geolocation_batching
+
+ruilin chen
+10/19/2026
+'''
+# system import
+import time
+from multiprocessing.pool import ThreadPool
+# local import
+from airbnb_disorder_analytics.psql.geolocation_batching import RateLimiter, RetryBudget, \
+    group_properties_by_location
+
+
+def test_group_properties_by_location():
+    list_of_properties = [('a', -73.123451, 40.1), ('b', -73.123449, 40.1), ('c', -73.12346, 40.1),
+                          ('d', None, None), ('e', None, None)]
+    assert group_properties_by_location(list_of_properties) == [(-73.123451, 40.1, ['a', 'b']),
+                                                                (-73.12346, 40.1, ['c']),
+                                                                (None, None, ['d']),
+                                                                (None, None, ['e'])]
+    # with fewer decimal places, the three located listings share a location
+    assert group_properties_by_location(list_of_properties, precision=3)[0] == (-73.123451, 40.1, ['a', 'b', 'c'])
+    assert group_properties_by_location([]) == []
+
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(max_calls_per_second=50)
+    call_times = []
+
+    def call(_):
+        rate_limiter.wait()
+        call_times.append(time.time())
+
+    with ThreadPool(4) as pool:
+        pool.map(call, range(10))
+    call_times.sort()
+    # the first call goes through at once, then one call every 1/50 second
+    assert call_times[-1] - call_times[0] >= 9 / 50 - 0.01
+
+
+def test_retry_budget():
+    retry_budget = RetryBudget(max_retries=30)
+    with ThreadPool(4) as pool:
+        list_of_allowed = pool.map(lambda _: retry_budget.spend(), range(100))
+    assert sum(list_of_allowed) == 30
+    assert retry_budget.remaining_retries == 0
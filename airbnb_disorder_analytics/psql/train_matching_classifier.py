@@ -14,16 +14,20 @@ ruilin chen
 08/15/2020
 '''
 # system import
+import os
+import sys
+import time
 import numpy as np
-from tqdm import tqdm
-import pickle
-import random
+import pandas as pd
 # third-party import
 import psycopg2
 from scipy.spatial import cKDTree
 # local import
 from airbnb_disorder_analytics.config.db_config import DBInfo
 from airbnb_disorder_analytics.config.us_states import USStates
+from airbnb_disorder_analytics.psql.matching_features import get_feature_names, get_neighbor_features, \
+    sample_index_points
+from airbnb_disorder_analytics.psql.model_registry import save_model, load_model
 
 airbnb_connection = psycopg2.connect(DBInfo.airbnb_config)
 airbnb_cursor = airbnb_connection.cursor()
@@ -31,9 +35,13 @@ airbnb_cursor = airbnb_connection.cursor()
 crime_connection = psycopg2.connect(DBInfo.crime_config)
 crime_cursor = crime_connection.cursor()
 
+uss = USStates()
+
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import precision_score
+from sklearn.metrics import precision_score, precision_recall_curve
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 
 class NearestClassifier:
     def __init__(self, X, Y, k):
@@ -45,6 +53,7 @@ class NearestClassifier:
         self.valid_X = None
         self.valid_Y = None
         self.split_ratio = 0.75
+        self.metrics = {}
         self.clf = LogisticRegression(random_state=self.random_state)
 
     def train_classifier(self):
@@ -54,19 +63,139 @@ class NearestClassifier:
         predicted_Y = self.clf.predict(self.valid_X)
         precision_rate = precision_score(self.valid_Y, predicted_Y)
         print('precision rate:', precision_rate)
+        self.metrics = {'precision': float(precision_rate)}
         return precision_rate
 
-    def save_classifier(self, pkl_name):
-        with open(pkl_name, 'wb') as file:
-            pickle.dump(self.clf, file)
-        print('saved model to', pkl_name)
+    def register_classifier(self, state_abbr):
+        """
+        store the classifier, which takes the nearest distance only, as the newest version of the state's model
+        in psql.model_registry
+
+        :return: int -> the version of the stored model
+        """
+        return save_model(state_abbr, self.clf, 1, feature_spec=['dist_1'], metrics=self.metrics)
+
+    def load_registered_classifier(self, state_abbr, version=None):
+        """
+        :param version: int -> the version to load from psql.model_registry; the newest one if None
+        """
+        self.clf = load_model(state_abbr, version)['clf']
+
+class MultiNeighborClassifier(NearestClassifier):
+    """
+    matching classifier that uses the features of the k nearest geolocated points (see psql.matching_features)
+    and predicts a local match only when its probability reaches a threshold chosen on the validation set
+    """
+    def __init__(self, X, Y, k, nodes, census_tracts, target_precision=0.99, api_calls_per_second=10):
+        """
+        :param X: numpy array of shape (number_of_points, k + 2), from get_neighbor_features()
+        :param Y: numpy array -> 1 if the nearest geolocated point is in the same census tract, otherwise 0
+        :param k: int -> number of nearest neighbors the features are built from
+        :param nodes: numpy array of shape (number_of_points, 2) -> longitude and latitude of the points of X
+        :param census_tracts: numpy array -> census tract of the points of X
+        :param target_precision: float -> the threshold is the lowest one whose precision reaches this value
+        :param api_calls_per_second: float -> throughput of the census API, used to project the overall throughput
+        """
+        super().__init__(X, Y, k + 2)
+        self.k = k
+        self.nodes = np.asarray(nodes)
+        self.census_tracts = np.asarray(census_tracts)
+        self.valid_indices = None
+        self.target_precision = target_precision
+        self.api_calls_per_second = api_calls_per_second
+        self.threshold = None
+        self.metrics = {}
+        self.curve_df = None
+        # the distances are tiny (in degrees) compared to vote_share, so the features are standardized first
+        self.clf = make_pipeline(StandardScaler(), LogisticRegression(random_state=self.random_state, max_iter=1000))
+
+    def train_classifier(self):
+        """
+        fit the classifier, build the precision/recall/throughput curve on the validation set
+        and pick the threshold
+
+        :return: curve_df: a pandas dataframe with one row per candidate threshold
+        """
+        self.train_X, self.valid_X, self.train_Y, self.valid_Y, _, self.valid_indices = train_test_split(
+            self.all_X, self.all_Y, np.arange(len(self.all_Y)), test_size=self.split_ratio,
+            random_state=self.random_state)
+        self.clf.fit(X=self.train_X, y=self.train_Y)
+        probabilities = self.clf.predict_proba(self.valid_X)[:, 1]
+        local_points_per_second = self.time_local_matching()
+        precision, recall, thresholds = precision_recall_curve(self.valid_Y, probabilities)
+        self.curve_df = pd.DataFrame({'threshold': thresholds, 'precision': precision[:-1], 'recall': recall[:-1]})
+        # share of all the points that would be matched locally, i.e. the census API calls saved
+        sorted_probabilities = np.sort(probabilities)
+        self.curve_df['local_match_rate'] = 1 - np.searchsorted(sorted_probabilities, thresholds,
+                                                                side='left') / len(probabilities)
+        # points that aren't matched locally go to the census API
+        self.curve_df['projected_points_per_second'] = 1 / (
+                self.curve_df['local_match_rate'] / local_points_per_second
+                + (1 - self.curve_df['local_match_rate']) / self.api_calls_per_second)
+        qualified_df = self.curve_df[self.curve_df['precision'] >= self.target_precision]
+        if len(qualified_df):
+            best_row = qualified_df.loc[qualified_df['recall'].idxmax()]
+        else:  # the target can't be reached: use the most precise threshold
+            best_row = self.curve_df.loc[self.curve_df['precision'].idxmax()]
+        self.threshold = float(best_row['threshold'])
+        self.metrics = {key: float(best_row[key]) for key in ['threshold', 'precision', 'recall', 'local_match_rate',
+                                                              'projected_points_per_second']}
+        self.metrics['local_points_per_second'] = local_points_per_second
+        print('threshold: {threshold:.3f}\t precision: {precision:.3f}\t recall: {recall:.3f}'
+              '\t local match rate: {local_match_rate:.3f}'.format(**self.metrics))
+        return self.curve_df
+
+    def time_local_matching(self, sample_size=1000):
+        """
+        time local matching as CrimeDB.geolocate_point runs it, one validation point at a time:
+        the query of the k nearest geolocated points, the features and the prediction
+
+        :param sample_size: int -> number of validation points timed
+        :return: float -> points matched locally per second
+        """
+        tree = cKDTree(self.nodes)  # built once per state in production, so it isn't timed
+        sample_indices = self.valid_indices[:sample_size]
+        start_time = time.time()
+        for index in sample_indices:
+            # the point itself is in the tree: skip its first neighbor, as in training
+            nearest_dists, nearest_indices = tree.query(self.nodes[index], k=self.k + 1)
+            features = get_neighbor_features(nearest_dists[np.newaxis, 1:],
+                                             self.census_tracts[nearest_indices[np.newaxis, 1:]])
+            self.clf.predict_proba(features)
+        return len(sample_indices) / max(time.time() - start_time, 1e-9)
+
+    def register_classifier(self, state_abbr):
+        """
+        store the classifier together with what CrimeDB needs to apply it (k and the threshold)
+        as the newest version of the state's model in psql.model_registry
+
+        :return: int -> the version of the stored model
+        """
+        return save_model(state_abbr, self.clf, self.k, threshold=self.threshold,
+                          feature_spec=get_feature_names(self.k), metrics=self.metrics)
+
+
+def export_matching_threshold(state_abbr, model, thresholds_filename='matching_thresholds.csv'):
+    """
+    save the precision/recall/throughput curve of a state to matching_curve_{state_abbr}.csv and
+    its chosen threshold to a csv shared by all the states
+
+    :param state_abbr: str
+    :param model: a trained MultiNeighborClassifier
+    :param thresholds_filename: str
+    :return: None
+    """
+    model.curve_df.to_csv(f'matching_curve_{state_abbr}.csv', index=False)
+    threshold_df = pd.DataFrame([dict(state=state_abbr, k=model.k, **model.metrics)])
+    if os.path.isfile(thresholds_filename):
+        old_df = pd.read_csv(thresholds_filename)
+        threshold_df = pd.concat([old_df[old_df['state'] != state_abbr], threshold_df])
+    threshold_df.to_csv(thresholds_filename, index=False)
 
-    def load_classifer(self, pkl_name):
-        with open(pkl_name, 'rb') as file:
-            pickle_model = pickle.load(file)
-        self.clf = pickle_model
 
 def get_records_to_geolocate(state_id, year=None): # include geolocated records in both airbnb_data and crime_data
+    # the records are drawn as the local matching index of CrimeDB is, so that the classifier learns the neighbor
+    # distances of that index
     if year is None:
         query = """SELECT crime_incident.longitude, crime_incident.latitude, crime_incident.census_tract_id
                     FROM crime_incident, census_tracts
@@ -106,57 +235,60 @@ def get_records_to_geolocate(state_id, year=None): # include geolocated records
             """
     airbnb_cursor.execute(query, (state,))
     another_list_of_records = airbnb_cursor.fetchall()
-    full_list = list_of_records + another_list_of_records
-    return full_list
-
-def ckdnearest(all_nodes, target_node, k=3):
-    # k specifies the number of smallest values to return
-    btree = cKDTree(target_node)
-    dist, idx = btree.query(all_nodes, k=1)
-    dist = dist.flatten()
-    indices_of_min = np.argpartition(dist, k)[:k]
-    return indices_of_min, dist[indices_of_min]
-
-
-if __name__ == '__main__':
-    state_abbr = 'NY' # MA: 25; TX: 48, NY: 36, CA: 06, IL: 17, DC
-    uss = USStates()
-    state_id = uss.abbr_to_fips[state_abbr]
-    year_threshold = 2017
-
-    list_of_records = get_records_to_geolocate(state_id, year=year_threshold)
-    all_census_tracts = [a_record[2] for a_record in list_of_records]
-    all_nodes = [np.array([[a_record[0], a_record[1]]]) for a_record in list_of_records]
-
-    number_of_features = 1
-    list_of_nearest_dists = []
-    list_of_matched_flag = []
-
-    batch_size = 10000
-    for index, a_record in tqdm(enumerate(list_of_records), total=batch_size):
-        target_node = np.array([[a_record[0], a_record[1]]])
-        #source_nodes = all_nodes[:index] + all_nodes[index+1:]
-        target_census_tract = a_record[2]
-        nearest_node_indices, nearest_dists = ckdnearest(all_nodes[:index] + all_nodes[index+1:],
-                                                     target_node, k=number_of_features)
-        nearest_census_tract_index = nearest_node_indices[0] + int(nearest_node_indices[0] >= index)
-        nearest_census_tract = all_census_tracts[nearest_census_tract_index]
-        list_of_nearest_dists.append(nearest_dists)
-        list_of_matched_flag.append(int(nearest_census_tract == target_census_tract))
-        if index > batch_size:
-            break
-
-    # change class_weight to penalize false_positive
-    model = NearestClassifier(X=list_of_nearest_dists, Y=list_of_matched_flag, k=number_of_features)
-    model.train_classifier()
-    model.save_classifier(f'matching_classifier_{state_abbr}.pkl')
-    print('saved model to classifier')
+    return sample_index_points(list_of_records, another_list_of_records)
 
+def get_leave_one_out_neighbors(all_nodes, k=1):
+    """
+    for every node, find its k nearest neighbors among all the other nodes.
+    a single tree is built over all the nodes and queried for k+1 neighbors of every node at once,
+    then each node is removed from its own list of neighbors.
 
+    :param all_nodes: numpy array of shape (number_of_nodes, 2) -> longitude, latitude
+    :param k: int -> number of neighbors to return
+    :return: nearest_dists, nearest_indices: numpy arrays of shape (number_of_nodes, k),
+                sorted from the nearest to the farthest neighbor
+    """
+    btree = cKDTree(all_nodes)
+    nearest_dists, nearest_indices = btree.query(all_nodes, k=k + 1)
+    is_self = nearest_indices == np.arange(len(all_nodes))[:, np.newaxis]
+    # with duplicated coordinates a node is not always its own first neighbor, and with more than k+1
+    # duplicates it may not be among the neighbors at all; in that case drop the farthest neighbor instead
+    is_self[~is_self.any(axis=1), -1] = True
+    nearest_dists = nearest_dists[~is_self].reshape(-1, k)
+    nearest_indices = nearest_indices[~is_self].reshape(-1, k)
+    return nearest_dists, nearest_indices
 
 
+def train_state(state_abbr, year_threshold=2017, number_of_neighbors=5):
+    """
+    train the matching classifier of a state, register it in psql.model_registry and export its threshold
 
+    :param state_abbr: str
+    :param year_threshold: int -> only the crime incidents of this year and later are used
+    :param number_of_neighbors: int -> k
+    :return: int -> the version of the registered model
+    """
+    state_id = uss.abbr_to_fips[state_abbr]
+    list_of_records = get_records_to_geolocate(state_id, year=year_threshold)
+    all_census_tracts = np.array([a_record[2] for a_record in list_of_records])
+    all_nodes = np.array([[a_record[0], a_record[1]] for a_record in list_of_records])
 
+    # features: derived from the nearest geolocated points other than the record itself
+    # label: whether the nearest of them is in the same census tract as the record
+    nearest_dists, nearest_indices = get_leave_one_out_neighbors(all_nodes, k=number_of_neighbors)
+    features = get_neighbor_features(nearest_dists, all_census_tracts[nearest_indices])
+    list_of_matched_flag = (all_census_tracts[nearest_indices[:, 0]] == all_census_tracts).astype(int)
+    print(state_abbr, 'generated features for', len(list_of_records), 'records')
 
+    model = MultiNeighborClassifier(X=features, Y=list_of_matched_flag, k=number_of_neighbors, nodes=all_nodes,
+                                    census_tracts=all_census_tracts)
+    model.train_classifier()
+    version = model.register_classifier(state_abbr)
+    export_matching_threshold(state_abbr, model)
+    return version
 
 
+if __name__ == '__main__':
+    # e.g. python train_matching_classifier.py NY CA; all the states geolocated by CrimeDB if none is given
+    for state_abbr in sys.argv[1:] or ['NY', 'CA', 'IL', 'MA', 'TX', 'DC']:
+        train_state(state_abbr)